@@ -0,0 +1,141 @@
+import os #Used for the cpu count and paths
+import json #Results are written as json lines
+import time #Used to measure the throughput
+import argparse #Command line options
+import multiprocessing #Process pool for the workers
+import contextlib #Used to silence the loading messages of the workers
+import io #In memory stream the loading messages are written to
+import LoadData
+import Similarity
+import MatrixFactorization
+import SimilarityCache
+
+#Batch recommendations for many users
+#The users are spread over a pool of worker processes. Every worker opens the dataset from the memory mapped binary cache (LoadData.loadCache),
+#so the rating data is shared between the workers through the page cache instead of being pickled to every one of them.
+#The float/indicator matrices of the batched engine (about 12MB for MovieLens 100k) are built once and memory mapped the same way
+#(Similarity.shareUserKernels). What every worker still builds itself is mostly the User objects, about 5MB of private memory per worker
+#for MovieLens 100k in the genre mode (15MB before the matrices were shared). The users who watched every movie are only built when movies
+#are compared by their watchers.
+#Results are written to a json lines file as soon as a worker finishes a user.
+
+_worker = dict() #Data of the current worker process, filled by _initWorker
+KERNEL_CACHE_DIR = "kernels" #Folder of the batched engine matrices, inside the cache folder of LoadData
+
+def _shareKernels(path, ratingMatrix):
+    '''Open the batched engine matrices of that dataset memory mapped, they are written first if missing or outdated'''
+    Similarity.shareUserKernels(ratingMatrix, os.path.join(path, "cache", KERNEL_CACHE_DIR), [os.path.join(path, "u.data")])
+
+def _initWorker(path, simFunction, compareMovieGenres, amount, custom, factorModelPath, cacheName):
+    '''Load the data once per worker process, from the memory mapped cache'''
+    factorOnly = not custom and simFunction == Similarity.MATRIX_FACTORIZATION #Neither the batched engine nor the movie comparisons are used
+    usersWatched = custom or not (compareMovieGenres or factorOnly) #Only needed to compare movies by their watchers
+    with contextlib.redirect_stdout(io.StringIO()): #Every worker would print the loading messages otherwise
+        userList, movieList, ratingMatrix = LoadData.loadData(path=path, useCache=True, returnMatrix=True, usersWatched=usersWatched)
+    if not factorOnly:
+        _shareKernels(path, ratingMatrix)
+    _worker["userList"] = userList
+    _worker["movieList"] = movieList
+    _worker["users"] = {user.getID(): user for user in userList}
+    _worker["ratingMatrix"] = ratingMatrix
+    _worker["factorModel"] = MatrixFactorization.loadFactorModel(factorModelPath) if factorModelPath else None
+    _worker["movieCache"] = SimilarityCache.MovieSimilarityCache(movieList, sharedName=cacheName) if cacheName else None #Tables shared by all workers
+    _worker["settings"] = (simFunction, compareMovieGenres, amount, custom)
+
+def _recommendUser(userID):
+    '''Compute the recommendations for one user in a worker, returns a dict that is written as one json line'''
+    simFunction, compareMovieGenres, amount, custom = _worker["settings"]
+    target = _worker["users"].get(str(userID))
+    if target == None:
+        return {"user": str(userID), "error": "unknown user"}
+    start = time.perf_counter()
+    try:
+        if custom:
+            rec = Similarity.customSimilarity(target, _worker["userList"], _worker["movieList"], amount, False, _worker["ratingMatrix"],
+                                              movieCache=_worker["movieCache"])
+        else:
+            rec = Similarity.recommendMovies(target, _worker["userList"], _worker["movieList"], amount, simFunction, compareMovieGenres, False, _worker["ratingMatrix"],
+                                            factorModel=_worker["factorModel"], movieCache=_worker["movieCache"])
+    except Exception as e: #One broken user should not stop the whole batch
+        return {"user": str(userID), "error": repr(e)}
+    return {"user": str(userID), "seconds": time.perf_counter() - start,
+            "recommendations": [{"movie": name, "score": float(score), "averageRating": float(rating)} for name, score, rating in rec]}
+
+def allUserIDs(path = LoadData.DATA_DIR):
+    '''Return the IDs of all users in the dataset'''
+    return [str(userID) for userID in LoadData.loadRatingMatrix(path, useCache=True).getUserIDs().tolist()]
+
+def recommendBatch(userIDs = "all", simFunction = 0, compareMovieGenres = True, outputPath = "recommendations.jsonl", workers = None,
+                   amount = 20, custom = False, path = LoadData.DATA_DIR, chunkSize = 4, factorModelPath = None, similarityCache = False):
+    '''Compute the recommendations for a list of user IDs (or "all") with a pool of worker processes and stream them to outputPath.
+    SimFunction values are the same as for Similarity.recommendMovies, custom = True uses Similarity.customSimilarity instead.
+    factorModelPath = .npz file of MatrixFactorization.FactorModel.save, needed for simFunction 6
+    similarityCache = True ... The workers share one SimilarityCache.MovieSimilarityCache in shared memory, so a movie pair is only computed once
+    Returns (users done, seconds, users per second)'''
+    LoadData.loadCache(path) #Build the cache once up front, so the workers only open it
+    if custom or not simFunction == Similarity.MATRIX_FACTORIZATION:
+        _shareKernels(path, LoadData.loadRatingMatrix(path, useCache=True)) #Same for the batched engine matrices
+    if userIDs == "all":
+        userIDs = allUserIDs(path)
+    workers = workers or os.cpu_count() or 1
+
+    cache = None
+    cacheName = None
+    if similarityCache: #Created here, so the shared tables live as long as the batch and are removed afterwards
+        cacheName = "recsys_" + str(os.getpid()) + "_" + str(time.monotonic_ns())
+        cache = SimilarityCache.MovieSimilarityCache(LoadData.loadMovies(path, useCache=True), sharedName=cacheName)
+        cache.prepare(2 if custom else simFunction, False if custom else compareMovieGenres) #customSimilarity uses Pearson on the co-watchers
+
+    start = time.perf_counter()
+    done = 0
+    try:
+        with multiprocessing.Pool(workers, initializer=_initWorker, initargs=(path, simFunction, compareMovieGenres, amount, custom, factorModelPath, cacheName)) as pool:
+            with open(outputPath, 'w') as f:
+                for result in pool.imap_unordered(_recommendUser, userIDs, chunksize=chunkSize): #Results arrive in the order the workers finish
+                    f.write(json.dumps(result) + '\n')
+                    done += 1
+    finally:
+        if not cache == None:
+            cache.close()
+    seconds = time.perf_counter() - start
+    return (done, seconds, done / seconds if seconds > 0 else 0)
+
+def measureScaling(userIDs, workerCounts, **settings):
+    '''Run the same batch with different amounts of workers and report the throughput of each'''
+    results = list()
+    for workers in workerCounts:
+        done, seconds, rate = recommendBatch(userIDs, workers=workers, outputPath=os.devnull, **settings)
+        print("Workers: " + str(workers) + ", users: " + str(done) + ", " + format(seconds, ".2f") + "s, " + format(rate, ".2f") + " users/s")
+        results.append((workers, done, seconds, rate))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute recommendations for many users in parallel")
+    parser.add_argument("users", nargs="*", default=["all"], help='user IDs or "all" (default)')
+    parser.add_argument("--sim-function", type=int, default=0, help="0 Euclidean, 1 Cosine, 2 Pearson, 3 Jaccard, 4 Manhatten, 6 Matrix factorization")
+    parser.add_argument("--factor-model", default=None, help="model file of MatrixFactorization.py --output, for --sim-function 6")
+    parser.add_argument("--similarity-cache", action="store_true", help="share computed movie pairs between the workers")
+    parser.add_argument("--custom", action="store_true", help="use customSimilarity instead of recommendMovies")
+    parser.add_argument("--compare-users-watched", action="store_true", help="compare movies by the users who watched them instead of their genres")
+    parser.add_argument("--amount", type=int, default=20, help="recommendations per user")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument("--output", default="recommendations.jsonl", help="json lines output file")
+    parser.add_argument("--data", default=LoadData.DATA_DIR, help="folder with u.item and u.data")
+    parser.add_argument("--scaling", action="store_true", help="measure the throughput for 1, 2, 4, ... workers instead of writing results")
+    args = parser.parse_args()
+
+    userIDs = "all" if args.users == ["all"] else args.users
+    settings = {"simFunction": args.sim_function, "compareMovieGenres": not args.compare_users_watched, "amount": args.amount,
+                "custom": args.custom, "path": args.data, "factorModelPath": args.factor_model,
+                "similarityCache": args.similarity_cache}
+    if args.scaling:
+        counts = [1]
+        while counts[-1] * 2 <= (args.workers or os.cpu_count() or 1):
+            counts.append(counts[-1] * 2)
+        measureScaling(allUserIDs(args.data) if userIDs == "all" else userIDs, counts, **settings)
+    else:
+        done, seconds, rate = recommendBatch(userIDs, outputPath=args.output, workers=args.workers, **settings)
+        print("Recommended for " + str(done) + " users in " + format(seconds, ".2f") + "s (" + format(rate, ".2f") + " users/s), written to " + args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import os #Used for the cache paths
+import json #The manifest is stored as json
+import hashlib #Used to hash the source files
+import numpy as np #The cached arrays are .npy files
+
+#Binary cache for parsed data
+#Arrays are stored as one .npy file each, next to a manifest with the modification time, size and hash of the source files they were parsed from.
+#Reading opens the arrays with memory mapping, so nothing is copied or parsed and several processes share the same pages.
+
+MANIFEST_NAME = "manifest.json" #Name of the manifest file in the cache folder
+CACHE_VERSION = 1 #Increase when the layout of the cached arrays changes
+
+def fileHash(path):
+    '''Return the sha1 hash of a file'''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''): #Read in 1MB blocks
+            h.update(block)
+    return h.hexdigest()
+
+def sourceSignature(paths):
+    '''Return the modification time, size and hash of all source files, used to check if a cache is still valid'''
+    signature = dict()
+    for path in paths:
+        stat = os.stat(path)
+        signature[os.path.basename(path)] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "sha1": fileHash(path)}
+    return signature
+
+def _sourcesUnchanged(manifest, paths):
+    '''Check the sources against the manifest. An unchanged mtime and size is trusted, otherwise the hash decides.
+    The mtime of a source that was only touched is updated in the manifest (returns (unchanged, touched))'''
+    sources = manifest.get("sources", dict())
+    if not len(sources) == len(paths):
+        return (False, False)
+    touched = False
+    for path in paths:
+        entry = sources.get(os.path.basename(path))
+        if entry == None or not os.path.exists(path):
+            return (False, False)
+        stat = os.stat(path)
+        if not stat.st_size == entry["size"]: #Different size, the content changed for sure
+            return (False, False)
+        if not stat.st_mtime_ns == entry["mtime"]:
+            if not fileHash(path) == entry["sha1"]: #Touched and the content changed
+                return (False, False)
+            entry["mtime"] = stat.st_mtime_ns #Same content, so the next check can trust the mtime again
+            touched = True
+    return (True, touched)
+
+def _writeManifest(cacheDir, manifest):
+    '''Write the manifest atomically'''
+    temp = os.path.join(cacheDir, MANIFEST_NAME + ".tmp")
+    with open(temp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp, os.path.join(cacheDir, MANIFEST_NAME))
+
+def signatureMatches(signature, paths):
+    '''Check if the source files still match a signature of sourceSignature, stored somewhere else than a cache manifest'''
+    return _sourcesUnchanged({"sources": signature}, paths)[0]
+
+def readCache(cacheDir, paths, names):
+    '''Open the cached arrays "names" memory mapped, returns a dict of arrays or None if the cache is missing or outdated'''
+    try:
+        with open(os.path.join(cacheDir, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError): #No cache yet or a broken manifest
+        return None
+    if not manifest.get("version") == CACHE_VERSION:
+        return None
+    unchanged, touched = _sourcesUnchanged(manifest, paths)
+    if not unchanged:
+        return None
+    if touched: #Only the mtimes changed, store them so later loads don't hash the sources again
+        try:
+            _writeManifest(cacheDir, manifest)
+        except OSError: #A read only cache is still valid, it is just hashed every time
+            pass
+    arrays = dict()
+    for name in names:
+        if not name in manifest.get("arrays", list()):
+            return None
+        try:
+            arrays[name] = np.load(os.path.join(cacheDir, name + ".npy"), mmap_mode='r') #Zero-copy, the pages are loaded on first access
+        except (OSError, ValueError):
+            return None
+    return arrays
+
+def createArray(cacheDir, name, shape, dtype):
+    '''Create a writable memory mapped array in the cache folder, for arrays that are filled piece by piece.
+    It only becomes part of the cache once publish is called'''
+    os.makedirs(cacheDir, exist_ok=True)
+    return np.lib.format.open_memmap(os.path.join(cacheDir, name + ".tmp.npy"), mode='w+', dtype=dtype, shape=shape)
+
+def writeArray(cacheDir, name, array):
+    '''Write an array to the cache folder, it only becomes part of the cache once publish is called'''
+    os.makedirs(cacheDir, exist_ok=True)
+    np.save(os.path.join(cacheDir, name + ".tmp.npy"), np.ascontiguousarray(array))
+
+def publish(cacheDir, signature, names):
+    '''Move the written arrays "names" into place and write the manifest with the signature of the source files (see sourceSignature)'''
+    for name in names:
+        os.replace(os.path.join(cacheDir, name + ".tmp.npy"), os.path.join(cacheDir, name + ".npy")) #Atomic, readers never see half written files
+    _writeManifest(cacheDir, {"version": CACHE_VERSION, "sources": signature, "arrays": sorted(names)}) #Written last, so it only exists once all arrays do
+
+def writeCache(cacheDir, signature, arrays):
+    '''Write the arrays (dict name -> array) to the cache folder, together with the signature of the source files (see sourceSignature).
+    Take the signature before the sources are read, so a source that changes while the arrays are computed invalidates the cache'''
+    for name, array in arrays.items():
+        writeArray(cacheDir, name, array)
+    publish(cacheDir, signature, list(arrays))
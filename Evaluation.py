@@ -0,0 +1,252 @@
+import os #Used for the fold folders and the cpu count
+import io #In memory stream the loading messages are written to
+import json #Results are written as json
+import math #log2 for the NDCG
+import time #Latency of every request
+import random #Picks the evaluated users
+import shutil #Copies u.item into the folds
+import argparse #Command line options
+import contextlib #Used to silence the loading messages
+import tracemalloc #Peak memory of a request
+import multiprocessing #Process pool, one task per fold and mode
+import numpy as np #Splitting the ratings
+import LoadData
+import Similarity
+import MovieStats
+import SimilarityCache
+import MatrixFactorization
+
+#Offline evaluation of the recommendation modes
+#u.data is split into folds like the u1-u5 files of MovieLens: every fold holds out a different 20% of the ratings as test set and keeps
+#the other 80% as training data. The split is done per user, so every user keeps most of their ratings in every training set.
+#Every fold is a folder with its own u.item, u.data (training ratings) and u.test, so the normal loaders and caches work on it.
+#Every (fold, mode) pair is one task for a pool of worker processes. A task recommends movies for the test users from the training data
+#and scores them against the movies the user rated with RELEVANT_RATING or more in the test set: precision@K, recall@K, NDCG@K and the
+#catalog coverage, next to the latency of the requests and the peak memory of one request.
+
+DEFAULT_FOLDS = 5 #Like u1-u5
+DEFAULT_K = 10 #Length of the recommendation lists
+DEFAULT_USERS = 50 #Evaluated users per fold, 0 for all test users
+RELEVANT_RATING = 4 #Test ratings from this value on count as relevant
+FOLD_DIR = "folds" #Folder of the folds inside the dataset folder
+FOLD_MANIFEST = "folds.json" #Number of folds and seed the folds were built with, inside the fold folder
+
+_worker = dict() #Data of the folds the current worker process has loaded, filled by _foldData
+
+def buildFolds(path = LoadData.DATA_DIR, folds = DEFAULT_FOLDS, seed = 0, rebuild = False):
+    '''Split u.data into folds, returns the list of fold folders (path/folds/u1, u2, ...). Existing folds are reused if they were built with
+    the same folds and seed, unless rebuild is True.
+    The ratings of every user are shuffled and dealt to the folds in turn, fold i tests on its share and trains on the rest'''
+    root = os.path.join(path, FOLD_DIR)
+    folders = [os.path.join(root, "u" + str(i + 1)) for i in range(folds)]
+    settings = {"folds": folds, "seed": seed}
+    try:
+        with open(os.path.join(root, FOLD_MANIFEST), 'r') as f:
+            built = json.load(f)
+    except (OSError, ValueError): #No folds yet or a broken manifest
+        built = None
+    if not rebuild and built == settings and all(os.path.exists(os.path.join(folder, "u.test")) for folder in folders):
+        return folders
+    if not built == None:
+        os.remove(os.path.join(root, FOLD_MANIFEST)) #Removed until all folds are written again
+    data = LoadData._readRatingFile(path)
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(data)), data[:, 0])) #Grouped by user, random order inside every user
+    rank = np.empty(len(data), dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, np.diff(data[order, 0]) != 0]) #First rating of every user in order
+    counts = np.diff(np.r_[starts, len(data)])
+    rank[order] = np.arange(len(data)) - np.repeat(starts, counts) #Position of every rating inside its user
+    fold = (rank + np.repeat(rng.integers(0, folds, len(starts)), counts)[np.argsort(order)]) % folds #Random first fold per user, then in turn
+    for i, folder in enumerate(folders):
+        os.makedirs(folder, exist_ok=True)
+        shutil.copyfile(os.path.join(path, "u.item"), os.path.join(folder, "u.item"))
+        np.savetxt(os.path.join(folder, "u.data"), data[fold != i], fmt="%d", delimiter="\t") #Training ratings, in file order
+        np.savetxt(os.path.join(folder, "u.test"), data[fold == i], fmt="%d", delimiter="\t")
+    with open(os.path.join(root, FOLD_MANIFEST), 'w') as f: #Written last, so folds that were only partly written are built again
+        json.dump(settings, f)
+    return folders
+
+def allModes(factorization = True):
+    '''All recommendation modes as (kind, simFunction, compareMovieGenres) tuples'''
+    modes = [("recommendMovies", simFunction, compareMovieGenres) for compareMovieGenres in (True, False) for simFunction in range(5)]
+    modes.append(("customSimilarity", Similarity.CUSTOM_SIMILARITY, False))
+    if factorization:
+        modes.append(("factorization", Similarity.MATRIX_FACTORIZATION, False))
+    modes.append(("popularity", None, None)) #Baseline, the most rated movies the user hasn't seen
+    return modes
+
+def modeName(mode):
+    '''Readable name of a mode'''
+    kind, simFunction, compareMovieGenres = mode
+    if kind == "recommendMovies":
+        return kind + "[f=" + str(simFunction) + ", " + ("genre" if compareMovieGenres else "watchers") + "]"
+    return kind
+
+def rankingMetrics(recommended, relevant, k = DEFAULT_K):
+    '''Precision@K, recall@K and NDCG@K of a recommendation list (best first) against a set of relevant items'''
+    hits = [1 if item in relevant else 0 for item in recommended[:k]]
+    if not relevant:
+        return (0.0, 0.0, 0.0)
+    dcg = sum(hit / math.log2(i + 2) for i, hit in enumerate(hits))
+    idcg = sum(1 / math.log2(i + 2) for i in range(min(len(relevant), k))) #All relevant items on top
+    return (sum(hits) / k, sum(hits) / len(relevant), dcg / idcg)
+
+def _readTest(folder, movieList):
+    '''Relevant movie names of every user in the test set of a fold'''
+    data = np.loadtxt(os.path.join(folder, "u.test"), dtype=np.int64, delimiter='\t', ndmin=2)
+    relevant = dict()
+    for userID, movieID, rating in data[:, :3].tolist():
+        if rating >= RELEVANT_RATING and 0 < movieID <= len(movieList):
+            relevant.setdefault(str(userID), set()).add(movieList[movieID - 1].getName()) #The recommenders return names
+    return relevant
+
+def _foldData(folder):
+    '''Load a fold once per worker process'''
+    if not folder in _worker:
+        with contextlib.redirect_stdout(io.StringIO()):
+            userList, movieList, ratingMatrix = LoadData.loadData(path=folder, useCache=True, returnMatrix=True)
+        _worker[folder] = {"userList": userList, "movieList": movieList, "users": {user.getID(): user for user in userList},
+                           "ratingMatrix": ratingMatrix, "relevant": _readTest(folder, movieList),
+                           "movieStats": MovieStats.loadMovieStats(folder, useCache=True), "movieCache": SimilarityCache.MovieSimilarityCache(movieList)}
+    return _worker[folder]
+
+def _recommend(mode, target, data, k):
+    '''Recommendation names of one mode for one user'''
+    kind, simFunction, compareMovieGenres = mode
+    if kind == "popularity":
+        seenIDs = {movie.getID() for movie in target.getWatchedMovies()}
+        return [data["movieList"][movieID - 1].getName() for movieID in data["movieStats"].mostPopular(k, seenIDs)]
+    if kind == "customSimilarity":
+        rec = Similarity.customSimilarity(target, data["userList"], data["movieList"], k, False, data["ratingMatrix"], movieStats=data["movieStats"],
+                                           movieCache=data["movieCache"])
+    elif kind == "factorization":
+        if not "factorModel" in data: #Trained once per fold and worker, on all training ratings
+            data["factorModel"] = MatrixFactorization.trainALS(data["ratingMatrix"], testShare=0, verbose=False)
+        rec = Similarity.recommendMovies(target, data["userList"], data["movieList"], k, simFunction, movieStats=data["movieStats"], factorModel=data["factorModel"])
+    else:
+        rec = Similarity.recommendMovies(target, data["userList"], data["movieList"], k, simFunction, compareMovieGenres, False, data["ratingMatrix"],
+                                         movieStats=data["movieStats"], movieCache=data["movieCache"])
+    return [name for name, score, rating in rec]
+
+def _targetUsers(data, users, seed):
+    '''The evaluated users of a fold: test users with at least one relevant movie, a random sample of "users" of them (0 = all)'''
+    userIDs = sorted((ID for ID in data["relevant"] if ID in data["users"]), key = int)
+    if users and users < len(userIDs):
+        userIDs = sorted(random.Random(seed).sample(userIDs, users), key = int)
+    return userIDs
+
+def _evaluateTask(task):
+    '''Evaluate one mode on one fold in a worker, returns a dict with the metrics, latencies and memory'''
+    fold, folder, mode, k, users, seed = task
+    data = _foldData(folder)
+    userIDs = _targetUsers(data, users, seed + fold)
+    if mode[0] == "factorization" and userIDs:
+        _recommend(mode, data["users"][userIDs[0]], data, k) #Train outside the timed requests
+    latencies = list()
+    precision, recall, ndcg = list(), list(), list()
+    recommended = set()
+    errors = 0
+    for userID in userIDs:
+        target = data["users"][userID]
+        start = time.perf_counter()
+        try:
+            names = _recommend(mode, target, data, k)
+        except Exception: #A failing request counts as an empty list
+            names = list()
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        recommended.update(names)
+        scores = rankingMetrics(names, data["relevant"][userID], k)
+        precision.append(scores[0])
+        recall.append(scores[1])
+        ndcg.append(scores[2])
+    peakMemory = None
+    if userIDs: #Peak memory of one request, measured separately because tracemalloc slows everything down
+        tracemalloc.start()
+        try:
+            _recommend(mode, data["users"][userIDs[0]], data, k)
+        except Exception:
+            pass
+        peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    ms = np.array(latencies) * 1000
+    return {"fold": fold + 1, "mode": modeName(mode), "users": len(userIDs), "errors": errors,
+            "precision": float(np.mean(precision)) if precision else 0.0, "recall": float(np.mean(recall)) if recall else 0.0,
+            "ndcg": float(np.mean(ndcg)) if ndcg else 0.0, "coverage": len(recommended) / len(data["movieList"]),
+            "meanMs": float(ms.mean()) if len(ms) else 0.0, "p50Ms": float(np.percentile(ms, 50)) if len(ms) else 0.0,
+            "p95Ms": float(np.percentile(ms, 95)) if len(ms) else 0.0, "peakMemoryBytes": peakMemory}
+
+def evaluate(path = LoadData.DATA_DIR, folds = DEFAULT_FOLDS, modes = None, k = DEFAULT_K, users = DEFAULT_USERS, workers = None, seed = 0, verbose = True):
+    '''Evaluate every mode on every fold with a pool of worker processes.
+    Returns (list of per fold results, list of per mode summaries sorted by NDCG)'''
+    modes = modes or allModes()
+    folders = buildFolds(path, folds, seed)
+    for folder in folders: #Build the caches once up front, so the workers only open them
+        LoadData.loadCache(folder)
+        MovieStats.loadMovieStats(folder, useCache=True)
+    tasks = [(fold, folder, mode, k, users, seed) for mode in modes for fold, folder in enumerate(folders)]
+    results = list()
+    workers = workers or os.cpu_count() or 1
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(_evaluateTask, tasks): #Results arrive in the order the workers finish
+            results.append(result)
+            if verbose:
+                print("fold " + str(result["fold"]) + " " + result["mode"].ljust(32) + " NDCG " + format(result["ndcg"], ".4f")
+                      + ", " + format(result["meanMs"], ".1f") + " ms/request")
+    results.sort(key = lambda x: ([modeName(mode) for mode in modes].index(x["mode"]), x["fold"]))
+    return (results, summarize(results))
+
+def summarize(results):
+    '''Average the per fold results of every mode, sorted by NDCG (best first)'''
+    byMode = dict()
+    for result in results:
+        byMode.setdefault(result["mode"], list()).append(result)
+    summaries = list()
+    for mode, rows in byMode.items():
+        summary = {"mode": mode, "folds": len(rows), "users": sum(row["users"] for row in rows), "errors": sum(row["errors"] for row in rows)}
+        for metric in ("precision", "recall", "ndcg", "coverage", "meanMs", "p95Ms"):
+            summary[metric] = float(np.mean([row[metric] for row in rows]))
+        summary["ndcgStd"] = float(np.std([row["ndcg"] for row in rows]))
+        memory = [row["peakMemoryBytes"] for row in rows if not row["peakMemoryBytes"] == None]
+        summary["peakMemoryBytes"] = max(memory) if memory else None
+        summaries.append(summary)
+    summaries.sort(key = lambda x: -x["ndcg"])
+    return summaries
+
+def report(summaries, k = DEFAULT_K):
+    '''Print the summaries as a table'''
+    print("mode".ljust(32) + ("P@" + str(k)).rjust(8) + ("R@" + str(k)).rjust(8) + "NDCG".rjust(8) + "+-".rjust(7) + "cover".rjust(8)
+          + "ms/req".rjust(9) + "p95 ms".rjust(9) + "peak MB".rjust(9) + "errors".rjust(8))
+    for s in summaries:
+        memory = format(s["peakMemoryBytes"] / 1e6, ".2f") if not s["peakMemoryBytes"] == None else "-"
+        print(s["mode"].ljust(32) + format(s["precision"], ".4f").rjust(8) + format(s["recall"], ".4f").rjust(8) + format(s["ndcg"], ".4f").rjust(8)
+              + format(s["ndcgStd"], ".3f").rjust(7) + format(s["coverage"], ".3f").rjust(8) + format(s["meanMs"], ".1f").rjust(9)
+              + format(s["p95Ms"], ".1f").rjust(9) + memory.rjust(9) + str(s["errors"]).rjust(8))
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross validate all recommendation modes on folds of u.data")
+    parser.add_argument("--folds", type=int, default=DEFAULT_FOLDS, help="number of folds (u1, u2, ...)")
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="length of the recommendation lists")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS, help="evaluated users per fold, 0 for all")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument("--modes", nargs="*", default=None, help="only the modes whose name contains one of these texts")
+    parser.add_argument("--no-factorization", action="store_true", help="skip the matrix factorization mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data", default=LoadData.DATA_DIR, help="folder with u.item and u.data")
+    parser.add_argument("--rebuild-folds", action="store_true", help="split u.data again even if the folds exist")
+    parser.add_argument("--output", default=None, help="also write the results to this json file")
+    args = parser.parse_args()
+
+    modes = allModes(not args.no_factorization)
+    if args.modes:
+        modes = [mode for mode in modes if any(text in modeName(mode) for text in args.modes)]
+    if args.rebuild_folds:
+        buildFolds(args.data, args.folds, args.seed, rebuild=True)
+    results, summaries = evaluate(args.data, args.folds, modes, args.k, args.users, args.workers, args.seed)
+    report(summaries, args.k)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"settings": vars(args), "folds": results, "modes": summaries}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import sys #Used to read the command line arguments
+import time #Used to measure the update latency
+import random #Random events for the replay in main
+import collections #OrderedDict for the LRU caches, deque for the latencies
+import numpy as np #Posting lists, running sums and pair statistics
+import LoadData
+import Similarity
+
+#Incremental rating updates
+#A LiveRatings object keeps the user and movie lists of loadData current under a stream of single (user, movie, rating) events,
+#instead of loading everything again. Every event only touches the rated movie and the user who rated it:
+#the users rating arrays, the posting list and running average of the movie, and the cached similarity rows those two are part of.
+#User-user rows hold the statistics over the co-rated movies of one target user and every other user (the same sums the batched engine in
+#Similarity computes), movie-movie rows hold the number of common watchers of one movie and every other movie. Both are plain sums,
+#so an event adds the difference between the new and the old contribution instead of recomputing the row.
+
+MAX_RATING = 5 #Ratings go from 1 to MAX_RATING
+STAT_ROWS = 7 + 2 * MAX_RATING #n, Sa, Sb, Saa, Sbb, Sab, Smin, then one row per rating value for the target and for the other user
+DEFAULT_CACHED_USERS = 64 #User-user rows kept in memory
+DEFAULT_CACHED_MOVIES = 256 #Movie-movie rows kept in memory
+LATENCY_WINDOW = 10000 #Amount of recent events the latency report covers
+
+def _statWeights(a, b):
+    '''Yield the contribution of co-rated movies with the ratings a (target) and b (other user) to every row of the pair statistics'''
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    yield np.ones(len(b)) #n
+    yield a #Sa
+    yield b #Sb
+    yield a * a #Saa
+    yield b * b #Sbb
+    yield a * b #Sab
+    yield np.minimum(a, b) #Smin
+    for value in range(1, MAX_RATING + 1): #The target gave that rating value
+        yield (a == value).astype(np.float64)
+    for value in range(1, MAX_RATING + 1): #The other user gave that rating value
+        yield (b == value).astype(np.float64)
+
+def _statDelta(a, b, oldA, oldB):
+    '''Difference between the contributions of the ratings (a, b) and (oldA, oldB), a rating of 0 means the movie is not co-rated'''
+    delta = np.zeros((STAT_ROWS, len(b)))
+    if a and np.all(b):
+        delta += np.array(list(_statWeights(np.broadcast_to(a, len(b)), b)))
+    if oldA and np.all(oldB):
+        delta -= np.array(list(_statWeights(np.broadcast_to(oldA, len(oldB)), oldB)))
+    return delta
+
+def _grow(stats, width):
+    '''Return the pair statistics with at least width columns'''
+    if stats.shape[1] >= width:
+        return stats
+    grown = np.zeros((STAT_ROWS, width))
+    grown[:, :stats.shape[1]] = stats
+    return grown
+
+class LiveRatings:
+    '''User and movie lists (from LoadData.loadData) that take single rating events.
+    Can be given to Similarity.recommendMovies/customSimilarity as userScores, and getMovieIndex as their movieIndex'''
+    def __init__(self, userList, movieList, maxCachedUsers = DEFAULT_CACHED_USERS, maxCachedMovies = DEFAULT_CACHED_MOVIES):
+        '''Constructor, the users have to be array backed (every loader creates those)'''
+        self.__userList = userList
+        self.__movieList = movieList
+        self.__users = {int(user.getID()): user for user in userList} #User ID -> User
+        self.__positions = {int(movie.getID()): i for i, movie in enumerate(movieList)} #Movie ID -> position in the movie list
+        self.__counts = np.array([movie.getWatcherCount() for movie in movieList], dtype=np.int64) #Running count of ratings per movie
+        self.__sums = np.array([int(movie.getWatcherRatings().sum(dtype=np.int64)) for movie in movieList], dtype=np.int64) #Running sum of ratings per movie
+        self.__userRows = collections.OrderedDict() #Target user ID -> pair statistics with every user, least recently used first
+        self.__movieRows = collections.OrderedDict() #Movie position -> common watchers with every movie, least recently used first
+        self.__maxCachedUsers = maxCachedUsers
+        self.__maxCachedMovies = maxCachedMovies
+        self.__latencies = collections.deque(maxlen=LATENCY_WINDOW) #Seconds per event
+        self.__width = max(self.__users, default=0) + 1 #Columns of the user rows, one per user ID
+
+    def getUserList(self):
+        '''Returns the list of users, new users are added at the end'''
+        return self.__userList
+
+    def getMovieList(self):
+        '''Returns the list of movies'''
+        return self.__movieList
+
+    def getUser(self, userID):
+        '''Returns the User object of that ID, None if the user has no ratings yet'''
+        return self.__users.get(int(userID))
+
+    def getMoviePosition(self, movieID):
+        '''Returns the position of a movie ID in the movie list'''
+        position = self.__positions.get(int(movieID))
+        if position == None:
+            raise ValueError("Unknown movie ID: " + str(movieID))
+        return position
+
+    def setRating(self, userID, movieID, rating):
+        '''Add a rating, or change it if the user already rated that movie. Returns the previous rating, 0 if there was none'''
+        if not 1 <= int(rating) <= MAX_RATING:
+            raise ValueError("Rating has to be between 1 and " + str(MAX_RATING) + ": " + str(rating))
+        return self.__apply(int(userID), self.getMoviePosition(movieID), int(rating))
+
+    def removeRating(self, userID, movieID):
+        '''Delete a rating. Returns the removed rating, 0 if there was none'''
+        return self.__apply(int(userID), self.getMoviePosition(movieID), 0)
+
+    def applyEvents(self, events):
+        '''Apply a list of (userID, movieID, rating) events in order, a rating of 0 or None deletes. Returns the amount of events'''
+        count = 0
+        for userID, movieID, rating in events:
+            if rating:
+                self.setRating(userID, movieID, rating)
+            else:
+                self.removeRating(userID, movieID)
+            count += 1
+        return count
+
+    def __apply(self, userID, position, rating):
+        '''Apply one event, rating 0 deletes'''
+        if userID < 1: #The score arrays are indexed by user ID
+            raise ValueError("User IDs start at 1: " + str(userID))
+        start = time.perf_counter()
+        user = self.__users.get(userID)
+        if user == None: #First rating of a new user
+            if not rating:
+                self.__latencies.append(time.perf_counter() - start)
+                return 0
+            user = LoadData.User(str(userID), self.__movieList, np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint8))
+            self.__users[userID] = user
+            self.__userList.append(user)
+            self.__width = max(self.__width, userID + 1)
+        movie = self.__movieList[position]
+        watcherIDs, watcherRatings = movie.getWatcherIDs(), movie.getWatcherRatings() #Posting list before the event
+        old = user.setMovieRating(position, rating) if rating else user.removeMovie(position)
+        if not old == rating:
+            if rating:
+                movie.setUserWatched(userID, rating)
+            else:
+                movie.removeUserWatched(userID)
+            self.__sums[position] += rating - old #Running average
+            self.__counts[position] += (rating > 0) - (old > 0)
+            movie.setRating(float(self.__sums[position] / self.__counts[position]) if self.__counts[position] else 0)
+            self.__updateUserRows(userID, rating, old, watcherIDs, watcherRatings)
+            if (rating > 0) != (old > 0): #Only adding or removing a movie changes the common watchers
+                self.__updateMovieRows(user, position, 1 if rating else -1)
+        self.__latencies.append(time.perf_counter() - start)
+        return old
+
+    def __updateUserRows(self, userID, rating, old, watcherIDs, watcherRatings):
+        '''Update the cached user rows the changed rating is part of'''
+        others = watcherIDs != userID
+        if userID in self.__userRows: #The row of the user who rated: one column per other watcher of the movie
+            ids, ratings = watcherIDs[others], watcherRatings[others]
+            stats = _grow(self.__userRows[userID], self.__width)
+            stats[:, ids] += _statDelta(rating, ratings, old, ratings)
+            self.__userRows[userID] = stats
+        for target, stats in self.__userRows.items(): #Rows of other users who watched the movie: only the column of the user who rated
+            if target == userID:
+                continue
+            pos = int(np.searchsorted(watcherIDs, target))
+            if pos < len(watcherIDs) and watcherIDs[pos] == target:
+                stats = _grow(stats, self.__width)
+                stats[:, userID] += _statDelta(int(watcherRatings[pos]), [rating], int(watcherRatings[pos]), [old])[:, 0]
+                self.__userRows[target] = stats
+
+    def __updateMovieRows(self, user, position, step):
+        '''Update the cached movie rows after the user added (step 1) or removed (step -1) the movie at that position'''
+        positions = user.getMovieIndices()
+        positions = positions[positions != position] #The other movies of the user
+        watched = set(positions.tolist())
+        for cached, row in self.__movieRows.items():
+            if cached == position:
+                row[positions] += step
+            elif cached in watched:
+                row[position] += step
+
+    def __userRow(self, userID):
+        '''Pair statistics of the user with every user (one column per user ID), computed from the posting lists if they are not cached'''
+        stats = self.__userRows.get(userID)
+        if stats is not None:
+            stats = _grow(stats, self.__width) #Rows cached before a new user joined are too narrow
+            self.__userRows[userID] = stats #Replaces the cached row, the cache doesn't grow
+            self.__userRows.move_to_end(userID)
+            return stats
+        user = self.__users[userID]
+        ids, a, b = list(), list(), list()
+        for position, rating in zip(user.getMovieIndices().tolist(), user.getRatings().tolist()): #Everyone who watched one of the users movies
+            movie = self.__movieList[position]
+            ids.append(movie.getWatcherIDs())
+            a.append(np.full(movie.getWatcherCount(), rating))
+            b.append(movie.getWatcherRatings())
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int32)
+        a = np.concatenate(a) if a else np.empty(0)
+        b = np.concatenate(b) if b else np.empty(0)
+        stats = np.zeros((STAT_ROWS, self.__width))
+        for i, weights in enumerate(_statWeights(a, b)):
+            stats[i] = np.bincount(ids, weights=weights, minlength=self.__width)
+        while self.__userRows and len(self.__userRows) >= self.__maxCachedUsers: #Make room first, so the cache never holds more rows than allowed
+            self.__userRows.popitem(last=False) #Drop the least recently used row
+        if self.__maxCachedUsers > 0:
+            self.__userRows[userID] = stats
+        return stats
+
+    def __movieRow(self, position):
+        '''Common watchers of the movie at that position with every movie, computed from the posting lists if they are not cached'''
+        row = self.__movieRows.get(position)
+        if row is not None:
+            self.__movieRows.move_to_end(position)
+            return row
+        watched = [self.__users[userID].getMovieIndices() for userID in self.__movieList[position].getWatcherIDs().tolist()]
+        row = np.bincount(np.concatenate(watched) if watched else np.empty(0, dtype=np.int64), minlength=len(self.__movieList)).astype(np.int64)
+        self.__movieRows[position] = row
+        if len(self.__movieRows) > self.__maxCachedMovies:
+            self.__movieRows.popitem(last=False)
+        return row
+
+    def getUserScores(self, userID, simFunction = 0):
+        '''Similarity of the user to every user, an array with the score of every user at the position of its ID.
+        Same scores as Similarity.userSimilarityScores, simFunction values are the same (5 = custom score)'''
+        userID = int(userID)
+        if not userID in self.__users:
+            return np.zeros(self.__width)
+        stats = self.__userRow(userID)
+        inTarget = stats[7:7 + MAX_RATING] > 0 #Rating values the target gave to co-rated movies
+        inOther = stats[7 + MAX_RATING:] > 0 #Rating values the other user gave to co-rated movies
+        return Similarity.scoresFromStats({"n": stats[0], "Sa": stats[1], "Sb": stats[2], "Saa": stats[3], "Sbb": stats[4], "Sab": stats[5],
+                                           "Smin": stats[6], "combined": (inTarget | inOther).sum(axis=0), "unique": (inTarget & ~inOther).sum(axis=0),
+                                           "watched": len(self.__users[userID].getRatings())}, simFunction)
+
+    def getMovieScores(self, movieID, simFunction = 0):
+        '''Similarity of the movie to every movie by the users who watched them, an array in movie list order.
+        Same scores as Similarity.compareMoviesByUsersWatched'''
+        position = self.getMoviePosition(movieID)
+        common = self.__movieRow(position)
+        count = self.__counts[position]
+        return Similarity.binaryScoresFromCounts(count, self.__counts, common, count + self.__counts - common, simFunction)
+
+    def getMovieSimilarity(self, movieID1, movieID2, simFunction = 0):
+        '''Similarity of two movies by the users who watched them, same as Similarity.compareMoviesByUsersWatched'''
+        position1, position2 = self.getMoviePosition(movieID1), self.getMoviePosition(movieID2)
+        common = int(self.__movieRow(position1)[position2])
+        count1, count2 = int(self.__counts[position1]), int(self.__counts[position2])
+        return Similarity.binaryScoresFromCounts(count1, count2, common, count1 + count2 - common, simFunction)
+
+    def getMovieIndex(self, simFunction = 0):
+        '''Returns a view with the interface of SimilarityIndex.MovieIndex, to give the live movie similarities to the recommenders'''
+        return LiveMovieIndex(self, simFunction)
+
+    def getAverageRating(self, movieID):
+        '''Returns the running average rating of a movie, 0 if nobody rated it'''
+        position = self.getMoviePosition(movieID)
+        return float(self.__sums[position] / self.__counts[position]) if self.__counts[position] else 0
+
+    def getLatencyReport(self):
+        '''Returns the amount of events and the mean, median, 95th and 99th percentile and maximum update latency in milliseconds, over the recent events'''
+        if not self.__latencies:
+            return {"events": 0}
+        ms = np.array(self.__latencies) * 1000
+        return {"events": len(ms), "meanMs": float(ms.mean()), "p50Ms": float(np.percentile(ms, 50)), "p95Ms": float(np.percentile(ms, 95)),
+                "p99Ms": float(np.percentile(ms, 99)), "maxMs": float(ms.max())}
+
+class LiveMovieIndex:
+    '''Movie similarities of a LiveRatings object by the users who watched the movies, with the interface of SimilarityIndex.MovieIndex.
+    Every movie is a neighbor, so the lookups are exact'''
+    def __init__(self, liveRatings, simFunction):
+        '''Constructor'''
+        self.__live = liveRatings
+        self.__simFunction = int(simFunction)
+
+    def getK(self):
+        '''Returns the amount of neighbors of every movie (all other movies)'''
+        return len(self.__live.getMovieList()) - 1
+
+    def matches(self, simFunction, compareMovieGenres):
+        '''Check if the view fits that simFunction and comparison mode, the live similarities are always by the users who watched'''
+        return self.__simFunction == int(simFunction) and not compareMovieGenres
+
+    def getNeighbors(self, movieID):
+        '''Returns (movieIDs, scores) of all other movies, most similar first, ties in the order SimilarityIndex uses'''
+        movieList = self.__live.getMovieList()
+        scores = np.array(self.__live.getMovieScores(movieID, self.__simFunction), dtype=np.float64)
+        ratings = np.array([int(movie.getRating()) for movie in movieList])
+        scores[self.__live.getMoviePosition(movieID)] = -np.inf #Never the movie itself
+        order = np.lexsort((np.arange(len(movieList)), -ratings, -scores))[:-1]
+        return ([movieList[i].getID() for i in order.tolist()], scores[order].tolist())
+
+    def getSimilarity(self, movieID1, movieID2):
+        '''Returns the similarity of the two movies'''
+        return self.__live.getMovieSimilarity(movieID1, movieID2, self.__simFunction)
+
+if __name__ == "__main__":
+    #Replay random events on the dataset and report the update latency, arguments: [amount of events]
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    start = time.perf_counter()
+    userList, movieList = LoadData.loadData(useCache=True)
+    print("Full reload: " + format((time.perf_counter() - start) * 1000, ".1f") + " ms")
+    live = LiveRatings(userList, movieList)
+    random.seed(0)
+    userIDs = [user.getID() for user in userList]
+    for userID in random.sample(userIDs, 20): #Warm some cached rows, so the events have rows to keep current
+        live.getUserScores(userID)
+    for movie in random.sample(movieList, 50):
+        live.getMovieScores(movie.getID())
+    events = list()
+    for i in range(amount): #A mix of new ratings, changed ratings and deletes
+        user = live.getUser(random.choice(userIDs))
+        kind = random.random()
+        if kind < 0.2 and len(user.getRatings()): #Delete one of the users ratings
+            events.append((user.getID(), movieList[int(random.choice(user.getMovieIndices()))].getID(), 0))
+        else:
+            events.append((user.getID(), random.choice(movieList).getID(), random.randint(1, MAX_RATING)))
+    live.applyEvents(events)
+    report = live.getLatencyReport()
+    print("Events: " + str(report["events"]) + ", mean " + format(report["meanMs"], ".3f") + " ms, p50 " + format(report["p50Ms"], ".3f")
+          + " ms, p95 " + format(report["p95Ms"], ".3f") + " ms, p99 " + format(report["p99Ms"], ".3f") + " ms, max " + format(report["maxMs"], ".3f") + " ms")
+    #A new user whose ID leaves a gap copies the ratings of an existing user, so it becomes that users closest neighbor
+    source = live.getUser(userIDs[0])
+    newID = max(int(ID) for ID in userIDs) + 1000
+    live.applyEvents([(newID, movieList[position].getID(), rating) for position, rating in zip(source.getMovieIndices().tolist(), source.getRatings().tolist())])
+    neighbors = dict(Similarity.recommendMovies(source, live.getUserList(), movieList, len(userIDs) + 1, 0, True, True, userScores=live))
+    recommended = Similarity.recommendMovies(source, live.getUserList(), movieList, 5, 0, True, userScores=live)
+    custom = Similarity.customSimilarity(source, live.getUserList(), movieList, 5, userScores=live)
+    if not (neighbors.get(str(newID)) == max(neighbors.values()) and len(recommended) == 5 and len(custom) == 5):
+        print("ERROR - Recommendations with the new user " + str(newID) + " as neighbor failed")
+    else:
+        print("New user " + str(newID) + " is the closest neighbor of user " + source.getID() + ", recommendations work")
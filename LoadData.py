@@ -1,14 +1,39 @@
+import os #Used to build the paths to the dataset files
+import numpy as np #Used for the vectorized rating matrix loader
+import DataCache #Binary cache of the parsed files
+import Profiling #Timings of the loaders when profiling is on
+
+DATA_DIR = "movies" #Folder containing the MovieLens files
+
+GENRE_NAMES = ("Action", "Adventure", "Animation", "Children's", "Comedy", "Crime", "Documentary", "Drama", "Fantasy",
+               "Film-Noir", "Horror", "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western") #Genre names in the order of the genre block in u.item
+
+_genreNameLists = dict() #Genre name list of every genre vector seen so far, so movies with the same genres share one list
+
+def genreVectorToMask(genreVector):
+    '''Pack a 0 and 1 genre vector into an integer, bit i is set if position i is 1'''
+    mask = 0
+    for i, value in enumerate(genreVector):
+        if value:
+            mask |= 1 << i
+    return mask
+
 class Movie:
     '''Movie Object, contains ID, Name, Year, Genre-Vector and List, a rating if used in an User Object, and a List of users who watched that movie'''
+    __slots__ = ('__ID', '__name', '__year', '__genre', '__genreMask', '__rating', '__genreNameList', '__watcherIDs', '__watcherRatings', '__pendingWatchers') #No per object dict, there is one Movie per catalog entry
+    
     def __init__(self, ID, name, year, genre, rating=0):
         '''Constructor'''
         self.__ID = ID #Movie ID
         self.__name = self.__adjustMovieName(name) #Movie Name, also removes the Year and puts the THE in front of the Name
         self.__year = year #Year of the Movie
         self.__genre = genre #The 0 and 1 List from the input file
+        self.__genreMask = genreVectorToMask(genre) #The same genres as one integer, bit i is set if the movie has genre i
         self.__rating = int(rating) #A variable for the rating, in userList it is used for that users rating, in movie list for its average rating
         self.__genreNameList = self.__movieGenreDataToNames(genre) #List of the names of the movie genres, used for Jaccard and makes it easier to display
-        self.__usersWatched = list() #Empty list that is filled with the users who watched that movie later on
+        self.__watcherIDs = np.empty(0, dtype=np.int32) #Posting list: sorted IDs of the users who watched that movie, filled later on
+        self.__watcherRatings = np.empty(0, dtype=np.uint8) #Ratings of those users, same order as the IDs
+        self.__pendingWatchers = list() #Users added with addUsersWatched that are not merged into the posting list yet
         
         
     def __str__(self):
@@ -31,6 +56,10 @@ class Movie:
         '''Returns the 0 and 1 vector with the genre data'''
         return self.__genre
     
+    def getGenreMask(self):
+        '''Returns the genres as an integer bitmask, bit i is set if the movie has genre i'''
+        return self.__genreMask
+    
     def getGenreNameList(self):
         '''Returns the list of genre names of that movie'''
         return self.__genreNameList
@@ -44,21 +73,78 @@ class Movie:
         self.__rating = rating
     
     def getUsersWatched(self):
-        '''Returns a list of users who watched that movie, with the rating they gave that movie'''
-        return self.__usersWatched
+        '''Returns a list of users who watched that movie, with the rating they gave that movie, sorted by user ID'''
+        ids, ratings = self.getWatcherIDs(), self.getWatcherRatings()
+        return [(str(userID), rating) for userID, rating in zip(ids.tolist(), ratings.tolist())]
     
     def addUsersWatched(self, userID, rating):
         '''Add a user to the list of users who watched that movie, the rating of that user is used to calculate the average rating'''
-        self.__usersWatched.append((userID, rating))
+        self.__pendingWatchers.append((int(userID), int(rating)))
+        
+    def setUsersWatched(self, userIDs, ratings):
+        '''Replace the users who watched that movie with the arrays of user IDs (sorted) and ratings'''
+        self.__watcherIDs = np.asarray(userIDs, dtype=np.int32)
+        self.__watcherRatings = np.asarray(ratings, dtype=np.uint8)
+        self.__pendingWatchers = list()
+        
+    def __mergePendingWatchers(self):
+        '''Merge the users added with addUsersWatched into the sorted posting list, a user that is added again keeps the newest rating'''
+        pending = np.array(self.__pendingWatchers, dtype=np.int64).reshape(-1, 2)
+        ids = np.concatenate((self.__watcherIDs, pending[:, 0].astype(np.int32)))
+        ratings = np.concatenate((self.__watcherRatings, pending[:, 1].astype(np.uint8)))
+        reverseIDs = ids[::-1] #np.unique keeps the first occurrence, reversing keeps the newest one
+        uniqueIDs, first = np.unique(reverseIDs, return_index=True)
+        self.__watcherIDs = uniqueIDs.astype(np.int32)
+        self.__watcherRatings = ratings[::-1][first]
+        self.__pendingWatchers = list()
+        
+    def getWatcherIDs(self):
+        '''Returns the posting list of the movie, a sorted int32 array with the IDs of the users who watched it'''
+        if self.__pendingWatchers:
+            self.__mergePendingWatchers()
+        return self.__watcherIDs
+    
+    def getWatcherRatings(self):
+        '''Returns the ratings of the users in the posting list, same order as getWatcherIDs'''
+        if self.__pendingWatchers:
+            self.__mergePendingWatchers()
+        return self.__watcherRatings
+    
+    def setUserWatched(self, userID, rating):
+        '''Add one user to the posting list or change the rating of a user already in it, keeps the list sorted.
+        Returns the previous rating of that user, 0 if they were not in the list'''
+        ids, ratings = self.getWatcherIDs(), self.getWatcherRatings()
+        pos = int(np.searchsorted(ids, int(userID)))
+        if pos < len(ids) and ids[pos] == int(userID): #Already in the list, the arrays may be read only views of the cache, so they are copied
+            old = int(ratings[pos])
+            self.__watcherRatings = ratings.copy()
+            self.__watcherRatings[pos] = rating
+            return old
+        self.__watcherIDs = np.insert(ids, pos, int(userID)).astype(np.int32)
+        self.__watcherRatings = np.insert(ratings, pos, rating).astype(np.uint8)
+        return 0
+    
+    def removeUserWatched(self, userID):
+        '''Remove one user from the posting list, returns the rating they gave, 0 if they were not in the list'''
+        ids, ratings = self.getWatcherIDs(), self.getWatcherRatings()
+        pos = int(np.searchsorted(ids, int(userID)))
+        if pos == len(ids) or ids[pos] != int(userID):
+            return 0
+        old = int(ratings[pos])
+        self.__watcherIDs = np.delete(ids, pos)
+        self.__watcherRatings = np.delete(ratings, pos)
+        return old
+        
+    def getWatcherCount(self):
+        '''Returns the number of users who watched that movie'''
+        return len(self.getWatcherIDs())
 
     def calculateAverageRating(self):
         '''Calculate the Average Rating for that movie, depending on the ratings from the UsersWatched list'''
-        avgRating = 0 #rating variable
-        userList = self.getUsersWatched() #get the list of users who watched that movie with ratings
-        if  not len(userList) == 0: #Check if any user watched that movie
-            for user in userList: #Go over all users
-                avgRating += int(user[1]) #Add up all ratings
-            avgRating /= len(userList) #Calculate the average
+        ratings = self.getWatcherRatings() #get the ratings of the users who watched that movie
+        if  not len(ratings) == 0: #Check if any user watched that movie
+            avgRating = int(ratings.sum(dtype=np.int64)) #Add up all ratings
+            avgRating /= len(ratings) #Calculate the average
             self.__rating = avgRating #Save the average in the rating field
         else:
             self.__rating = 0 #If nobody rated the movie, 0 will be in the rating field
@@ -66,34 +152,20 @@ class Movie:
     
     def __movieGenreNumberToGenreName(self, num):
         '''Enter the position of the Genre in the GenreData Block of the item.data file and get the genre name'''
-        switcher = { #Simple Switch Case
-            0: "Action",
-            1: "Adventure",
-            2: "Animation",
-            3: "Children's",
-            4: "Comedy",
-            5: "Crime",
-            6: "Documentary",
-            7: "Drama",
-            8: "Fantasy",
-            9: "Film-Noir",
-            10: "Horror",
-            11: "Musical",
-            12: "Mystery",
-            13: "Romance",
-            14: "Sci-Fi",
-            15: "Thriller",
-            16: "War",
-            17: "Western"
-        }
-        return switcher.get(num, "Invalid input: "+str(num))
+        if 0 <= num < len(GENRE_NAMES):
+            return GENRE_NAMES[num]
+        return "Invalid input: "+str(num)
 
     def __movieGenreDataToNames(self, genreData):
         '''Enter the genredata block of a movie from the item.data file and get a list of all its genres'''
-        result = [] #Empty List for the result
-        for i in range(len(genreData)): #Loop over all values
-            if genreData[i] == 1: #If a value is one, add the genre name to the list
-                result.append(self.__movieGenreNumberToGenreName(i))
+        key = tuple(genreData)
+        result = _genreNameLists.get(key) #Reuse the list if another movie has the same genres
+        if result == None:
+            result = [] #Empty List for the result
+            for i in range(len(genreData)): #Loop over all values
+                if genreData[i] == 1: #If a value is one, add the genre name to the list
+                    result.append(self.__movieGenreNumberToGenreName(i))
+            _genreNameLists[key] = result
         return result #Return the list
 
     def __adjustMovieName(self, movieName):
@@ -103,17 +175,79 @@ class Movie:
             movieName = "The "+movieName #Place it at the front
         return movieName #Return new movieName
     
-class User:
-    '''User Class, contains ID, and a movie list, with ratings'''
-    def __init__(self, ID):
+class RatedMovie:
+    '''Thin view of a shared Movie record together with the rating one user gave it, has the same getters as Movie'''
+    __slots__ = ('__movie', '__rating')
+    
+    def __init__(self, movie, rating):
         '''Constructor'''
+        self.__movie = movie #Shared Movie object from the movie list
+        self.__rating = int(rating) #The rating of the user
+        
+    def __str__(self):
+        '''To String function: Same as for a Movie, with the rating of the user'''
+        return self.getID() + ", " + self.getName() + ", " + self.getYear() + ", " + " ".join(self.getGenreNameList()) + ", " + str(self.__rating)
+    
+    def getMovie(self):
+        '''Returns the shared Movie object'''
+        return self.__movie
+    
+    def getID(self):
+        '''Returns that movies ID'''
+        return self.__movie.getID()
+    
+    def getName(self):
+        '''Returns that movies Name'''
+        return self.__movie.getName()
+    
+    def getYear(self):
+        '''Returns the year that movie got released'''
+        return self.__movie.getYear()
+    
+    def getGenreVector(self):
+        '''Returns the 0 and 1 vector with the genre data'''
+        return self.__movie.getGenreVector()
+    
+    def getGenreMask(self):
+        '''Returns the genres as an integer bitmask'''
+        return self.__movie.getGenreMask()
+    
+    def getGenreNameList(self):
+        '''Returns the list of genre names of that movie'''
+        return self.__movie.getGenreNameList()
+    
+    def getRating(self):
+        '''Returns the rating of the user'''
+        return self.__rating
+    
+    def setRating(self, rating):
+        '''Set the rating of this view, the user keeps the rating it was created with'''
+        self.__rating = rating
+    
+    def getUsersWatched(self):
+        '''Returns the list of users who watched that movie'''
+        return self.__movie.getUsersWatched()
+    
+class User:
+    '''User Class, contains ID, and a movie list, with ratings.
+    The ratings are either stored as two parallel arrays (positions in a shared movie list and uint8 ratings), that is what the loaders create,
+    or as a list of movie objects (addMovie/setWatchedMoviesList)'''
+    __slots__ = ('__ID', '__watchedMovies', '__movieList', '__movieIndices', '__ratings')
+    
+    def __init__(self, ID, movieList=None, movieIndices=None, ratings=None):
+        '''Constructor, movieList/movieIndices/ratings = shared list of all movies, positions of the watched movies in it and the ratings'''
         self.__ID = ID #User ID
         self.__watchedMovies = list() #Empty list for all the movies that user has watched
+        self.__movieList = None #Shared list of all movies
+        self.__movieIndices = None #Positions of the watched movies in the shared list
+        self.__ratings = None #Ratings of the watched movies
+        if not movieList == None:
+            self.setRatings(movieList, movieIndices, ratings)
         
     def __str__(self):
         '''To String: Print all the useful information of the User'''
         temp = ""
-        for movie in self.__watchedMovies: #Add up the data of all the movies that user watched
+        for movie in self.getWatchedMovies(): #Add up the data of all the movies that user watched
             temp += str(movie) 
             temp += '\n'
         return self.__ID + '\n' +temp #Add the userID and return the string
@@ -125,20 +259,271 @@ class User:
     def setWatchedMoviesList(self, movieList):
         '''Put a new list in the Watched Movie variable'''
         self.__watchedMovies = movieList
+        self.__movieList = None #The list replaces the arrays
+        self.__movieIndices = None
+        self.__ratings = None
+        
+    def setRatings(self, movieList, movieIndices, ratings):
+        '''Store the watched movies as positions in the shared movie list and ratings'''
+        self.__movieList = movieList
+        self.__movieIndices = np.asarray(movieIndices, dtype=np.int32)
+        self.__ratings = np.asarray(ratings, dtype=np.uint8)
+        self.__watchedMovies = list()
+        
+    def setMovieRating(self, position, rating):
+        '''Add the movie at that position of the shared movie list with a rating, or change the rating if the user already rated it.
+        Only for array backed users, returns the previous rating, 0 if the user had not rated that movie'''
+        hit = np.flatnonzero(self.__movieIndices == position)
+        if len(hit): #Already rated, the arrays may be read only, so they are copied
+            old = int(self.__ratings[hit[0]])
+            self.__ratings = self.__ratings.copy()
+            self.__ratings[hit[0]] = rating
+            return old
+        self.__movieIndices = np.append(self.__movieIndices, np.int32(position)) #New movies go to the end, like a new line in u.data
+        self.__ratings = np.append(self.__ratings, np.uint8(rating))
+        return 0
+    
+    def removeMovie(self, position):
+        '''Remove the movie at that position of the shared movie list from the watched movies.
+        Only for array backed users, returns the removed rating, 0 if the user had not rated that movie'''
+        hit = np.flatnonzero(self.__movieIndices == position)
+        if len(hit) == 0:
+            return 0
+        old = int(self.__ratings[hit[0]])
+        self.__movieIndices = np.delete(self.__movieIndices, hit[0])
+        self.__ratings = np.delete(self.__ratings, hit[0])
+        return old
         
     def getID(self):
         '''Return the ID'''
         return self.__ID
     
     def getWatchedMovies(self):
-        '''Return the list of watched movies'''
-        return self.__watchedMovies
+        '''Return the list of watched movies, for array backed users that is a new list of RatedMovie views'''
+        if self.__movieIndices is None:
+            return self.__watchedMovies
+        movieList = self.__movieList
+        return [RatedMovie(movieList[i], r) for i, r in zip(self.__movieIndices.tolist(), self.__ratings.tolist())]
+    
+    def getMovieIndices(self):
+        '''Return the positions of the watched movies in the shared movie list, None if the user stores a list of movie objects'''
+        return self.__movieIndices
+    
+    def getRatings(self):
+        '''Return the ratings (uint8 array, same order as getMovieIndices), None if the user stores a list of movie objects'''
+        return self.__ratings
+    
+    def getMovieList(self):
+        '''Return the shared movie list the positions refer to'''
+        return self.__movieList
+        
+class RatingMatrix:
+    '''Sparse user x movie rating matrix, rows are users and columns are movies.
+    Keeps a CSR copy for fast row (user) access and a CSC copy for fast column (movie) access,
+    and dense arrays to map between the dataset IDs and the matrix indices.
+    The CSR/CSC copies are plain arrays, scipy is only imported when getCSR or getCSC is called'''
+    def __init__(self, userIDs, movieIDs, ratings, arrays=None):
+        '''Constructor, userIDs, movieIDs and ratings are parallel arrays of rating triples in file order.
+        arrays = dict returned by getArrays (for example memory mapped from the cache), then nothing is computed or copied'''
+        if not arrays == None:
+            self.__useArrays(arrays)
+            return
+        self.__userIDs = np.unique(userIDs) #Sorted list of all user IDs, position = row index
+        self.__movieIDs = np.unique(movieIDs) #Sorted list of all movie IDs, position = column index
+        self.__userIndex = self.__buildIndex(self.__userIDs) #Dense userID -> row lookup array
+        self.__movieIndex = self.__buildIndex(self.__movieIDs) #Dense movieID -> column lookup array
+        self.__rows = self.__userIndex[userIDs].astype(np.int32) #Row of every rating, still in file order
+        self.__cols = self.__movieIndex[movieIDs].astype(np.int32) #Column of every rating, still in file order
+        self.__ratings = np.asarray(ratings, dtype=np.uint8) #Rating of every rating, still in file order
+        self.__shape = (len(self.__userIDs), len(self.__movieIDs))
+        self.__csrArrays = self.__compress(self.__rows, self.__cols, self.__shape[0]) #(data, indices, indptr), one row per user
+        self.__cscArrays = self.__compress(self.__cols, self.__rows, self.__shape[1]) #Column major copy for the movie lookups
+        self.__csr = self.__csc = None #scipy matrices, created by getCSR and getCSC
         
-def loadMovies():
-    '''Create a list of Movie objects containing all movies'''
+    def __useArrays(self, arrays):
+        '''Take over the arrays of getArrays without copying them'''
+        self.__userIDs = arrays["userIDs"]
+        self.__movieIDs = arrays["movieIDs"]
+        self.__userIndex = arrays["userIndex"]
+        self.__movieIndex = arrays["movieIndex"]
+        self.__rows = arrays["rows"]
+        self.__cols = arrays["cols"]
+        self.__ratings = arrays["ratings"]
+        self.__shape = (len(self.__userIDs), len(self.__movieIDs))
+        self.__csrArrays = (arrays["csrData"], arrays["csrIndices"], arrays["csrIndptr"])
+        self.__cscArrays = (arrays["cscData"], arrays["cscIndices"], arrays["cscIndptr"])
+        self.__csr = self.__csc = None
+    
+    def __compress(self, major, minor, size):
+        '''Compressed (data, indices, indptr) arrays of the ratings, grouped by major and sorted by minor inside every group.
+        The same arrays scipy builds for a matrix without duplicates, MovieLens has none'''
+        order = np.lexsort((minor, major))
+        indptr = np.zeros(size + 1, dtype=np.int32 if len(major) < 2 ** 31 else np.int64) #Offsets above 2^31 ratings need int64, like StreamingLoad
+        np.cumsum(np.bincount(major, minlength=size), out=indptr[1:])
+        return (self.__ratings[order], minor[order], indptr)
+    
+    def getArrays(self):
+        '''Return all arrays of the matrix as a dict, can be given back to the constructor'''
+        return {"userIDs": self.__userIDs, "movieIDs": self.__movieIDs, "userIndex": self.__userIndex, "movieIndex": self.__movieIndex,
+                "rows": self.__rows, "cols": self.__cols, "ratings": self.__ratings,
+                "csrData": self.__csrArrays[0], "csrIndices": self.__csrArrays[1], "csrIndptr": self.__csrArrays[2],
+                "cscData": self.__cscArrays[0], "cscIndices": self.__cscArrays[1], "cscIndptr": self.__cscArrays[2]}
+    
+    def __buildIndex(self, ids):
+        '''Given a sorted array of IDs, build an array where position ID holds the index of that ID (-1 if unknown)'''
+        index = np.full(int(ids[-1]) + 1 if len(ids) else 1, -1, dtype=np.int32) #Everything unknown at first
+        index[ids] = np.arange(len(ids), dtype=np.int32) #Fill in the known IDs
+        return index
+    
+    def __lookup(self, index, ID):
+        '''Return the index of an ID in one of the lookup arrays, or -1 if it isn't in the matrix'''
+        ID = int(ID) #IDs in the object model are strings
+        if ID < 0 or ID >= len(index):
+            return -1
+        return int(index[ID])
+    
+    def getShape(self):
+        '''Return the (users, movies) shape of the matrix'''
+        return self.__shape
+    
+    def getCSR(self):
+        '''Return the matrix in CSR format, one row per user (a scipy.sparse matrix on the same arrays)'''
+        if self.__csr is None: #A sparse matrix compares elementwise
+            from scipy import sparse #Imported on first use, the loaders and the object model work without it
+            self.__csr = sparse.csr_matrix(self.__csrArrays, shape=self.__shape, copy=False)
+        return self.__csr
+    
+    def getCSC(self):
+        '''Return the matrix in CSC format, one column per movie (a scipy.sparse matrix on the same arrays)'''
+        if self.__csc is None:
+            from scipy import sparse
+            self.__csc = sparse.csc_matrix(self.__cscArrays, shape=self.__shape, copy=False)
+        return self.__csc
+    
+    def getUserIDs(self):
+        '''Return the array of user IDs, the position of an ID is its row index'''
+        return self.__userIDs
+    
+    def getMovieIDs(self):
+        '''Return the array of movie IDs, the position of an ID is its column index'''
+        return self.__movieIDs
+    
+    def getUserIndex(self, userID):
+        '''Return the row index of a user ID, or -1 if the user has no ratings'''
+        return self.__lookup(self.__userIndex, userID)
+    
+    def getMovieIndex(self, movieID):
+        '''Return the column index of a movie ID, or -1 if the movie has no ratings'''
+        return self.__lookup(self.__movieIndex, movieID)
+    
+    def getUserRatings(self, userID):
+        '''Return two arrays (movie IDs, ratings) with all the ratings of that user'''
+        row = self.getUserIndex(userID)
+        if row == -1:
+            return (np.empty(0, dtype=self.__movieIDs.dtype), np.empty(0, dtype=np.uint8))
+        data, indices, indptr = self.__csrArrays
+        start, end = indptr[row], indptr[row + 1] #Slice of that row in the CSR arrays
+        return (self.__movieIDs[indices[start:end]], data[start:end])
+    
+    def getMovieRatings(self, movieID):
+        '''Return two arrays (user IDs, ratings) with all the ratings of that movie'''
+        col = self.getMovieIndex(movieID)
+        if col == -1:
+            return (np.empty(0, dtype=self.__userIDs.dtype), np.empty(0, dtype=np.uint8))
+        data, indices, indptr = self.__cscArrays
+        start, end = indptr[col], indptr[col + 1] #Slice of that column in the CSC arrays
+        return (self.__userIDs[indices[start:end]], data[start:end])
+    
+    def getRating(self, userID, movieID):
+        '''Return the rating a user gave a movie, 0 if they didn't rate it'''
+        row, col = self.getUserIndex(userID), self.getMovieIndex(movieID)
+        if row == -1 or col == -1:
+            return 0
+        data, indices, indptr = self.__csrArrays
+        start, end = indptr[row], indptr[row + 1]
+        position = start + np.searchsorted(indices[start:end], col) #The columns of a row are sorted
+        return int(data[position]) if position < end and indices[position] == col else 0
+    
+    @Profiling.profiled()
+    def toUserList(self, movieList):
+        '''Build the same list of User objects loadUsers would return, the users point into movieList instead of copying the movies'''
+        movieIDs = np.array([int(movie.getID()) for movie in movieList], dtype=np.int64)
+        positions = np.full(max(int(movieIDs.max(initial=0)), int(self.__movieIDs.max(initial=0))) + 1, -1, dtype=np.int32) #Movie ID -> position in movieList
+        positions[movieIDs] = np.arange(len(movieIDs), dtype=np.int32)
+        ratingPositions = positions[self.__movieIDs[self.__cols]] #Position in movieList of every rating, -1 for unknown movies
+        order = np.argsort(self.__rows, kind="stable") #Group the ratings by user, but keep the file order inside every user
+        order = order[ratingPositions[order] >= 0] #Ratings of unknown movies are skipped, same as in loadUsers
+        rows = self.__rows[order]
+        moviePositions = ratingPositions[order]
+        ratings = self.__ratings[order]
+        bounds = np.flatnonzero(np.diff(rows)) + 1 #Positions where the next user starts
+        starts = [0] + bounds.tolist()
+        ends = bounds.tolist() + [len(rows)]
+        
+        userList = list() #List for all the user objects
+        for start, end in zip(starts, ends): #Loop over the block of ratings of every user
+            if start == end: #No ratings at all
+                continue
+            userList.append(User(str(self.__userIDs[rows[start]]), movieList, moviePositions[start:end].copy(), ratings[start:end].copy()))
+        userList.sort(key = lambda x: x.getID(), reverse = True) #Same order as loadUsers
+        return userList
+    
+    @Profiling.profiled()
+    def setUsersWatched(self, movieList):
+        '''Fill the posting lists of the movies in movieList straight from the CSC columns, same result as loadUsersWatched'''
+        data, indices, indptr = self.__cscArrays
+        for movie in movieList:
+            col = self.getMovieIndex(movie.getID())
+            if col == -1: #Nobody rated that movie
+                movie.setUsersWatched(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint8))
+                continue
+            start, end = indptr[col], indptr[col + 1]
+            movie.setUsersWatched(self.__userIDs[indices[start:end]], data[start:end]) #Rows are sorted by user ID, so the posting list is sorted too
+    
+    def getMovieTotals(self):
+        '''Return three arrays (count, sum, sum of squares of the ratings) with one entry per column, computed in one pass over all ratings'''
+        size = len(self.__movieIDs)
+        ratings = self.__ratings.astype(np.float64) #Sums of small integers, exact in float64
+        return (np.bincount(self.__cols, minlength=size).astype(np.int64), np.bincount(self.__cols, weights=ratings, minlength=size),
+                np.bincount(self.__cols, weights=ratings * ratings, minlength=size))
+    
+    @Profiling.profiled()
+    def setAverageRatings(self, movieList):
+        '''Store the average ratings in the movies of movieList, same result as generateAverageRatings but without a loop over the posting lists'''
+        counts, sums, _ = self.getMovieTotals()
+        averages = np.divide(sums, counts, out=np.zeros(len(counts)), where=counts > 0).tolist()
+        for movie in movieList:
+            col = self.getMovieIndex(movie.getID())
+            movie.setRating(averages[col] if col >= 0 and counts[col] > 0 else 0) #0 if nobody rated the movie, like calculateAverageRating
+    
+    def toLists(self, movieList, usersWatched=True):
+        '''Build the (userList, movieList) tuple loadData returns from this matrix
+        usersWatched = False ... Leave the users who watched a movie empty, for callers that never compare movies by their watchers'''
+        userList = self.toUserList(movieList) #Generate the list of all user objects
+        if usersWatched:
+            self.setUsersWatched(movieList) #Generate the user list for all the movie objects in the movie list
+        self.setAverageRatings(movieList) #Calculate all the average Ratings
+        return (userList, movieList)
+        
+@Profiling.profiled()
+def loadMovies(path=DATA_DIR, useCache=False):
+    '''Create a list of Movie objects containing all movies
+    useCache = True ... Build the movies from the binary cache instead of parsing u.item'''
+    if useCache:
+        return _moviesFromCache(loadCache(path)) #Memory mapped movie data
+    return [Movie(mID, mName, mYear, mGenre) for (mID, mName, mYear, mGenre) in _readMovieFile(path)]
+
+def _moviesFromCache(arrays):
+    '''Build the Movie objects from the arrays of loadCache'''
+    titles, years, genres = arrays["titles"].tolist(), arrays["years"].tolist(), arrays["genres"].tolist()
+    return [Movie(str(mID), titles[i], years[i], genres[i]) for i, mID in enumerate(arrays["itemIDs"].tolist())]
+
+@Profiling.profiled()
+def _readMovieFile(path=DATA_DIR):
+    '''Parse u.item and return a list of (ID, name, year, genre vector) tuples'''
     movieList = list() #Setup List containing all movies
     try:
-        f = open(r"movies\u.item", 'r') #Open the movie dataset
+        f = open(os.path.join(path, "u.item"), 'r', encoding="latin-1") #Open the movie dataset, the titles are latin-1 encoded
     except:
         print('File "u.item" could not be found.')
         raise
@@ -152,17 +537,19 @@ def loadMovies():
             mGenre = temp[-18:] #Save Genre Data
             mGenre[-1] = mGenre[-1].rstrip() #Remove the \n at the end
             mGenre = list(map(int, mGenre)) #Cast the strings to ints
-            movieList.append(Movie(mID, mName, mYear, mGenre)) #Add a new Movie Object to the List
+            movieList.append((mID, mName, mYear, mGenre)) #Add the movie data to the List
         except:
-            continue #If there is a problem with the line, skip it
+            pass #If there is a problem with the line, skip it
         line = f.readline() #Read the next line
+    f.close() #Close the movie file
         
     return movieList #Return the List
 
-def loadUsers(movieList):
+@Profiling.profiled()
+def loadUsers(movieList, path=DATA_DIR):
     f = None
     try:
-        f = open(r"movies\u.data", 'r') #Open the user file
+        f = open(os.path.join(path, "u.data"), 'r') #Open the user file
     except:
         print('File "u.data" could not be found.')
         raise
@@ -198,18 +585,80 @@ def loadUsers(movieList):
     
     
     
-    for user in userList: #Go through the user list and change the movie ID rating tuples to a list of movie objects
+    moviePositions = {movie.getID(): i for i, movie in enumerate(movieList)} #Position of every movie ID in the movie list
+    for user in userList: #Go through the user list and change the movie ID rating tuples to positions in the movie list and ratings
         movies = user.getWatchedMovies() #get the movie ids and ratings
-        tempMovieList = list() #new list for the movie objects
-        for movie in movies:
-            m = next((x for x in movieList if x.getID() == movie[0]), None) #check if that movie is already in the list
-            if not m == None: #If not add it and set the rating correctly
-                newMovie = Movie(m.getID(), m.getName(), m.getYear(), m.getGenreVector(), movie[1]) #Create a new movie object with the checked movies data
-                tempMovieList.append(newMovie)
-        user.setWatchedMoviesList(tempMovieList) #set that users watched movies list to the newly created one
+        known = [movie for movie in movies if movie[0] in moviePositions] #Ratings of unknown movies are skipped
+        user.setRatings(movieList, [moviePositions[movie[0]] for movie in known], [int(movie[1]) for movie in known]) #The user points into the shared movie list
     userList.sort(key = lambda x: x.getID(), reverse = True)
     return userList #return the list of users
 
+@Profiling.profiled()
+def _readRatingFile(path=DATA_DIR):
+    '''Parse u.data in one vectorized pass, returns an array with one (userID, movieID, rating, timestamp) row per line'''
+    try:
+        return np.loadtxt(os.path.join(path, "u.data"), dtype=np.int64, delimiter='\t', ndmin=2)
+    except OSError:
+        print('File "u.data" could not be found.')
+        raise
+
+@Profiling.profiled()
+def loadRatingMatrix(path=DATA_DIR, useCache=False):
+    '''Load the u.data file in one vectorized pass and return a RatingMatrix
+    useCache = True ... Open the matrix memory mapped from the binary cache instead of parsing u.data'''
+    if useCache:
+        return _matrixFromCache(loadCache(path))
+    data = _readRatingFile(path)
+    return RatingMatrix(data[:, 0], data[:, 1], data[:, 2])
+
+def _matrixFromCache(arrays):
+    '''Build the RatingMatrix from the matrix_ arrays of loadCache, nothing is copied'''
+    return RatingMatrix(None, None, None, {name[7:]: array for name, array in arrays.items() if name.startswith("matrix_")})
+
+CACHE_ARRAYS = ("itemIDs", "titles", "years", "genres", "userIDs", "movieIDs", "ratings", "timestamps") #Arrays of the cache, plus the matrix_ arrays of the RatingMatrix
+MATRIX_ARRAYS = ("userIDs", "movieIDs", "userIndex", "movieIndex", "rows", "cols", "ratings",
+                 "csrData", "csrIndices", "csrIndptr", "cscData", "cscIndices", "cscIndptr") #Arrays of RatingMatrix.getArrays, stored with a matrix_ prefix
+
+def _cacheSources(path):
+    '''The files the cache is built from'''
+    return [os.path.join(path, "u.item"), os.path.join(path, "u.data")]
+
+def _movieCacheArrays(path=DATA_DIR):
+    '''Parse u.item into the movie arrays of the cache'''
+    movies = _readMovieFile(path)
+    return {"itemIDs": np.array([int(m[0]) for m in movies], dtype=np.int32),
+            "titles": np.array([m[1] for m in movies], dtype=str),
+            "years": np.array([m[2] for m in movies], dtype=str),
+            "genres": np.array([m[3] for m in movies], dtype=np.uint8).reshape(len(movies), -1)} #Genre bit-matrix, one row per movie
+
+def buildCache(path=DATA_DIR, cacheDir=None):
+    '''Parse the dataset and write the binary cache (default folder: path/cache)'''
+    cacheDir = cacheDir or os.path.join(path, "cache")
+    signature = DataCache.sourceSignature(_cacheSources(path)) #Taken before parsing, see DataCache.writeCache
+    data = _readRatingFile(path)
+    arrays = _movieCacheArrays(path)
+    arrays.update({"userIDs": data[:, 0].astype(np.int32),
+                   "movieIDs": data[:, 1].astype(np.int32),
+                   "ratings": data[:, 2].astype(np.uint8),
+                   "timestamps": data[:, 3]})
+    matrix = RatingMatrix(data[:, 0], data[:, 1], data[:, 2])
+    for name, array in matrix.getArrays().items():
+        arrays["matrix_" + name] = array
+    DataCache.writeCache(cacheDir, signature, arrays)
+
+@Profiling.profiled()
+def loadCache(path=DATA_DIR, cacheDir=None):
+    '''Open the binary cache memory mapped, it is (re)built first if it is missing or the source files changed. Returns a dict of arrays'''
+    cacheDir = cacheDir or os.path.join(path, "cache")
+    names = CACHE_ARRAYS + tuple("matrix_" + name for name in MATRIX_ARRAYS)
+    arrays = DataCache.readCache(cacheDir, _cacheSources(path), names)
+    if arrays == None: #Missing or outdated
+        print("Building cache in", cacheDir)
+        buildCache(path, cacheDir)
+        arrays = DataCache.readCache(cacheDir, _cacheSources(path), names)
+    return arrays
+
+@Profiling.profiled()
 def loadUsersWatched(userList, movieList):
     '''Add the users who watched a movie to that movies list of users who watched it'''
     for user in userList: #Loop over all users
@@ -217,16 +666,29 @@ def loadUsersWatched(userList, movieList):
         for movie in tempList: #Loop over that list
             movieList[int(movie.getID()) - 1].addUsersWatched(user.getID(),movie.getRating()) #Add that user and its rating to the list of users who watched that movie
     
+@Profiling.profiled()
 def generateAverageRatings(movieList):
     '''Invoke the Calculate Average Rating function of all movie objects in the list'''
     for movie in movieList: #Loop over all movies
         movie.calculateAverageRating() #Invoke the function
     
-def loadData():
-    '''Load movie and user data'''
-    movieList = loadMovies() #Generate the list of all movie objects
+@Profiling.profiled()
+def loadData(useRatingMatrix=False, path=DATA_DIR, useCache=False, returnMatrix=False, usersWatched=True):
+    '''Load movie and user data
+    useRatingMatrix = True ... Parse the ratings with loadRatingMatrix and build the objects from the matrix, much faster than loadUsers
+    useCache = True ... Like useRatingMatrix, but the movies and the matrix are memory mapped from the binary cache
+    returnMatrix = True ... Return (userList, movieList, ratingMatrix), so the batched engine can use the matrix without loading it again
+    (implies useRatingMatrix)
+    usersWatched = False ... Skip the users who watched every movie (only with the rating matrix), they are only needed to compare movies by their watchers'''
+    arrays = loadCache(path) if useCache else None #Opened once for the movies and the matrix
+    movieList = _moviesFromCache(arrays) if useCache else loadMovies(path) #Generate the list of all movie objects
     print("Loading Movie List finished.")
-    userList = loadUsers(movieList) #Generate the list of all user objects
+    if useRatingMatrix or useCache or returnMatrix:
+        ratingMatrix = _matrixFromCache(arrays) if useCache else loadRatingMatrix(path) #Parse all ratings at once
+        print("Loading Rating Matrix finished.")
+        userList, movieList = ratingMatrix.toLists(movieList, usersWatched) #Build the user objects, users watched and average ratings from the matrix
+        return (userList, movieList, ratingMatrix) if returnMatrix else (userList, movieList)
+    userList = loadUsers(movieList, path) #Generate the list of all user objects
     print("Loading User Data finished")
     loadUsersWatched(userList, movieList) #Generate the user list for all the movie objects in the movie list
     print("Loading Users Watched finished.")
@@ -0,0 +1,250 @@
+import time #Used to measure the training time per epoch
+import argparse #Command line options
+import concurrent.futures #Thread pool for the solves, NumPy releases the GIL in them
+import numpy as np #All updates are batched array operations
+import LoadData
+
+#Model based recommendations with matrix factorization
+#The rating matrix is approximated as globalMean + userBias + movieBias + userFactors . movieFactors, trained with alternating
+#least squares (ALS): with the movie side fixed every user is an independent regularized least squares problem and the other way round.
+#The problems of a block of users (or movies) are set up with a few array operations and solved in one batched np.linalg.solve,
+#the blocks can be spread over threads. Once trained, scoring all movies for a user is one matrix-vector product.
+
+DEFAULT_FACTORS = 20 #Length of the user and movie vectors
+DEFAULT_EPOCHS = 10 #Amount of ALS sweeps (users + movies)
+DEFAULT_REGULARIZATION = 0.1 #Weight of the L2 penalty, scaled by the amount of ratings of the user or movie
+DEFAULT_TEST_SHARE = 0.1 #Share of the ratings held out to measure the RMSE
+BLOCK_RATINGS = 2048 #Amount of ratings whose normal equations are built at once, bounds the memory of a solve
+MIN_RATING = 1 #Predictions are clipped to the rating scale
+MAX_RATING = 5
+
+class FactorModel:
+    '''Trained factorization of a rating matrix, predicts a rating for every user and movie'''
+    def __init__(self, userIDs, movieIDs, userFactors, movieFactors, userBiases, movieBiases, globalMean, history = None):
+        '''Constructor, the rows of the factor and bias arrays belong to the IDs at the same position'''
+        self.__userIDs = np.asarray(userIDs) #User ID of every row of userFactors
+        self.__movieIDs = np.asarray(movieIDs) #Movie ID of every row of movieFactors
+        self.__userFactors = np.asarray(userFactors, dtype=np.float64)
+        self.__movieFactors = np.asarray(movieFactors, dtype=np.float64)
+        self.__userBiases = np.asarray(userBiases, dtype=np.float64)
+        self.__movieBiases = np.asarray(movieBiases, dtype=np.float64)
+        self.__globalMean = float(globalMean)
+        self.__history = list(history or list()) #One dict per training epoch
+        self.__userPositions = {int(ID): i for i, ID in enumerate(self.__userIDs.tolist())}
+        self.__moviePositions = {int(ID): i for i, ID in enumerate(self.__movieIDs.tolist())}
+
+    def __str__(self):
+        '''To String function: Print the size and the last test RMSE of the model'''
+        text = "FactorModel(" + str(len(self.__userIDs)) + " users, " + str(len(self.__movieIDs)) + " movies, " + str(self.getFactorCount()) + " factors"
+        if self.__history:
+            text += ", test RMSE " + format(self.__history[-1]["testRMSE"], ".4f")
+        return text + ")"
+
+    def getUserIDs(self):
+        '''Returns the user ID of every row of the user factors'''
+        return self.__userIDs
+
+    def getMovieIDs(self):
+        '''Returns the movie ID of every row of the movie factors'''
+        return self.__movieIDs
+
+    def getUserFactors(self):
+        '''Returns the users x factors array'''
+        return self.__userFactors
+
+    def getMovieFactors(self):
+        '''Returns the movies x factors array'''
+        return self.__movieFactors
+
+    def getFactorCount(self):
+        '''Returns the length of the factor vectors'''
+        return self.__userFactors.shape[1]
+
+    def getGlobalMean(self):
+        '''Returns the mean of the training ratings'''
+        return self.__globalMean
+
+    def getHistory(self):
+        '''Returns one dict per training epoch with the seconds it took and the train and test RMSE'''
+        return self.__history
+
+    def __userPosition(self, userID):
+        '''Row of a user ID, or -1 if the user had no training ratings'''
+        return self.__userPositions.get(int(userID), -1) #IDs in the object model are strings
+
+    def predict(self, userID, movieID):
+        '''Predicted rating of a user for a movie. Unknown users get the movie baseline, unknown movies the user baseline'''
+        user, movie = self.__userPosition(userID), self.__moviePositions.get(int(movieID), -1)
+        score = self.__globalMean
+        if user >= 0:
+            score += self.__userBiases[user]
+        if movie >= 0:
+            score += self.__movieBiases[movie]
+        if user >= 0 and movie >= 0:
+            score += float(self.__userFactors[user] @ self.__movieFactors[movie])
+        return float(min(max(score, MIN_RATING), MAX_RATING))
+
+    def scoreMovies(self, userID, clip = True):
+        '''Predicted ratings of a user for all movies (one per entry of getMovieIDs), one matrix-vector product.
+        clip = False ... Keep scores outside the rating scale, they still rank the movies the clipped ones tie'''
+        user = self.__userPosition(userID)
+        scores = self.__globalMean + self.__movieBiases
+        if user >= 0:
+            scores = scores + self.__userBiases[user] + self.__movieFactors @ self.__userFactors[user]
+        return np.clip(scores, MIN_RATING, MAX_RATING) if clip else scores
+
+    def topMovies(self, userID, amount, exclude = None):
+        '''Returns the amount movies with the highest predicted rating as (movieID, score) tuples, best first.
+        The order uses the unclipped scores, the returned scores are clipped to the rating scale.
+        exclude = IDs of movies to skip, e.g. the ones the user already rated'''
+        scores = self.scoreMovies(userID, clip = False)
+        if exclude:
+            skip = [self.__moviePositions[int(ID)] for ID in exclude if int(ID) in self.__moviePositions]
+            scores[skip] = -np.inf
+        amount = min(int(amount), int(np.isfinite(scores).sum()))
+        if amount <= 0:
+            return list()
+        best = np.argpartition(-scores, amount - 1)[:amount] #Top-N without sorting all movies
+        best = best[np.lexsort((best, -scores[best]))] #Highest score first, ties by position
+        return [(int(self.__movieIDs[i]), float(min(max(scores[i], MIN_RATING), MAX_RATING))) for i in best]
+
+    def similarUsers(self, userID, amount):
+        '''Returns the amount users with the most similar factor vectors (cosine) as (userID, similarity) tuples, best first'''
+        user = self.__userPosition(userID)
+        if user == -1:
+            return list()
+        norms = np.linalg.norm(self.__userFactors, axis=1)
+        scores = np.divide(self.__userFactors @ self.__userFactors[user], norms * norms[user], out=np.zeros(len(norms)), where=norms * norms[user] > 0)
+        scores[user] = -np.inf #Never return the user itself
+        amount = min(int(amount), len(scores) - 1)
+        if amount <= 0:
+            return list()
+        best = np.argpartition(-scores, amount - 1)[:amount]
+        best = best[np.lexsort((best, -scores[best]))]
+        return [(str(self.__userIDs[i]), float(scores[i])) for i in best]
+
+    def rmse(self, userIDs, movieIDs, ratings):
+        '''Root mean squared error of the clipped predictions for parallel arrays of rating triples'''
+        users = np.array([self.__userPosition(ID) for ID in np.asarray(userIDs).tolist()], dtype=np.int64)
+        movies = np.array([self.__moviePositions.get(int(ID), -1) for ID in np.asarray(movieIDs).tolist()], dtype=np.int64)
+        return _rmse(self.__globalMean, self.__userFactors, self.__movieFactors, self.__userBiases, self.__movieBiases, users, movies, ratings)
+
+    def save(self, path):
+        '''Save the model to a .npz file'''
+        np.savez(path, userIDs=self.__userIDs, movieIDs=self.__movieIDs, userFactors=self.__userFactors, movieFactors=self.__movieFactors,
+                 userBiases=self.__userBiases, movieBiases=self.__movieBiases, globalMean=np.array([self.__globalMean]),
+                 history=np.array([[h["epoch"], h["seconds"], h["trainRMSE"], h["testRMSE"]] for h in self.__history]).reshape(-1, 4))
+
+def loadFactorModel(path):
+    '''Load a model saved with FactorModel.save'''
+    with np.load(path) as data:
+        history = [{"epoch": int(row[0]), "seconds": row[1], "trainRMSE": row[2], "testRMSE": row[3]} for row in data["history"].tolist()]
+        return FactorModel(data["userIDs"], data["movieIDs"], data["userFactors"], data["movieFactors"], data["userBiases"], data["movieBiases"],
+                           float(data["globalMean"][0]), history)
+
+def _rmse(globalMean, userFactors, movieFactors, userBiases, movieBiases, users, movies, ratings):
+    '''RMSE of the clipped predictions for rows users and movies (-1 = unknown, only the baseline is used)'''
+    if len(ratings) == 0:
+        return float("nan")
+    knownUser, knownMovie = users >= 0, movies >= 0
+    both = knownUser & knownMovie
+    scores = np.full(len(ratings), globalMean)
+    scores[knownUser] += userBiases[users[knownUser]]
+    scores[knownMovie] += movieBiases[movies[knownMovie]]
+    scores[both] += np.einsum("ij,ij->i", userFactors[users[both]], movieFactors[movies[both]]) #Row wise dot products
+    errors = np.clip(scores, MIN_RATING, MAX_RATING) - np.asarray(ratings, dtype=np.float64)
+    return float(np.sqrt(np.mean(errors * errors)))
+
+def _blocks(indptr):
+    '''Split the rows of a CSR matrix into (start, end) ranges of about BLOCK_RATINGS ratings, a row is never split'''
+    rows = len(indptr) - 1
+    starts = np.unique(np.searchsorted(indptr, np.arange(0, indptr[-1], BLOCK_RATINGS), side='right') - 1) #Row in which every block of ratings starts
+    starts = [0] + [int(s) for s in starts if 0 < s < rows]
+    return list(zip(starts, starts[1:] + [rows]))
+
+def _solveRows(indptr, indices, targets, fixed, regularization, threads):
+    '''Solve the regularized least squares problem of every row of a CSR matrix: the vector x minimizing
+    sum (target - x . fixed[col])^2 + regularization * ratings of the row * |x|^2 over the ratings of the row. Rows without ratings get 0'''
+    counts = np.diff(indptr)
+    result = np.zeros((len(counts), fixed.shape[1]))
+    identity = np.eye(fixed.shape[1])
+
+    def solveBlock(block):
+        '''Build the normal equations of all rows of the block at once and solve them in one batched call'''
+        start, end = block
+        rated = np.flatnonzero(counts[start:end]) + start #Rows without ratings are skipped, reduceat can't sum empty segments
+        if len(rated) == 0:
+            return
+        low, high = indptr[start], indptr[end]
+        factors = fixed[indices[low:high]] #Fixed side vector of every rating of the block
+        offsets = indptr[rated] - low #Where the ratings of every row start
+        A = np.add.reduceat(factors[:, :, np.newaxis] * factors[:, np.newaxis, :], offsets, axis=0) #Sum of the outer products per row
+        A += regularization * counts[rated][:, np.newaxis, np.newaxis] * identity
+        b = np.add.reduceat(factors * targets[low:high, np.newaxis], offsets, axis=0)
+        result[rated] = np.linalg.solve(A, b[:, :, np.newaxis])[:, :, 0] #Every row writes only its own result, no locking needed
+
+    blocks = _blocks(indptr)
+    if threads > 1:
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            list(pool.map(solveBlock, blocks))
+    else:
+        for block in blocks:
+            solveBlock(block)
+    return result
+
+def trainALS(ratingMatrix, factors = DEFAULT_FACTORS, epochs = DEFAULT_EPOCHS, regularization = DEFAULT_REGULARIZATION, threads = 1,
+             testShare = DEFAULT_TEST_SHARE, seed = 0, verbose = True):
+    '''Train a FactorModel on a LoadData.RatingMatrix with alternating least squares.
+    testShare of the ratings (picked at random with seed) are held out, the train and test RMSE are recorded after every epoch'''
+    arrays = ratingMatrix.getArrays()
+    rows, cols = arrays["rows"].astype(np.int64), arrays["cols"].astype(np.int64) #Matrix positions of every rating
+    ratings = arrays["ratings"].astype(np.float64)
+    rng = np.random.default_rng(seed)
+    test = rng.random(len(ratings)) < testShare
+    shape = ratingMatrix.getShape()
+    from scipy import sparse #Imported on first use, loading a saved model doesn't need it
+    byUser = sparse.csr_matrix((ratings[~test], (rows[~test], cols[~test])), shape=shape) #Training ratings, one row per user
+    byMovie = byUser.T.tocsr() #The same ratings, one row per movie
+    globalMean = float(byUser.data.mean()) if byUser.nnz else 0.0
+    userFactors = rng.normal(0, 0.1, (shape[0], factors))
+    movieFactors = rng.normal(0, 0.1, (shape[1], factors))
+    userBiases = np.zeros(shape[0])
+    movieBiases = np.zeros(shape[1])
+    ones = (np.ones((shape[1], 1)), np.ones((shape[0], 1))) #The constant column turns the last entry of the solution into the bias
+
+    history = list()
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        solution = _solveRows(byUser.indptr, byUser.indices, byUser.data - globalMean - movieBiases[byUser.indices],
+                              np.hstack([movieFactors, ones[0]]), regularization, threads) #Users with the movies fixed
+        userFactors, userBiases = solution[:, :-1], solution[:, -1]
+        solution = _solveRows(byMovie.indptr, byMovie.indices, byMovie.data - globalMean - userBiases[byMovie.indices],
+                              np.hstack([userFactors, ones[1]]), regularization, threads) #Movies with the users fixed
+        movieFactors, movieBiases = solution[:, :-1], solution[:, -1]
+        seconds = time.perf_counter() - start
+        trainRMSE = _rmse(globalMean, userFactors, movieFactors, userBiases, movieBiases, rows[~test], cols[~test], ratings[~test])
+        testRMSE = _rmse(globalMean, userFactors, movieFactors, userBiases, movieBiases, rows[test], cols[test], ratings[test])
+        history.append({"epoch": epoch + 1, "seconds": seconds, "trainRMSE": trainRMSE, "testRMSE": testRMSE})
+        if verbose:
+            print("Epoch " + str(epoch + 1) + ": " + format(seconds, ".3f") + "s, train RMSE " + format(trainRMSE, ".4f") + ", test RMSE " + format(testRMSE, ".4f"))
+    return FactorModel(ratingMatrix.getUserIDs(), ratingMatrix.getMovieIDs(), userFactors, movieFactors, userBiases, movieBiases, globalMean, history)
+
+def main():
+    parser = argparse.ArgumentParser(description="Train a matrix factorization model on u.data")
+    parser.add_argument("--factors", type=int, default=DEFAULT_FACTORS, help="length of the factor vectors")
+    parser.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS, help="ALS sweeps")
+    parser.add_argument("--regularization", type=float, default=DEFAULT_REGULARIZATION)
+    parser.add_argument("--threads", type=int, default=1, help="threads for the batched solves")
+    parser.add_argument("--test-share", type=float, default=DEFAULT_TEST_SHARE, help="share of the ratings held out for the test RMSE")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data", default=LoadData.DATA_DIR, help="folder with u.item and u.data")
+    parser.add_argument("--output", default=None, help="save the model to this .npz file")
+    args = parser.parse_args()
+    model = trainALS(LoadData.loadRatingMatrix(args.data, useCache=True), args.factors, args.epochs, args.regularization, args.threads,
+                     args.test_share, args.seed)
+    print(model)
+    if args.output:
+        model.save(args.output)
+
+if __name__ == "__main__":
+    main()
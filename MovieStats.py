@@ -0,0 +1,183 @@
+import os #Used for the cache folder
+import sys #Used to read the command line arguments
+import time #Used to report the build time
+import numpy as np #All statistics are computed as arrays
+import LoadData
+import DataCache
+
+#Precomputed per-movie statistics
+#Count, mean, variance, a Bayesian shrunk mean and the popularity rank of every movie, computed in one vectorized pass over the
+#ratings of a LoadData.RatingMatrix. All arrays are indexed by movie ID, so a lookup for the tie breakers or the popularity
+#fallback of the recommendations is O(1) per movie. The table can be cached to disk next to the dataset cache.
+
+DEFAULT_PRIOR_WEIGHT = 10 #Amount of "virtual" ratings with the global mean every movie starts with for the Bayesian mean
+STAT_ARRAYS = ("counts", "sums", "sumSquares", "means", "variances", "bayesianMeans", "popularityRanks", "popularityOrder", "priorWeight") #Arrays of the cache
+
+class MovieStats:
+    '''Table of per-movie rating statistics, every array is indexed by movie ID (IDs nobody rated have a count of 0)'''
+    def __init__(self, counts, sums, sumSquares, priorWeight = DEFAULT_PRIOR_WEIGHT, arrays = None):
+        '''Constructor, counts, sums and sumSquares are arrays indexed by movie ID.
+        arrays = dict returned by getArrays (for example memory mapped from the cache), then only the Bayesian mean is recomputed if the prior differs'''
+        if not arrays == None:
+            self.__useArrays(arrays, priorWeight)
+            return
+        self.__counts = np.asarray(counts, dtype=np.int64) #Number of ratings
+        self.__sums = np.asarray(sums, dtype=np.float64) #Sum of the ratings
+        self.__sumSquares = np.asarray(sumSquares, dtype=np.float64) #Sum of the squared ratings
+        rated = self.__counts > 0
+        self.__means = np.divide(self.__sums, self.__counts, out=np.zeros(len(self.__counts)), where=rated) #0 for unrated movies, like calculateAverageRating
+        squares = np.divide(self.__sumSquares, self.__counts, out=np.zeros(len(self.__counts)), where=rated)
+        self.__variances = np.maximum(squares - self.__means * self.__means, 0) #Population variance, rounding can make it slightly negative
+        self.__setPrior(priorWeight)
+        ids = np.flatnonzero(rated)
+        order = np.lexsort((ids, -self.__means[ids], -self.__counts[ids])) #Most ratings first, then the better mean, then the smaller ID
+        self.__popularityOrder = ids[order] #Rated movie IDs from the most to the least popular
+        self.__popularityRanks = np.full(len(self.__counts), -1, dtype=np.int64) #-1 for unrated movies
+        self.__popularityRanks[self.__popularityOrder] = np.arange(len(order))
+
+    def __useArrays(self, arrays, priorWeight):
+        '''Take over the arrays of getArrays without copying them'''
+        self.__counts = arrays["counts"]
+        self.__sums = arrays["sums"]
+        self.__sumSquares = arrays["sumSquares"]
+        self.__means = arrays["means"]
+        self.__variances = arrays["variances"]
+        self.__popularityRanks = arrays["popularityRanks"]
+        self.__popularityOrder = arrays["popularityOrder"]
+        if float(arrays["priorWeight"][0]) == float(priorWeight):
+            self.__priorWeight = float(priorWeight)
+            self.__globalMean = float(self.__sums.sum() / max(int(self.__counts.sum()), 1))
+            self.__bayesianMeans = arrays["bayesianMeans"]
+        else:
+            self.__setPrior(priorWeight)
+
+    def __setPrior(self, priorWeight):
+        '''Compute the Bayesian mean, every movie is pulled towards the global mean as if it had priorWeight more ratings with that mean'''
+        self.__priorWeight = float(priorWeight)
+        self.__globalMean = float(self.__sums.sum() / max(int(self.__counts.sum()), 1))
+        weights = self.__counts + self.__priorWeight
+        self.__bayesianMeans = np.divide(self.__sums + self.__priorWeight * self.__globalMean, weights, out=np.full(len(weights), self.__globalMean), where=weights > 0)
+
+    def getArrays(self):
+        '''Return all arrays of the table as a dict, can be given back to the constructor'''
+        return {"counts": self.__counts, "sums": self.__sums, "sumSquares": self.__sumSquares, "means": self.__means, "variances": self.__variances,
+                "bayesianMeans": self.__bayesianMeans, "popularityRanks": self.__popularityRanks, "popularityOrder": self.__popularityOrder,
+                "priorWeight": np.array([self.__priorWeight])}
+
+    def __position(self, movieID):
+        '''Return the array position of a movie ID, or -1 if it is outside the table'''
+        movieID = int(movieID) #IDs in the object model are strings
+        if movieID < 0 or movieID >= len(self.__counts):
+            return -1
+        return movieID
+
+    def getCounts(self):
+        '''Returns the number of ratings of every movie ID'''
+        return self.__counts
+
+    def getMeans(self):
+        '''Returns the average rating of every movie ID, 0 for unrated movies'''
+        return self.__means
+
+    def getVariances(self):
+        '''Returns the variance of the ratings of every movie ID, 0 for unrated movies'''
+        return self.__variances
+
+    def getBayesianMeans(self):
+        '''Returns the Bayesian shrunk mean of every movie ID, the global mean for unrated movies'''
+        return self.__bayesianMeans
+
+    def getPopularityRanks(self):
+        '''Returns the popularity rank of every movie ID (0 = most ratings), -1 for unrated movies'''
+        return self.__popularityRanks
+
+    def getPopularityOrder(self):
+        '''Returns the IDs of all rated movies from the most to the least popular'''
+        return self.__popularityOrder
+
+    def getGlobalMean(self):
+        '''Returns the average of all ratings'''
+        return self.__globalMean
+
+    def getPriorWeight(self):
+        '''Returns the prior weight of the Bayesian mean'''
+        return self.__priorWeight
+
+    def getCount(self, movieID):
+        '''Returns the number of ratings of a movie'''
+        pos = self.__position(movieID)
+        return int(self.__counts[pos]) if pos >= 0 else 0
+
+    def getMean(self, movieID):
+        '''Returns the average rating of a movie, 0 if nobody rated it'''
+        pos = self.__position(movieID)
+        return float(self.__means[pos]) if pos >= 0 else 0.0
+
+    def getVariance(self, movieID):
+        '''Returns the variance of the ratings of a movie, 0 if nobody rated it'''
+        pos = self.__position(movieID)
+        return float(self.__variances[pos]) if pos >= 0 else 0.0
+
+    def getBayesianMean(self, movieID):
+        '''Returns the Bayesian shrunk mean of a movie, the global mean if nobody rated it'''
+        pos = self.__position(movieID)
+        return float(self.__bayesianMeans[pos]) if pos >= 0 else self.__globalMean
+
+    def getPopularityRank(self, movieID):
+        '''Returns the popularity rank of a movie (0 = most ratings), -1 if nobody rated it'''
+        pos = self.__position(movieID)
+        return int(self.__popularityRanks[pos]) if pos >= 0 else -1
+
+    def mostPopular(self, amount, exclude = None):
+        '''Returns the IDs (int) of the amount most popular movies, skipping the IDs in exclude'''
+        exclude = {int(ID) for ID in exclude} if exclude else set()
+        result = list()
+        for movieID in self.__popularityOrder.tolist(): #Stops after amount + len(exclude) movies at most
+            if len(result) >= amount:
+                break
+            if not movieID in exclude:
+                result.append(movieID)
+        return result
+
+    def setAverageRatings(self, movieList):
+        '''Store the average ratings in the movie objects, instead of generateAverageRatings'''
+        for movie in movieList:
+            pos = self.__position(movie.getID())
+            movie.setRating(float(self.__means[pos]) if pos >= 0 and self.__counts[pos] > 0 else 0)
+
+def computeMovieStats(ratingMatrix, priorWeight = DEFAULT_PRIOR_WEIGHT):
+    '''Build the statistics table from a LoadData.RatingMatrix in one pass over its ratings'''
+    movieIDs = ratingMatrix.getMovieIDs()
+    size = int(movieIDs.max()) + 1 if len(movieIDs) else 0
+    counts, sums, sumSquares = ratingMatrix.getMovieTotals() #One entry per column
+    table = [np.zeros(size, dtype=np.int64), np.zeros(size), np.zeros(size)]
+    for array, values in zip(table, (counts, sums, sumSquares)): #Scatter the columns to their movie IDs
+        array[movieIDs] = values
+    return MovieStats(*table, priorWeight = priorWeight)
+
+def loadMovieStats(path = LoadData.DATA_DIR, useCache = False, priorWeight = DEFAULT_PRIOR_WEIGHT, cacheDir = None):
+    '''Compute the statistics table of the dataset in path
+    useCache = True ... Open the table memory mapped from the cache (default folder: path/cache/movieStats), it is (re)built first if it is
+    missing or the source files changed'''
+    if not useCache:
+        return computeMovieStats(LoadData.loadRatingMatrix(path), priorWeight)
+    cacheDir = cacheDir or os.path.join(path, "cache", "movieStats")
+    sources = LoadData._cacheSources(path)
+    arrays = DataCache.readCache(cacheDir, sources, STAT_ARRAYS)
+    if arrays == None: #Missing or outdated
+        print("Building movie statistics in", cacheDir)
+        signature = DataCache.sourceSignature(sources) #Taken before computing, see DataCache.writeCache
+        stats = computeMovieStats(LoadData.loadRatingMatrix(path, useCache=True), priorWeight)
+        DataCache.writeCache(cacheDir, signature, stats.getArrays())
+        return stats
+    return MovieStats(None, None, None, priorWeight, arrays)
+
+if __name__ == "__main__":
+    #Build the statistics table and list the most popular movies, optional argument: amount
+    start = time.perf_counter()
+    stats = loadMovieStats(useCache=True)
+    print("Movie statistics ready in " + format(time.perf_counter() - start, ".3f") + "s, global mean " + format(stats.getGlobalMean(), ".3f"))
+    movieList = LoadData.loadMovies(useCache=True)
+    for rank, movieID in enumerate(stats.mostPopular(int(sys.argv[1]) if len(sys.argv) > 1 else 10)):
+        print(str(rank + 1) + ". " + movieList[movieID - 1].getName() + ": " + str(stats.getCount(movieID)) + " ratings, mean " + format(stats.getMean(movieID), ".2f")
+              + ", Bayesian mean " + format(stats.getBayesianMean(movieID), ".2f") + ", variance " + format(stats.getVariance(movieID), ".2f"))
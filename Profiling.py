@@ -0,0 +1,222 @@
+import os #Reads the switch from the environment
+import sys #The report is written to stderr at exit
+import json #Stats can be exported as json
+import time #Timing of the stages
+import atexit #Writes the stats of a RECSYS_PROFILE run at exit
+import threading #Every thread has its own stack of open stages
+import functools #Keeps the name and docstring of profiled functions
+import contextlib #profile() is a context manager
+
+#Lightweight instrumentation of the hot paths
+#Functions decorated with profiled and blocks wrapped in stage record their call count, total time and self time (without the
+#stages nested in them), per stage name and per call stack. Counters (count) record events without timing, e.g. distance function calls.
+#Recording is off by default, a profiled call then only checks one global and calls the function.
+#It is switched on for a block with "with Profiling.profile() as p:", or for the whole process with the environment variable
+#RECSYS_PROFILE: a file name ending in .json or .folded gets the stats written to it at exit, any other value prints a report.
+#The .folded export has one "stage;nested stage;... microseconds" line per call stack, the input format of flamegraph.pl and speedscope.
+
+ENV_VAR = "RECSYS_PROFILE" #Environment variable that switches the recording on for the whole process
+
+_active = None #Profile that is recording right now, None if recording is off
+
+class Profile:
+    '''Timings and counters recorded while profiling was on'''
+    def __init__(self):
+        '''Constructor'''
+        self.__stacks = dict() #"outer;inner" stack -> [calls, seconds, seconds spent in nested stages]
+        self.__counters = dict() #Counter name -> count
+        self.__lock = threading.Lock() #The stats are shared by all threads
+        self.__local = threading.local() #Stack of open stages of every thread
+
+    def enter(self, name):
+        '''Open a stage, every enter needs a matching exit'''
+        stack = getattr(self.__local, "stack", None)
+        if stack == None:
+            stack = self.__local.stack = list()
+        path = stack[-1][0] + ";" + name if stack else name
+        stack.append([path, time.perf_counter(), 0.0]) #[stack path, start time, time of the nested stages]
+
+    def exit(self):
+        '''Close the innermost open stage of the calling thread'''
+        stack = self.__local.stack
+        path, start, nested = stack.pop()
+        elapsed = time.perf_counter() - start
+        if stack:
+            stack[-1][2] += elapsed #Counts as nested time of the parent
+        with self.__lock:
+            entry = self.__stacks.get(path)
+            if entry == None:
+                entry = self.__stacks[path] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += nested
+
+    def count(self, name, amount = 1):
+        '''Add amount to a counter'''
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + amount
+
+    def merge(self, other):
+        '''Add the stats of another profile to this one'''
+        with self.__lock:
+            for path, (calls, seconds, nested) in other.getStacks().items():
+                entry = self.__stacks.setdefault(path, [0, 0.0, 0.0])
+                entry[0] += calls
+                entry[1] += seconds
+                entry[2] += nested
+            for name, amount in other.getCounters().items():
+                self.__counters[name] = self.__counters.get(name, 0) + amount
+
+    def reset(self):
+        '''Forget everything recorded so far'''
+        with self.__lock:
+            self.__stacks.clear()
+            self.__counters.clear()
+
+    def getStacks(self):
+        '''Returns a dict "outer;inner" stack -> (calls, seconds, seconds in nested stages)'''
+        with self.__lock:
+            return {path: tuple(entry) for path, entry in self.__stacks.items()}
+
+    def getCounters(self):
+        '''Returns a dict counter name -> count'''
+        with self.__lock:
+            return dict(self.__counters)
+
+    def getStages(self):
+        '''Returns a dict stage name -> {"calls", "seconds", "selfSeconds"}, summed over all stacks the stage shows up in'''
+        stages = dict()
+        for path, (calls, seconds, nested) in self.getStacks().items():
+            stage = stages.setdefault(path.rsplit(";", 1)[-1], {"calls": 0, "seconds": 0.0, "selfSeconds": 0.0})
+            stage["calls"] += calls
+            stage["seconds"] += seconds
+            stage["selfSeconds"] += seconds - nested
+        return stages
+
+    def getTotalSeconds(self):
+        '''Returns the time spent in the outermost stages'''
+        return sum(seconds for path, (calls, seconds, nested) in self.getStacks().items() if not ";" in path)
+
+    def toDict(self):
+        '''Returns all stats as a dict that can be written as json'''
+        stacks = {path: {"calls": calls, "seconds": seconds, "selfSeconds": seconds - nested} for path, (calls, seconds, nested) in self.getStacks().items()}
+        return {"totalSeconds": self.getTotalSeconds(), "stages": self.getStages(), "stacks": stacks, "counters": self.getCounters()}
+
+    def toJSON(self, path = None):
+        '''Returns the stats as a json string, also writes it to path if given'''
+        text = json.dumps(self.toDict(), indent=2, sort_keys=True)
+        if path:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def toFolded(self, path = None):
+        '''Returns the stats in the folded stack format (one "stack self-microseconds" line per stack), also writes it to path if given'''
+        lines = [stack + " " + str(int(round((seconds - nested) * 1e6))) for stack, (calls, seconds, nested) in sorted(self.getStacks().items())]
+        text = "\n".join(lines) + "\n" if lines else ""
+        if path:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def report(self):
+        '''Returns a table with one line per stage, the slowest first, followed by the counters'''
+        total = self.getTotalSeconds()
+        lines = ["stage".ljust(44) + "calls".rjust(10) + "total ms".rjust(12) + "self ms".rjust(12) + "share".rjust(8)]
+        for name, stage in sorted(self.getStages().items(), key = lambda x: -x[1]["seconds"]):
+            share = stage["seconds"] / total * 100 if total > 0 else 0
+            lines.append(name.ljust(44) + str(stage["calls"]).rjust(10) + format(stage["seconds"] * 1000, ".2f").rjust(12)
+                         + format(stage["selfSeconds"] * 1000, ".2f").rjust(12) + (format(share, ".1f") + "%").rjust(8))
+        for name, amount in sorted(self.getCounters().items()):
+            lines.append(name.ljust(44) + str(amount).rjust(10))
+        return "\n".join(lines)
+
+class _NullStage:
+    '''Stage that does nothing, returned by stage while recording is off'''
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage() #Shared, so a stage costs no allocation while recording is off
+
+class _Stage:
+    '''Context manager that times a block as one stage of a profile'''
+    def __init__(self, profile, name):
+        '''Constructor'''
+        self.__profile = profile
+        self.__name = name
+
+    def __enter__(self):
+        self.__profile.enter(self.__name)
+
+    def __exit__(self, *exc):
+        self.__profile.exit()
+        return False
+
+def stage(name):
+    '''Time a block as a stage: "with Profiling.stage('name'):"'''
+    profile = _active
+    if profile == None:
+        return _NULL_STAGE
+    return _Stage(profile, name)
+
+def count(name, amount = 1):
+    '''Add amount to a counter, nothing happens while recording is off'''
+    profile = _active
+    if not profile == None:
+        profile.count(name, amount)
+
+def profiled(name = None):
+    '''Decorator that times every call of a function as a stage, name defaults to module.function'''
+    def decorate(func):
+        label = name or func.__module__ + "." + func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = _active
+            if profile == None: #Recording is off
+                return func(*args, **kwargs)
+            profile.enter(label)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.exit()
+        return wrapper
+    return decorate
+
+def isEnabled():
+    '''Returns True if recording is on'''
+    return not _active == None
+
+def getActiveProfile():
+    '''Returns the profile that is recording right now, or None'''
+    return _active
+
+@contextlib.contextmanager
+def profile():
+    '''Record everything inside the block into a new Profile: "with Profiling.profile() as p: ...", then p.report().
+    If recording was already on, the stats are added to the outer profile afterwards too'''
+    global _active
+    outer = _active
+    current = Profile()
+    _active = current
+    try:
+        yield current
+    finally:
+        _active = outer
+        if not outer == None:
+            outer.merge(current)
+
+def _writeAtExit(target):
+    '''Write the stats of the process wide profile, called at exit when RECSYS_PROFILE is set'''
+    if target.endswith(".json"):
+        _active.toJSON(target)
+    elif target.endswith(".folded"):
+        _active.toFolded(target)
+    else:
+        print(_active.report(), file=sys.stderr)
+
+if os.environ.get(ENV_VAR, "") not in ("", "0"): #Switched on for the whole process
+    _active = Profile()
+    atexit.register(_writeAtExit, os.environ[ENV_VAR])
@@ -0,0 +1,317 @@
+import os #Used for the cpu count
+import io #In memory stream the loading messages of the workers are written to
+import json #Requests and responses are json
+import time #Used for the cache expiry
+import asyncio #Event loop of the HTTP server
+import argparse #Command line options
+import contextlib #Used to silence the loading messages of the workers
+import collections #OrderedDict for the LRU cache
+import concurrent.futures #Worker processes
+from urllib.parse import urlsplit, parse_qs #Used to read the request path and query
+import LoadData
+import Similarity
+import LiveUpdates
+
+#Recommendation service
+#A local HTTP/JSON server on asyncio that loads the data once and answers similarMovies, recommendMovies and customSimilarity requests.
+#The scoring runs in worker processes, so the event loop only parses requests and serves cached results. Every worker is its own single process
+#executor with its own LiveRatings built from the memory mapped cache (like BatchRecommend), so rating events can be sent to every worker,
+#and each worker applies them in order before the requests that come after them.
+#Results are kept in an LRU cache with a time to live. Rating events drop the cached results they change directly:
+#the results of the rating user and of the users who watched the movie, results that list the movie or are about it, and co-watcher
+#results of the movies the user watched. The time to live bounds how long the indirect effects on other results can be served.
+#
+#Endpoints:
+#GET /similarMovies?movie=ID&simFunction=0&mode=genre&amount=10
+#GET /recommendMovies?user=ID&simFunction=0&mode=genre&amount=10     (mode = genre or watchers)
+#GET /customSimilarity?user=ID&amount=10
+#POST /ratings with {"user": ID, "movie": ID, "rating": 1-5}, a rating of 0 deletes
+#GET /stats
+
+DEFAULT_PORT = 8080 #Port the service listens on
+DEFAULT_CACHE_SIZE = 1024 #Amount of results kept in the cache
+DEFAULT_TTL = 300 #Seconds a cached result is served
+MODES = {"genre": True, "watchers": False} #mode parameter -> compareMovieGenres
+
+_worker = dict() #Data of the current worker process, filled by _initWorker
+
+def _initWorker(path):
+    '''Load the data once per worker process, from the memory mapped cache'''
+    with contextlib.redirect_stdout(io.StringIO()): #Every worker would print the loading messages otherwise
+        userList, movieList = LoadData.loadData(path=path, useCache=True)
+    _worker["live"] = LiveUpdates.LiveRatings(userList, movieList)
+
+def _score(kind, target, simFunction, compareMovieGenres, amount):
+    '''Compute one result in a worker, returns a list of (movie name, score, average rating) tuples, None if the target is unknown'''
+    live = _worker["live"]
+    movieList = live.getMovieList()
+    if kind == "similarMovies":
+        movieIndex = None if compareMovieGenres else live.getMovieIndex(simFunction) #Exact co-watcher similarities from the live counts, one row per request
+        try:
+            targetMovie = movieList[live.getMoviePosition(target)]
+        except ValueError:
+            return None
+        rec = Similarity.similarMovies(targetMovie, movieList, amount, simFunction, compareMovieGenres, movieIndex)
+    else:
+        targetUser = live.getUser(target)
+        if targetUser == None:
+            return None
+        if kind == "customSimilarity":
+            rec = Similarity.customSimilarity(targetUser, live.getUserList(), movieList, amount, False, None, live)
+        else:
+            #No movie index: every seen movie would need its own row, users with more seen movies than cached rows would rebuild rows on every
+            #request. compareMoviesByUsersWatched works on the live posting lists directly
+            rec = Similarity.recommendMovies(targetUser, live.getUserList(), movieList, amount, simFunction, compareMovieGenres, False, None, None, live)
+    return [(name, float(score), float(rating)) for name, score, rating in rec]
+
+def _applyEvent(userID, movieID, rating):
+    '''Apply a rating event in a worker'''
+    if rating:
+        _worker["live"].setRating(userID, movieID, rating)
+    else:
+        _worker["live"].removeRating(userID, movieID)
+
+class ResultCache:
+    '''LRU cache with a time to live, every entry has tags (for example ("user", ID)) that are used to drop it when the data changes'''
+    def __init__(self, maxSize = DEFAULT_CACHE_SIZE, ttl = DEFAULT_TTL):
+        '''Constructor'''
+        self.__entries = collections.OrderedDict() #Key -> (expiry time, value, tags), least recently used first
+        self.__tags = dict() #Tag -> set of keys
+        self.__maxSize = maxSize
+        self.__ttl = ttl
+        self.__hits = 0
+        self.__misses = 0
+
+    def get(self, key):
+        '''Returns the cached value, None if it is missing or expired'''
+        entry = self.__entries.get(key)
+        if entry == None or entry[0] < time.monotonic():
+            if not entry == None:
+                self.__remove(key)
+            self.__misses += 1
+            return None
+        self.__entries.move_to_end(key)
+        self.__hits += 1
+        return entry[1]
+
+    def put(self, key, value, tags):
+        '''Store a value with its tags, drops the least recently used entry when the cache is full'''
+        if key in self.__entries:
+            self.__remove(key)
+        self.__entries[key] = (time.monotonic() + self.__ttl, value, tags)
+        for tag in tags:
+            self.__tags.setdefault(tag, set()).add(key)
+        if len(self.__entries) > self.__maxSize:
+            self.__remove(next(iter(self.__entries)))
+
+    def __remove(self, key):
+        '''Remove one entry and its tags'''
+        expiry, value, tags = self.__entries.pop(key)
+        for tag in tags:
+            keys = self.__tags.get(tag)
+            keys.discard(key)
+            if not keys:
+                del self.__tags[tag]
+
+    def invalidate(self, tags):
+        '''Drop every entry with one of the tags, returns the amount of dropped entries'''
+        dropped = 0
+        for tag in tags:
+            for key in list(self.__tags.get(tag, ())):
+                self.__remove(key)
+                dropped += 1
+        return dropped
+
+    def getStats(self):
+        '''Returns the size, hits and misses of the cache'''
+        return {"size": len(self.__entries), "maxSize": self.__maxSize, "ttl": self.__ttl, "hits": self.__hits, "misses": self.__misses}
+
+class RecommendService:
+    '''The state of the service: the worker processes, the result cache and a LiveRatings copy used to check and route rating events'''
+    def __init__(self, path = LoadData.DATA_DIR, workers = None, cacheSize = DEFAULT_CACHE_SIZE, ttl = DEFAULT_TTL):
+        '''Constructor, loads the data and starts the workers'''
+        LoadData.loadCache(path) #Build the cache once up front, so the workers only open it
+        with contextlib.redirect_stdout(io.StringIO()):
+            userList, movieList = LoadData.loadData(path=path, useCache=True)
+        self.__live = LiveUpdates.LiveRatings(userList, movieList)
+        self.__nameIDs = dict() #Movie name -> IDs, the results only contain the names
+        for movie in movieList:
+            self.__nameIDs.setdefault(movie.getName(), list()).append(movie.getID())
+        self.__cache = ResultCache(cacheSize, ttl)
+        self.__workers = [concurrent.futures.ProcessPoolExecutor(1, initializer=_initWorker, initargs=(path,)) for i in range(workers or os.cpu_count() or 1)]
+        self.__pending = [0] * len(self.__workers) #Running tasks per worker
+        self.__inFlight = dict() #Key -> future of a result that is being computed, so the same request is only computed once
+        self.__events = 0 #Amount of rating events, results computed while an event came in are not cached
+        self.__requests = 0
+
+    def close(self):
+        '''Stop the worker processes'''
+        for worker in self.__workers:
+            worker.shutdown()
+
+    async def __run(self, function, *args):
+        '''Run a function in the worker with the fewest running tasks'''
+        i = self.__pending.index(min(self.__pending))
+        self.__pending[i] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.__workers[i], function, *args)
+        finally:
+            self.__pending[i] -= 1
+
+    def __tags(self, kind, target, compareMovieGenres, result):
+        '''Tags of a result: its target, and every movie it lists'''
+        tags = {("user", target)} if kind != "similarMovies" else {("movie", target)}
+        if kind == "similarMovies" and not compareMovieGenres:
+            tags.add(("watchers", target)) #Co-watcher similarities of that movie change with every rating of it
+        for name, score, rating in result:
+            tags.update(("movie", ID) for ID in self.__nameIDs.get(name, ()))
+        return tags
+
+    async def recommend(self, kind, target, simFunction, compareMovieGenres, amount):
+        '''Returns (result, cached), result is None for an unknown target'''
+        key = (kind, str(target), simFunction, compareMovieGenres, amount)
+        result = self.__cache.get(key)
+        if not result == None:
+            return (result, True)
+        future = self.__inFlight.get(key)
+        if not future == None: #The same request is already being computed
+            return (await asyncio.shield(future), False)
+        future = asyncio.get_running_loop().create_future()
+        self.__inFlight[key] = future
+        events = self.__events
+        try:
+            result = await self.__run(_score, kind, str(target), simFunction, compareMovieGenres, amount)
+            if not result == None and events == self.__events: #Nothing changed while it was computed
+                self.__cache.put(key, result, self.__tags(kind, str(target), compareMovieGenres, result))
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() #Mark it as retrieved, the error is raised below
+            raise
+        finally:
+            del self.__inFlight[key]
+        return (result, False)
+
+    async def rate(self, userID, movieID, rating):
+        '''Apply a rating event to the service and all workers, drops the cached results it changes. Returns the previous rating'''
+        live = self.__live
+        movie = live.getMovieList()[live.getMoviePosition(movieID)] #Raises a ValueError for unknown movies
+        watchers = movie.getWatcherIDs().tolist()
+        old = live.setRating(userID, movieID, rating) if rating else live.removeRating(userID, movieID)
+        self.__events += 1
+        user = live.getUser(userID)
+        tags = {("user", str(userID)), ("movie", str(movie.getID()))} #The users results and everything that shows that movie (average rating)
+        tags.update(("user", str(ID)) for ID in watchers) #Users who watched the movie, their similarity to the user changed
+        if user != None: #Co-watcher results of the movies of the user, their common watchers with the movie changed
+            movieList = live.getMovieList()
+            tags.update(("watchers", movieList[i].getID()) for i in user.getMovieIndices().tolist())
+        self.__cache.invalidate(tags)
+        await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(worker, _applyEvent, str(userID), str(movieID), rating) for worker in self.__workers))
+        return old
+
+    def getStats(self):
+        '''Returns the cache statistics and the amount of requests and events'''
+        return {"requests": self.__requests, "events": self.__events, "workers": len(self.__workers), "cache": self.__cache.getStats()}
+
+    async def handle(self, method, target, body):
+        '''Answer one request, returns (HTTP status, json payload)'''
+        self.__requests += 1
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if method == "GET" and url.path in ("/similarMovies", "/recommendMovies", "/customSimilarity"):
+                kind = url.path[1:]
+                targetID = query["movie"] if kind == "similarMovies" else query["user"]
+                simFunction = int(query.get("simFunction", 0))
+                if not 0 <= simFunction <= 4:
+                    raise ValueError("simFunction has to be between 0 and 4")
+                mode = query.get("mode", "genre")
+                if not mode in MODES:
+                    raise ValueError("mode has to be genre or watchers")
+                amount = int(query.get("amount", 10))
+                if amount < 1:
+                    raise ValueError("amount has to be at least 1")
+                if kind == "customSimilarity": #customSimilarity has no settings
+                    simFunction, mode = 0, "genre"
+                result, cached = await self.recommend(kind, targetID, simFunction, MODES[mode], amount)
+                if result == None:
+                    return (404, {"error": "unknown " + ("movie" if kind == "similarMovies" else "user") + ": " + str(targetID)})
+                return (200, {"target": str(targetID), "cached": cached,
+                              "results": [{"movie": name, "score": score, "averageRating": rating} for name, score, rating in result]})
+            if method == "POST" and url.path == "/ratings":
+                event = json.loads(body or b"{}")
+                userID, movieID, rating = int(event["user"]), int(event["movie"]), int(event.get("rating") or 0)
+                if userID < 1: #Checked before anything is changed, so a bad event can't reach the shared state
+                    raise ValueError("user has to be a positive ID: " + str(userID))
+                if not 0 <= rating <= LiveUpdates.MAX_RATING:
+                    raise ValueError("rating has to be between 1 and " + str(LiveUpdates.MAX_RATING) + ", or 0 to delete: " + str(rating))
+                old = await self.rate(userID, movieID, rating)
+                return (200, {"user": str(event["user"]), "movie": str(event["movie"]), "rating": rating, "previousRating": old})
+            if method == "GET" and url.path == "/stats":
+                return (200, self.getStats())
+            return (404, {"error": "unknown endpoint: " + method + " " + url.path})
+        except KeyError as e:
+            return (400, {"error": "missing parameter: " + str(e)})
+        except ValueError as e: #Also covers invalid json
+            return (400, {"error": str(e)})
+        except Exception as e:
+            return (500, {"error": repr(e)})
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+async def _connection(service, reader, writer):
+    '''Serve the requests of one connection, HTTP/1.1 keep alive is supported'''
+    try:
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            method, target, version = line.decode("latin-1").split()
+            headers = dict()
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b"\n", b""):
+                    break
+                name, value = header.decode("latin-1").split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, payload = await service.handle(method, target, body)
+            data = json.dumps(payload).encode()
+            keepAlive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            writer.write(("HTTP/1.1 " + str(status) + " " + REASONS[status] + "\r\nContent-Type: application/json\r\nContent-Length: " + str(len(data))
+                          + "\r\nConnection: " + ("keep-alive" if keepAlive else "close") + "\r\n\r\n").encode() + data)
+            await writer.drain()
+            if not keepAlive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError): #Client went away or sent something that isn't HTTP
+        pass
+    finally:
+        writer.close()
+
+async def serve(host = "127.0.0.1", port = DEFAULT_PORT, **settings):
+    '''Start the service and answer requests until it is stopped'''
+    service = RecommendService(**settings)
+    try:
+        server = await asyncio.start_server(lambda reader, writer: _connection(service, reader, writer), host, port)
+        print("Serving on http://" + host + ":" + str(port))
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON recommendation service")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="results kept in the cache")
+    parser.add_argument("--ttl", type=float, default=DEFAULT_TTL, help="seconds a cached result is served")
+    parser.add_argument("--data", default=LoadData.DATA_DIR, help="folder with u.item and u.data")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, path=args.data, workers=args.workers, cacheSize=args.cache_size, ttl=args.ttl))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
 import math #Math is mostly needed for the POW and SQRT function
-from scipy.spatial import distance #Used for the similarity Functions
-from scipy import stats
+import numpy as np #Used for the similarity functions and the batched user similarity engine
+import weakref #Used to cache the matrices of the batched engine per rating matrix
+import heapq #Bounded top-N selection instead of sorting whole lists
+import DataCache #The matrices of the batched engine can be shared between processes through the binary cache
+import Profiling #Timings and call counts when profiling is on
 
+def _isArrayBacked(user):
+    '''Check if a user stores its ratings as arrays of positions in the movie list and ratings (see LoadData.User)'''
+    return getattr(user, "getMovieIndices", None) != None and user.getMovieIndices() is not None
+
+@Profiling.profiled()
 def compareUsers(user1, user2, simFunction=0):
     '''Compare how similar two users are, will return value between 0 and 1, SimFunction values: 
     0...Euclidean
@@ -10,18 +18,23 @@ def compareUsers(user1, user2, simFunction=0):
     3...Jaccard
     4...Manhatten'''
     
-    moviesUser1 = user1.getWatchedMovies() #Get movies for first user
-    moviesUser2 = user2.getWatchedMovies() #Get movies for second user
-    
     incommon1 = list() #List of ratings of incommon movies for user1
     incommon2 = list() #List of ratings of incommon movies for user2
 
-    for movie in moviesUser1: #Loop over all movies the first user watched
-        for movie2 in moviesUser2: #Loop over all movies the second user watched
-            if movie.getID() == movie2.getID(): #If both users watched a movie, add the ratings to the lists
-                incommon1.append(int(movie.getRating()))
-                incommon2.append(int(movie2.getRating()))
-                break #Break once a movie is in both and look for the next one, saves computation time
+    if _isArrayBacked(user1) and _isArrayBacked(user2) and user1.getMovieList() is user2.getMovieList(): #Both users store index and rating arrays into the same movie list
+        common, pos1, pos2 = np.intersect1d(user1.getMovieIndices(), user2.getMovieIndices(), assume_unique=True, return_indices=True)
+        order = np.argsort(pos1) #Keep the order of the first users movies, like the loop below
+        incommon1 = user1.getRatings()[pos1[order]].tolist()
+        incommon2 = user2.getRatings()[pos2[order]].tolist()
+    else:
+        moviesUser1 = user1.getWatchedMovies() #Get movies for first user
+        moviesUser2 = user2.getWatchedMovies() #Get movies for second user
+        for movie in moviesUser1: #Loop over all movies the first user watched
+            for movie2 in moviesUser2: #Loop over all movies the second user watched
+                if movie.getID() == movie2.getID(): #If both users watched a movie, add the ratings to the lists
+                    incommon1.append(int(movie.getRating()))
+                    incommon2.append(int(movie2.getRating()))
+                    break #Break once a movie is in both and look for the next one, saves computation time
                 
     
     if len(incommon1) == 0: #If the two users have nothing incommon, the similarity will always be 0
@@ -43,6 +56,7 @@ def compareUsers(user1, user2, simFunction=0):
     
     return sim #Return the result
     
+@Profiling.profiled()
 def compareMoviesByGenre(movie1, movie2, simFunction = 0):
     '''Compare two movies by the similarity of their genres, will return a value between 0 and 1, SimFunction values: 
     0...Euclidean
@@ -51,6 +65,10 @@ def compareMoviesByGenre(movie1, movie2, simFunction = 0):
     3...Jaccard
     4...Manhatten'''
     
+    if hasattr(movie1, "getGenreMask") and hasattr(movie2, "getGenreMask"): #Genre bitmasks, the scores only depend on the bit counts
+        mask1, mask2 = movie1.getGenreMask(), movie2.getGenreMask()
+        return _binaryScore(_bitCount(mask1), _bitCount(mask2), _bitCount(mask1 & mask2), len(movie1.getGenreVector()), simFunction)
+    
     movieGenres1 = movie1.getGenreVector() #Get List of Genres of that movie
     movieGenres2 = movie2.getGenreVector() #Get List of Genres of that movie
     
@@ -73,6 +91,51 @@ def compareMoviesByGenre(movie1, movie2, simFunction = 0):
 
     return sim #Return the result 
     
+GENRE_LENGTH = 18 #Length of the MovieLens genre vectors
+
+def genreMasks(movieList):
+    '''Return the genre bitmasks of all movies (LoadData.Movie.getGenreMask) as a uint64 array, in movie list order'''
+    return np.fromiter((movie.getGenreMask() for movie in movieList), dtype=np.uint64, count=len(movieList))
+
+_BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64) #Set bits of every byte value
+
+def _bitCount(mask):
+    '''Set bits of one plain int, int.bit_count needs Python 3.10'''
+    return bin(mask).count("1")
+
+def _popcount(masks):
+    '''Number of set bits of every entry of a uint64 array'''
+    if hasattr(np, "bitwise_count"): #numpy 2.0 and newer
+        return np.bitwise_count(masks).astype(np.int64)
+    parts = np.ascontiguousarray(masks, dtype=np.uint64).view(np.uint8).reshape(masks.shape + (8,)) #Older numpy: count the bits of every byte
+    return _BYTE_BITS[parts].sum(axis=-1, dtype=np.int64)
+
+@Profiling.profiled()
+def genreSimilarityScores(masks1, masks2, simFunction = 0, length = GENRE_LENGTH):
+    '''Compare genre bitmasks, same scores as compareMoviesByGenre(movie1, movie2) for every pair. masks1 and masks2 are numbers or arrays
+    that broadcast against each other, for example one mask against the whole catalog (genreMasks), or masks[:, None] and masks for all pairs.
+    length...Length of the genre vectors'''
+    masks1 = np.asarray(masks1, dtype=np.uint64)
+    masks2 = np.asarray(masks2, dtype=np.uint64)
+    return binaryScoresFromCounts(_popcount(masks1), _popcount(masks2), _popcount(masks1 & masks2), length, simFunction)
+
+def genreSimilarityMatrix(movieList, simFunction = 0):
+    '''Compare every movie to every movie by genre, returns a movies x movies array, row = movie1 of compareMoviesByGenre'''
+    masks = genreMasks(movieList)
+    length = len(movieList[0].getGenreVector()) if movieList else GENRE_LENGTH
+    return genreSimilarityScores(masks[:, np.newaxis], masks, simFunction, length)
+
+def commonWatcherCount(watchers1, watchers2):
+    '''Number of user IDs in both sorted posting lists, every ID of the shorter list is looked up in the longer one with a binary search'''
+    if len(watchers1) > len(watchers2): #Search the shorter list in the longer one
+        watchers1, watchers2 = watchers2, watchers1
+    if len(watchers1) == 0:
+        return 0
+    pos = np.searchsorted(watchers2, watchers1) #Where every ID would be inserted in the other list
+    pos[pos == len(watchers2)] = 0 #IDs bigger than everything in the other list, compared against the first entry instead (never equal)
+    return int(np.count_nonzero(watchers2[pos] == watchers1))
+
+@Profiling.profiled()
 def compareMoviesByUsersWatched(movie1, movie2, simFunction = 0):
     '''Given the movieGenresWatchers dictonary and two movieNames, return two vectors over all userIDs that watched both movies, with a 1 if that user watched it the movie and a 0 if not
     SimFunction values: 
@@ -81,6 +144,12 @@ def compareMoviesByUsersWatched(movie1, movie2, simFunction = 0):
     2...Pearson
     3...Jaccard
     4...Manhatten'''
+    if hasattr(movie1, "getWatcherIDs") and hasattr(movie2, "getWatcherIDs"): #Movies with posting lists, the scores only depend on the counts
+        watchers1 = movie1.getWatcherIDs()
+        watchers2 = movie2.getWatcherIDs()
+        common = commonWatcherCount(watchers1, watchers2)
+        return binaryScoresFromCounts(len(watchers1), len(watchers2), common, len(watchers1) + len(watchers2) - common, simFunction)
+    
     #Could have just made this function for one movie and use a vector over all userIDs, but that would take loads of memory and a lot of useless data.
     #These vectors are only used for the comparison between two movies, so all lines of users who didn't watch either one of the movies would be useless.
     #This way I get two vectors with the same length, only containing the users who watched at least one of the two movies.
@@ -123,36 +192,345 @@ def compareMoviesByUsersWatched(movie1, movie2, simFunction = 0):
 
 def euclideanSimilarityScore(vector1, vector2):
     '''Given two vectors, calculate the euclidean similarity'''
-    dis = distance.euclidean(vector1, vector2) #Calculate euclidean distance
+    Profiling.count("Similarity.distance.euclidean")
+    diff = np.subtract(vector1, vector2, dtype=np.float64)
+    dis = math.sqrt(np.dot(diff, diff)) #Calculate euclidean distance
     return 1/(1+dis) #Calculate the similarity and return the results
 
 def cosineSimilarityScore(vector1, vector2):
     '''Given two vectors, calculate the cosine similarity'''
-    dis = distance.cosine(vector1, vector2) #Calculate cosine distance
-    sim = 1 - dis #Similarity = 1 - cosine distance
-    if math.isnan(sim): #Check for nan
+    Profiling.count("Similarity.distance.cosine")
+    u, v = np.asarray(vector1, dtype=np.float64), np.asarray(vector2, dtype=np.float64)
+    norm = math.sqrt(np.dot(u, u) * np.dot(v, v))
+    if norm == 0: #The cosine distance of a zero vector is nan
         return 0
-    return sim #Return result
+    dis = min(max(1 - np.dot(u, v) / norm, 0.0), 2.0) #Calculate cosine distance, clipped against rounding errors
+    return 1 - dis #Similarity = 1 - cosine distance
 
 def pearsonSimilarityScore(vector1, vector2):
     '''Given two vectors (same length), calculate the pearson similarity'''
-    sim = stats.pearsonr(vector1, vector2)[0] #Calculate distance
-    if math.isnan(sim): #Check if it is nan
+    Profiling.count("Similarity.distance.pearson")
+    uv = np.array((vector1, vector2), dtype=np.float64) #Both vectors as rows
+    if uv.shape[1] < 2: #The correlation of a single value is undefined, same as nan
+        return 0
+    uv -= uv.sum(axis=1, keepdims=True) / uv.shape[1] #Center both vectors
+    u, v = uv
+    normU, normV = math.sqrt(np.dot(u, u)), math.sqrt(np.dot(v, v))
+    if normU == 0 or normV == 0: #Constant vectors give nan
         return 0
+    sim = min(max(np.dot(u / normU, v / normV), -1.0), 1.0) #Calculate the correlation, normalized first like scipy.stats.pearsonr
     return 1-abs(sim) #return similarity
 
 def jaccardSimilarityScore(vector1, vector2):
     '''Given two vectors (same length), calculate the jaccard similarity'''
     #Jaccard had errors from when used from the library, this implementation works, so I kept mine
+    Profiling.count("Similarity.distance.jaccard")
     combined = list(dict.fromkeys(vector1 + vector2)) #Unique variables in both vectors
     unique = list(set(vector1) - set(vector2)) #Unique variables in vector1 that are not in vector2
+    if len(combined) == 0: #Two empty vectors (e.g. two movies without any genre) have nothing in common
+        return 0
     return len(unique)/len(combined) #Similarity
     
 def manhattenSimilarityScore(vector1, vector2):
     '''Given two vectors (same length), calculate the manhatten similarity'''
-    return 1/(1+distance.cityblock(vector1, vector2))
+    Profiling.count("Similarity.distance.manhatten")
+    return 1/(1+np.abs(np.subtract(vector1, vector2, dtype=np.float64)).sum())
 
-def similarMovies(targetMovie, movieList, recommendationAmount, simFunction = 0, compareMovieGenres = True):
+def _binaryScore(count1, count2, common, length, simFunction):
+    '''binaryScoresFromCounts for a single pair of plain numbers'''
+    differences = count1 + count2 - 2 * common
+    if simFunction == 0:
+        return 1 / (1 + math.sqrt(differences))
+    elif simFunction == 1:
+        norm = math.sqrt(count1 * count2)
+        return common / norm if norm > 0 else 0
+    elif simFunction == 2:
+        den = math.sqrt(count1 * (length - count1) * count2 * (length - count2))
+        if length < 2 or den == 0: #pearsonr would return nan
+            return 0
+        return 1 - abs(max(-1, min(1, (common * length - count1 * count2) / den)))
+    elif simFunction == 3:
+        union = count1 + count2 - common
+        return (count1 - common) / union if union > 0 else 0
+    elif simFunction == 4:
+        return 1 / (1 + differences)
+    print("ERROR - SimilarityFunction Value unknown")
+    return 0
+
+def binaryScoresFromCounts(count1, count2, common, length, simFunction = 0):
+    '''Similarity of two 0/1 vectors computed from counts only, without building the vectors. Works on numbers and numpy arrays.
+    count1/count2...Number of ones in each vector
+    common...Number of positions that are one in both vectors
+    length...Length of the vectors
+    Gives the same results as the score functions above, Jaccard uses the jaccardSimilarityScore definition on the lists of ones'''
+    if all(isinstance(x, (int, float)) for x in (count1, count2, common, length)): #Single pair, plain math is much faster than numpy
+        return _binaryScore(count1, count2, common, length, simFunction)
+    count1 = np.asarray(count1, dtype=np.float64)
+    count2 = np.asarray(count2, dtype=np.float64)
+    common = np.asarray(common, dtype=np.float64)
+    length = np.asarray(length, dtype=np.float64)
+    differences = count1 + count2 - 2 * common #Positions where exactly one of the vectors is one, also the squared euclidean distance
+    with np.errstate(divide='ignore', invalid='ignore'): #Division by zero gives nan, which is turned into 0 like in the score functions
+        if simFunction == 0:
+            sim = 1 / (1 + np.sqrt(differences))
+        elif simFunction == 1:
+            sim = common / np.sqrt(count1 * count2)
+        elif simFunction == 2:
+            r = (common * length - count1 * count2) / np.sqrt(count1 * (length - count1) * count2 * (length - count2))
+            sim = np.where(length < 2, np.nan, 1 - np.abs(np.clip(r, -1, 1))) #pearsonr needs at least two values
+        elif simFunction == 3:
+            sim = (count1 - common) / (count1 + count2 - common) #Ones only in vector1 / ones in any vector
+        elif simFunction == 4:
+            sim = 1 / (1 + differences)
+        else:
+            print("ERROR - SimilarityFunction Value unknown")
+            sim = np.zeros(np.broadcast(count1, count2, common, length).shape)
+    sim = np.nan_to_num(sim, nan=0.0, posinf=0.0, neginf=0.0)
+    if sim.ndim == 0: #Single pair, return a normal number
+        return float(sim)
+    return sim
+
+#Batched user similarity engine
+#Instead of comparing the target to every user one pair at a time, these functions work on a LoadData.RatingMatrix
+#and compute the statistics over the co-rated movies of the target and all users at once with sparse matrix products.
+#Every similarity function can be written with these sums, so the results match compareUsers (and the custom score in customSimilarity).
+
+CUSTOM_SIMILARITY = 5 #simFunction value for the rating difference score of customSimilarity, only used by the batched engine
+MATRIX_FACTORIZATION = 6 #simFunction value of recommendMovies for the model based engine (MatrixFactorization.FactorModel)
+
+_userKernelCache = weakref.WeakKeyDictionary() #Float/indicator versions of every rating matrix, so they are only built once
+
+def _userKernelMatrices(ratingMatrix):
+    '''Return the matrices the batched engine needs for that rating matrix (cached)'''
+    kernels = _userKernelCache.get(ratingMatrix)
+    if kernels == None:
+        R = ratingMatrix.getCSR().astype(np.float64) #Ratings as floats
+        M = R.copy() #Indicator of rated movies
+        M.data[:] = 1
+        R2 = R.multiply(R).tocsr() #Squared ratings
+        values = np.unique(R.data) #All rating values that occur (1-5 for MovieLens)
+        equal = list() #One indicator matrix per rating value, rating == value
+        atLeast = list() #One indicator matrix per rating value step, rating >= value, used for sum(min(a, b))
+        previous = 0
+        for value in values:
+            E = R.copy()
+            E.data = (R.data == value).astype(np.float64)
+            E.eliminate_zeros()
+            equal.append(E)
+            G = R.copy()
+            G.data = (R.data >= value).astype(np.float64) * (value - previous) #Weight every step by its height, so the sum over the steps is min(a, b)
+            G.eliminate_zeros()
+            atLeast.append(G)
+            previous = value
+        kernels = (R, M, R2, equal, atLeast)
+        _userKernelCache[ratingMatrix] = kernels
+    return kernels
+
+def _kernelArrays(kernels):
+    '''Flatten the matrices of _userKernelMatrices into a dict of arrays for the binary cache'''
+    R, M, R2, equal, atLeast = kernels
+    named = [("R", R), ("M", M), ("R2", R2)] + [("equal" + str(i), E) for i, E in enumerate(equal)] + [("atLeast" + str(i), G) for i, G in enumerate(atLeast)]
+    arrays = {"steps": np.array([len(equal)], dtype=np.int32)} #Number of rating values, so the names can be listed when reading
+    for name, matrix in named:
+        arrays[name + "Data"], arrays[name + "Indices"], arrays[name + "Indptr"] = matrix.data, matrix.indices, matrix.indptr
+    return arrays
+
+def _readKernelArrays(cacheDir, sources):
+    '''Open the cached matrices of the batched engine memory mapped, returns None if the cache is missing or outdated'''
+    steps = DataCache.readCache(cacheDir, sources, ["steps"])
+    if steps == None:
+        return None
+    names = ["R", "M", "R2"] + ["equal" + str(i) for i in range(int(steps["steps"][0]))] + ["atLeast" + str(i) for i in range(int(steps["steps"][0]))]
+    return DataCache.readCache(cacheDir, sources, ["steps"] + [name + part for name in names for part in ("Data", "Indices", "Indptr")])
+
+def shareUserKernels(ratingMatrix, cacheDir, sources):
+    '''Use the matrices of the batched engine for that rating matrix memory mapped from cacheDir, so worker processes share one copy
+    instead of building their own. They are built and written first if the cache is missing or the source files (the ones ratingMatrix
+    was loaded from) changed'''
+    arrays = _readKernelArrays(cacheDir, sources)
+    if arrays == None: #Missing or outdated
+        signature = DataCache.sourceSignature(sources) #Taken before building, see DataCache.writeCache
+        DataCache.writeCache(cacheDir, signature, _kernelArrays(_userKernelMatrices(ratingMatrix)))
+        arrays = _readKernelArrays(cacheDir, sources)
+    from scipy import sparse #Only needed by the batched engine
+    shape = ratingMatrix.getShape()
+    matrix = lambda name: sparse.csr_matrix((arrays[name + "Data"], arrays[name + "Indices"], arrays[name + "Indptr"]), shape=shape, copy=False)
+    steps = range(int(arrays["steps"][0]))
+    _userKernelCache[ratingMatrix] = (matrix("R"), matrix("M"), matrix("R2"), [matrix("equal" + str(i)) for i in steps], [matrix("atLeast" + str(i)) for i in steps])
+
+def _dense(matrix):
+    '''Turn the result of a sparse product into a dense float array'''
+    if hasattr(matrix, "toarray"): #Sparse, checked without importing scipy
+        matrix = matrix.toarray()
+    return np.asarray(matrix, dtype=np.float64)
+
+def scoresFromStats(stats, simFunction):
+    '''Turn the statistics over the co-rated movies into similarity scores, stats is a dict of equally shaped arrays:
+    n...Number of co-rated movies (always needed)
+    Sa, Sb, Saa, Sbb, Sab...Sums of the target and other users ratings, of their squares and of their products
+    Smin...Sum of min(a, b)
+    combined, unique...Number of distinct rating values of the two users, and of the values only the target gave (Jaccard)
+    watched...Number of movies the target watched (custom score)
+    Only the entries the simFunction needs have to be there'''
+    n = stats["n"]
+    scores = np.zeros(n.shape) #Pairs without co-rated movies stay 0, same as compareUsers
+    common = n > 0
+    if simFunction == 0: #Euclidean and Cosine only need the squares and the dot product
+        dis = np.sqrt(np.maximum(stats["Saa"] + stats["Sbb"] - 2 * stats["Sab"], 0))
+        scores[common] = 1 / (1 + dis[common])
+    elif simFunction == 1:
+        norm = np.sqrt(stats["Saa"] * stats["Sbb"])
+        valid = common & (norm > 0) #A zero vector gives nan in the cosine distance, which is 0
+        scores[valid] = stats["Sab"][valid] / norm[valid]
+    elif simFunction == 2: #Pearson from the sums, products and squares
+        Sa, Sb = stats["Sa"], stats["Sb"]
+        num = n * stats["Sab"] - Sa * Sb
+        den = np.sqrt(np.maximum(n * stats["Saa"] - Sa * Sa, 0) * np.maximum(n * stats["Sbb"] - Sb * Sb, 0))
+        valid = common & (n >= 2) & (den > 0) #Constant vectors or a single movie give nan, which is 0
+        r = np.clip(num[valid] / den[valid], -1, 1)
+        scores[valid] = 1 - np.abs(r)
+    elif simFunction == 3: #Jaccard over the distinct rating values, same definition as jaccardSimilarityScore
+        scores[common] = stats["unique"][common] / stats["combined"][common]
+    elif simFunction in (4, CUSTOM_SIMILARITY): #Manhatten and the custom score need the sum of absolute differences
+        dis = stats["Sa"] + stats["Sb"] - 2 * stats["Smin"] #|a - b| = a + b - 2 min(a, b)
+        if simFunction == 4:
+            scores[common] = 1 / (1 + dis[common])
+        else:
+            scores = (n - dis / 4) / np.maximum(stats["watched"], 1) #1 for every co-rated movie with the same rating, minus 0.25 per rating step
+    else:
+        print("ERROR - SimilarityFunction Value unknown")
+    return scores
+
+def _userScoresFromStats(rows, ratingMatrix, simFunction, others = None):
+    '''Compute the similarity of the users at the row indices "rows" (the targets) to all users, returns a len(rows) x users array.
+    others = row indices ... Only compare to these users, returns a len(rows) x len(others) array'''
+    R, M, R2, equal, atLeast = _userKernelMatrices(ratingMatrix)
+    Rt, Mt, R2t = R[rows], M[rows], R2[rows] #Rows of the targets
+    Ro, Mo, R2o = (R, M, R2) if others is None else (R[others], M[others], R2[others]) #Rows of the users they are compared to
+    stats = {"n": _dense(Mt @ Mo.T)} #Number of co-rated movies
+    
+    if simFunction in (0, 1, 2):
+        stats["Saa"] = _dense(R2t @ Mo.T) #Sum of the targets squared ratings over the co-rated movies
+        stats["Sbb"] = _dense(Mt @ R2o.T) #Sum of the other users squared ratings over the co-rated movies
+        stats["Sab"] = _dense(Rt @ Ro.T) #Dot product, only co-rated movies contribute
+    if simFunction in (2, 4, CUSTOM_SIMILARITY):
+        stats["Sa"] = _dense(Rt @ Mo.T)
+        stats["Sb"] = _dense(Mt @ Ro.T)
+    if simFunction == 3:
+        combined = np.zeros(stats["n"].shape)
+        unique = np.zeros(stats["n"].shape)
+        for E in equal: #Check every rating value separately
+            Eo = E if others is None else E[others]
+            inTarget = _dense(E[rows] @ Mo.T) > 0 #The target gave that rating to a co-rated movie
+            inOther = _dense(Mt @ Eo.T) > 0 #The other user gave that rating to a co-rated movie
+            combined += inTarget | inOther
+            unique += inTarget & ~inOther
+        stats["combined"] = combined
+        stats["unique"] = unique
+    elif simFunction in (4, CUSTOM_SIMILARITY):
+        stats["Smin"] = sum(_dense(G[rows] @ (G if others is None else G[others]).T) for G in atLeast) #Sum of min(a, b) over the co-rated movies
+        stats["watched"] = np.diff(M.indptr)[rows].reshape(-1, 1).astype(np.float64) #Number of movies the targets watched
+    return scoresFromStats(stats, simFunction)
+
+def userSimilarityScores(ratingMatrix, targetUserID, simFunction = 0, rows = None):
+    '''Compare one user to all users in the rating matrix at once, returns an array with one score per matrix row
+    (use ratingMatrix.getUserIndex to find a user). rows = row indices ... Only compare to these users, one score per row. SimFunction values: 
+    0...Euclidean
+    1...Cosine
+    2...Pearson
+    3...Jaccard
+    4...Manhatten
+    5...Custom (rating difference score of customSimilarity)'''
+    row = ratingMatrix.getUserIndex(targetUserID)
+    if row == -1: #A user without ratings has nothing in common with anyone
+        return np.zeros(ratingMatrix.getShape()[0] if rows is None else len(rows))
+    return _userScoresFromStats([row], ratingMatrix, simFunction, rows)[0]
+
+def userSimilarityMatrix(ratingMatrix, simFunction = 0):
+    '''Compare all users to all users, returns a users x users array, row = target user, same simFunction values as userSimilarityScores'''
+    return _userScoresFromStats(np.arange(ratingMatrix.getShape()[0]), ratingMatrix, simFunction)
+
+@Profiling.profiled()
+def _userSimList(targetUser, userList, ratingMatrix, simFunction):
+    '''Build the list of (userID, similarity) tuples of recommendMovies and customSimilarity with the batched engine'''
+    scores = userSimilarityScores(ratingMatrix, targetUser.getID(), simFunction) #Score all users at once
+    userSimList = list()
+    for user in userList: #Keep the order of the user list, so ties are sorted the same way
+        if not user.getID() == targetUser.getID():
+            row = ratingMatrix.getUserIndex(user.getID())
+            userSimList.append((user.getID(), float(scores[row]) if row != -1 else 0))
+    return userSimList
+
+@Profiling.profiled()
+def _userSimListFromScores(targetUser, userList, userScores, simFunction):
+    '''Build the list of (userID, similarity) tuples from an object with a getUserScores(userID, simFunction) method,
+    that returns an array with the score of every user at the position of its ID.
+    If the object has a getTopUsers(userID, simFunction) method instead, its list of the most similar users is used as it is'''
+    if hasattr(userScores, "getTopUsers"): #Only the neighbors it found, the other users are never looked at
+        return [tup for tup in userScores.getTopUsers(targetUser.getID(), simFunction) if not tup[0] == targetUser.getID()]
+    scores = userScores.getUserScores(targetUser.getID(), simFunction)
+    userSimList = list()
+    for user in userList: #Keep the order of the user list, so ties are sorted the same way
+        if not user.getID() == targetUser.getID():
+            ID = int(user.getID())
+            userSimList.append((user.getID(), float(scores[ID]) if ID < len(scores) else 0))
+    return userSimList
+
+def _useMovieIndex(movieIndex, simFunction, compareMovieGenres):
+    '''Check if a movie index was given and fits the simFunction and comparison mode'''
+    if movieIndex == None:
+        return False
+    if not movieIndex.matches(simFunction, compareMovieGenres):
+        print("ERROR - Movie index was built for a different SimilarityFunction or mode, comparing all movies instead")
+        return False
+    return True
+
+def _bestFirst(userSimList):
+    '''Yield the (userID, similarity) tuples from the highest to the lowest similarity, ties in list order (same as a stable sort).
+    Uses a heap, so only the users that are actually looked at get sorted'''
+    heap = [(-tup[1], i) for i, tup in enumerate(userSimList)]
+    heapq.heapify(heap) #O(n)
+    while heap:
+        yield userSimList[heapq.heappop(heap)[1]] #O(log n) per user
+
+def _averageRating(movie, movieList, movieStats):
+    '''Average rating of a movie, the tie breaker of the recommendations. O(1) lookup in the statistics table if one is given'''
+    if not movieStats == None:
+        return movieStats.getMean(movie.getID())
+    return float(movieList[int(movie.getID()) - 1].getRating()) #Movie IDs start at 1
+
+def _addPopularMovies(recommendations, movieList, movieStats, seenIDs, recommendationAmount):
+    '''Fill up recommendations that are shorter than recommendationAmount with the most popular movies the target hasn't seen,
+    they come last with a similarity of 0'''
+    missing = int(recommendationAmount) - len(recommendations)
+    if movieStats == None or missing <= 0:
+        return recommendations
+    names = {rec[0] for rec in recommendations}
+    for movieID in movieStats.mostPopular(missing + len(names), seenIDs): #Enough to skip the ones that are already recommended
+        if len(recommendations) >= int(recommendationAmount):
+            break
+        movie = movieList[movieID - 1] #Movie IDs start at 1
+        if not movie.getName() in names:
+            names.add(movie.getName())
+            recommendations.append((movie.getName(), 0.0, movieStats.getMean(movieID)))
+    return recommendations
+
+@Profiling.profiled()
+def _factorRecommendations(targetUser, movieList, recommendationAmount, recommendUsers, movieStats, factorModel):
+    '''recommendMovies with a matrix factorization model: one dot product per movie and a top-N, the score is the predicted rating'''
+    if factorModel == None:
+        raise ValueError("simFunction " + str(MATRIX_FACTORIZATION) + " needs a factorModel")
+    if recommendUsers: #Closest users in the factor space
+        return factorModel.similarUsers(targetUser.getID(), recommendationAmount)
+    seenIDs = {movie.getID() for movie in targetUser.getWatchedMovies()}
+    recommendedMovieList = list()
+    for movieID, score in factorModel.topMovies(targetUser.getID(), recommendationAmount, seenIDs):
+        movie = movieList[movieID - 1] #Movie IDs start at 1
+        recommendedMovieList.append((movie.getName(), score, _averageRating(movie, movieList, movieStats)))
+    return _addPopularMovies(recommendedMovieList, movieList, movieStats, seenIDs, recommendationAmount)
+
+@Profiling.profiled()
+def similarMovies(targetMovie, movieList, recommendationAmount, simFunction = 0, compareMovieGenres = True, movieIndex = None, movieCache = None):
     '''This will return a List of similar movies for the target movie
     SimFunction values: 
     0...Euclidean
@@ -161,22 +539,41 @@ def similarMovies(targetMovie, movieList, recommendationAmount, simFunction = 0,
     3...Jaccard
     4...Manhatten
     
-    Compare Movie Genres = True ... Movies will be compared by their genres'''
+    Compare Movie Genres = True ... Movies will be compared by their genres
+    movieIndex = SimilarityIndex.MovieIndex built for the same simFunction and mode ... Look up the neighbors instead of comparing to all movies
+    movieCache = SimilarityCache.MovieSimilarityCache of the same catalog ... Memoize the movie pairs the loop compares'''
     
     recList = list() #List for all the recommendation tuples (movie name, simScore, average rating)
     
+    if _useMovieIndex(movieIndex, simFunction, compareMovieGenres) and recommendationAmount <= movieIndex.getK(): #The index has enough neighbors stored
+        movieIDs, scores = movieIndex.getNeighbors(targetMovie.getID()) #Already in the right order
+        for movieID, simScore in zip(movieIDs[:recommendationAmount], scores):
+            movie = movieList[int(movieID) - 1] #Movie IDs start at 1
+            recList.append((movie.getName(), simScore, movie.getRating()))
+        return recList
+    
+    if compareMovieGenres and hasattr(targetMovie, "getGenreMask") and all(hasattr(movie, "getGenreMask") for movie in movieList): #Score the whole catalog at once
+        scores = genreSimilarityScores(targetMovie.getGenreMask(), genreMasks(movieList), simFunction, len(targetMovie.getGenreVector())).tolist()
+        recList = [(movie.getName(), simScore, movie.getRating()) for movie, simScore in zip(movieList, scores) if not movie.getID() == targetMovie.getID()]
+        with Profiling.stage("Similarity.similarMovies.rank"):
+            return heapq.nlargest(int(recommendationAmount), recList, key = lambda x: (x[1],int(x[2])))
+    
     for movie in movieList: #Loop over all movies
         if not movie.getID() == targetMovie.getID(): #Skip the target
             simScore = 0 #Variable for the similarity score
-            if compareMovieGenres: #Compare either by Genres or Users who watched that movie
+            if not movieCache == None: #Memoized pairs
+                simScore = movieCache.getSimilarity(targetMovie, movie, simFunction, compareMovieGenres)
+            elif compareMovieGenres: #Compare either by Genres or Users who watched that movie
                 simScore = compareMoviesByGenre(targetMovie, movie, simFunction)
             else:
                 simScore = compareMoviesByUsersWatched(targetMovie, movie, simFunction)
             recList.append((movie.getName(), simScore, movie.getRating())) #Add the tuple to the list
-    recList.sort(key = lambda x: (x[1],int(x[2])), reverse = True) #Sort the final list
-    return recList[:recommendationAmount] #Return the amount of asked for recommendations
+    with Profiling.stage("Similarity.similarMovies.rank"):
+        return heapq.nlargest(int(recommendationAmount), recList, key = lambda x: (x[1],int(x[2]))) #Only keep the asked for amount of recommendations, same order as a sort
 
-def recommendMovies(targetUser, userList, movieList, recommendationAmount, simFunction = 0, compareMovieGenres = True, recommendUsers = False):
+@Profiling.profiled()
+def recommendMovies(targetUser, userList, movieList, recommendationAmount, simFunction = 0, compareMovieGenres = True, recommendUsers = False, ratingMatrix = None, movieIndex = None, userScores = None,
+                    movieStats = None, factorModel = None, movieCache = None):
     '''This will return a List of Movie-Recommendations for the target User
     SimFunction values: 
     0...Euclidean
@@ -184,54 +581,96 @@ def recommendMovies(targetUser, userList, movieList, recommendationAmount, simFu
     2...Pearson
     3...Jaccard
     4...Manhatten
+    6...Matrix factorization, the movies with the highest predicted rating of factorModel (compareMovieGenres and the other engines are not used)
     
     Compare Movie Genres = True ... Movies will be compared by their genres
     Compare Movie Genres = False ... Movies will be compared by the users who watched and rated them
-    recommendUsers = False ... Recommend Movies, if True it will return closest users'''
+    recommendUsers = False ... Recommend Movies, if True it will return closest users
+    ratingMatrix = LoadData.RatingMatrix of the same data ... Score all users at once with the batched engine instead of compareUsers
+    movieIndex = SimilarityIndex.MovieIndex built for the same simFunction and mode ... Look up the movie similarities, movies outside the K neighbors count as 0
+    userScores = Object with getUserScores(userID, simFunction) (e.g. LiveUpdates.LiveRatings) ... Take the user similarities from it,
+    or with getTopUsers(userID, simFunction) (e.g. UserANN.UserANNIndex) ... Only walk the neighbors it returns
+    movieStats = MovieStats.MovieStats of the same data ... O(1) average rating tie breaker, and too short lists are filled up with popular movies
+    factorModel = MatrixFactorization.FactorModel trained on the same data ... Needed for simFunction 6
+    movieCache = SimilarityCache.MovieSimilarityCache of the same catalog ... Memoize the movie pairs, they repeat across neighbors and requests
+    (only in the watchers mode, the genre mode scores every candidate against all seen movies at once from the genre bitmasks)'''
     
+    if simFunction == MATRIX_FACTORIZATION:
+        return _factorRecommendations(targetUser, movieList, recommendationAmount, recommendUsers, movieStats, factorModel)
+    
+    useIndex = _useMovieIndex(movieIndex, simFunction, compareMovieGenres)
     
     userSimList = list() #List for tuples of userID and the similarity to the target user
     
-    for user in userList: #Loop over all users
-        if not user.getID() == targetUser.getID(): #Ignore the target user
-            simScore = compareUsers(targetUser, user, simFunction) #Calculate the similarity between the users
-            userSimList.append((user.getID(), simScore)) #Add the tuple to the list
+    with Profiling.stage("Similarity.recommendMovies.userSimilarity"): #Similarity of the target to every user
+        if not userScores == None: #Scores kept up to date somewhere else
+            userSimList = _userSimListFromScores(targetUser, userList, userScores, simFunction)
+        elif not ratingMatrix == None: #Batched engine, same scores as the loop below
+            userSimList = _userSimList(targetUser, userList, ratingMatrix, simFunction)
+        else:
+            for user in userList: #Loop over all users
+                if not user.getID() == targetUser.getID(): #Ignore the target user
+                    simScore = compareUsers(targetUser, user, simFunction) #Calculate the similarity between the users
+                    userSimList.append((user.getID(), simScore)) #Add the tuple to the list
             
-    userSimList.sort(key = lambda x: x[1], reverse = True) #Sort the list by the similarity score
     moviesTarget = targetUser.getWatchedMovies() #Get the movies the target user watched
+    seenMasks = None #Genre bitmasks of the movies the target watched, to compare a movie to all of them at once
+    if compareMovieGenres and not useIndex and all(hasattr(movie, "getGenreMask") for movie in moviesTarget):
+        seenMasks = genreMasks(moviesTarget)
+        genreLength = len(moviesTarget[0].getGenreVector()) if moviesTarget else GENRE_LENGTH
     recommendedMovieList = list() #List for all the recommended movies
-    userList.sort(key = lambda x: int(x.getID())) #Sort the user list by ID, just makes it easier to find specific users
+    recommendedNames = set() #Names of the movies in recommendedMovieList, for the duplicate check
+    seenIDs = {movie.getID() for movie in moviesTarget} #IDs of the movies the target has seen
     
     if recommendUsers: #If it should recommend users
-        return userSimList[:recommendationAmount] #Return the n most similar users
-    
-    for tup in userSimList: #Loop over all tuples
-        movies = userList[int(tup[0])-1].getWatchedMovies() #Get the movies that user watched
-        notSeen = movies #Variable for all the movies that user watched that the target user hasn't seen
-        for movie in moviesTarget: #Loop over all movies the target has seen
-            for otherMovie in movies: #Loop over all movies the user has seen
-                if movie.getID() == otherMovie.getID(): #If a movie is in both remove it
-                    movies.remove(otherMovie) #Remove the movie
-                    break #Once removed, break out of that loop and look for the next movie
-        for potMovie in notSeen: #Loop over all potential movies
-            sim = 0 #Variable for the similarity
-            if int(potMovie.getRating()) >= 4: #Ignore all movies the user rated lower than a 4, considering that those might fit, but are also just bad
-                for seenMovie in moviesTarget: #Compare the movie to all movies the target has seen and calculate an average similarity
-                    if compareMovieGenres: #Choose if to compare the by genre or users who watched it
-                        sim += compareMoviesByGenre(seenMovie, potMovie, simFunction) #Calculate the similarity
+        return heapq.nlargest(int(recommendationAmount), userSimList, key = lambda x: x[1]) #Return the n most similar users
+    users = {user.getID(): user for user in userList} #Find the neighbors by ID, the IDs don't have to match the list positions
+    
+    with Profiling.stage("Similarity.recommendMovies.candidates"): #Score the movies of the most similar users
+        for tup in _bestFirst(userSimList): #Loop over the users from the most to the least similar, stops early once there are enough movies
+            neighbor = users.get(tup[0])
+            if neighbor == None: #Not in the user list (e.g. a neighbor of an index built on other data)
+                continue
+            movies = neighbor.getWatchedMovies() #Get the movies that user watched
+            notSeen = [movie for movie in movies if not movie.getID() in seenIDs] #All the movies that user watched that the target user hasn't seen
+            for potMovie in notSeen: #Loop over all potential movies
+                sim = 0 #Variable for the similarity
+                if int(potMovie.getRating()) >= 4: #Ignore all movies the user rated lower than a 4, considering that those might fit, but are also just bad
+                    if potMovie.getName() in recommendedNames: #Skip the movie if it is already in the list of recommendations, before scoring it again
+                        Profiling.count("Similarity.recommendMovies.duplicates")
+                        continue
+                    if not seenMasks is None: #Genre scores against all seen movies at once
+                        for score in genreSimilarityScores(seenMasks, potMovie.getGenreMask(), simFunction, genreLength).tolist():
+                            sim += score #Added up one by one in the same order as the loop below, so the sum is the same
                     else:
-                        sim += compareMoviesByUsersWatched(movieList[int(seenMovie.getID())-1], movieList[int(potMovie.getID())-1], simFunction) #Calculate the similarity
-                sim /= len(moviesTarget) #Calculate the average similarity score
-                temp = [item for item in recommendedMovieList if item[0] == potMovie.getName()] #If the movie is already in the list of recommendations
-                if len(temp) == 0:
-                    recommendedMovieList.append((potMovie.getName(), sim, float(movieList[int(potMovie.getID())].getRating())))
-        if len(recommendedMovieList) >= int(recommendationAmount) or len(recommendedMovieList) == len(movieList): #Once enough movies are in the recommendations, stop the loop
-            break
-    recommendedMovieList.sort(key = lambda x: (x[1], x[2]), reverse = True) #Sort the list by similarity and average rating
-    return recommendedMovieList[:recommendationAmount] #Return the asked for amount of recommendations
+                        for seenMovie in moviesTarget: #Compare the movie to all movies the target has seen and calculate an average similarity
+                            if useIndex: #O(K) lookup in the precomputed neighbors
+                                sim += movieIndex.getSimilarity(seenMovie.getID(), potMovie.getID())
+                            elif not movieCache == None and compareMovieGenres: #Memoized pairs
+                                sim += movieCache.getSimilarity(seenMovie, potMovie, simFunction, True)
+                            elif not movieCache == None:
+                                sim += movieCache.getSimilarity(movieList[int(seenMovie.getID())-1], movieList[int(potMovie.getID())-1], simFunction, False)
+                            elif compareMovieGenres: #Choose if to compare the by genre or users who watched it
+                                sim += compareMoviesByGenre(seenMovie, potMovie, simFunction) #Calculate the similarity
+                            else:
+                                sim += compareMoviesByUsersWatched(movieList[int(seenMovie.getID())-1], movieList[int(potMovie.getID())-1], simFunction) #Calculate the similarity
+                    sim /= len(moviesTarget) #Calculate the average similarity score
+                    recommendedNames.add(potMovie.getName())
+                    recommendedMovieList.append((potMovie.getName(), sim, _averageRating(potMovie, movieList, movieStats)))
+            if len(recommendedMovieList) >= int(recommendationAmount) or len(recommendedMovieList) == len(movieList): #Once enough movies are in the recommendations, stop the loop
+                break
+    with Profiling.stage("Similarity.recommendMovies.rank"): #Top-N by similarity and average rating
+        recommendedMovieList = heapq.nlargest(int(recommendationAmount), recommendedMovieList, key = lambda x: (x[1], x[2])) #The asked for amount of recommendations, by similarity and average rating
+        return _addPopularMovies(recommendedMovieList, movieList, movieStats, seenIDs, recommendationAmount)
 
-def customSimilarity(targetUser, userList, movieList, recommendationAmount, recUsers = False):
-    '''A recommendation function using a custom similarity, just curious how it will do'''
+@Profiling.profiled()
+def customSimilarity(targetUser, userList, movieList, recommendationAmount, recUsers = False, ratingMatrix = None, userScores = None, movieStats = None, movieCache = None):
+    '''A recommendation function using a custom similarity, just curious how it will do
+    ratingMatrix = LoadData.RatingMatrix of the same data ... Score all users at once with the batched engine
+    userScores = Object with getUserScores(userID, simFunction) (e.g. LiveUpdates.LiveRatings) ... Take the user similarities from it,
+    or with getTopUsers(userID, simFunction) (e.g. UserANN.UserANNIndex) ... Only walk the neighbors it returns
+    movieStats = MovieStats.MovieStats of the same data ... O(1) average rating tie breaker, and too short lists are filled up with popular movies
+    movieCache = SimilarityCache.MovieSimilarityCache of the same catalog ... Memoize the movie pairs, they repeat across neighbors and requests'''
     
     #This works pretty much the same as the recommendation function, so I won't comment everything except the parts that are different
     
@@ -239,41 +678,53 @@ def customSimilarity(targetUser, userList, movieList, recommendationAmount, recU
     
     userSimList = list()
     
-    for user in userList:
-        if not user.getID() == targetUser.getID():
-            simScore = 0
-            tempMovieList = user.getWatchedMovies()
-            for movie in tempMovieList:
-                tempMovie = next((x for x in moviesTarget if x.getID() == movie.getID()), None)
-                if not tempMovie == None:
-                    simScore += 1 - (float(abs(int(tempMovie.getRating()) - int(movie.getRating())))/4) #The similarity score depends just on the difference in ratings
-            simScore /= len(moviesTarget) #If both rated it the same it is 1, and 0.25 difference for every rating they are different
-            userSimList.append((user.getID(), simScore))
+    with Profiling.stage("Similarity.customSimilarity.userSimilarity"): #Similarity of the target to every user
+        if not userScores == None: #Scores kept up to date somewhere else
+            userSimList = _userSimListFromScores(targetUser, userList, userScores, CUSTOM_SIMILARITY)
+        elif not ratingMatrix == None: #Batched engine with the same rating difference score
+            userSimList = _userSimList(targetUser, userList, ratingMatrix, CUSTOM_SIMILARITY)
+        else:
+            for user in userList:
+                if not user.getID() == targetUser.getID():
+                    simScore = 0
+                    tempMovieList = user.getWatchedMovies()
+                    for movie in tempMovieList:
+                        tempMovie = next((x for x in moviesTarget if x.getID() == movie.getID()), None)
+                        if not tempMovie == None:
+                            simScore += 1 - (float(abs(int(tempMovie.getRating()) - int(movie.getRating())))/4) #The similarity score depends just on the difference in ratings
+                    simScore /= len(moviesTarget) #If both rated it the same it is 1, and 0.25 difference for every rating they are different
+                    userSimList.append((user.getID(), simScore))
             
-    userSimList.sort(key = lambda x: x[1], reverse = True)
     if recUsers:
-        return userSimList[:recommendationAmount]
+        return heapq.nlargest(int(recommendationAmount), userSimList, key = lambda x: x[1])
     recommendedMovieList = list()
-    userList.sort(key = lambda x: int(x.getID()))
-    
-    for tup in userSimList: #Loop over all tuples
-        movies = userList[int(tup[0])-1].getWatchedMovies() #Get the movies that user watched
-        notSeen = movies #Variable for all the movies that user watched that the target user hasn't seen
-        for movie in moviesTarget: #Loop over all movies the target has seen
-            for otherMovie in movies: #Loop over all movies the user has seen
-                if movie.getID() == otherMovie.getID(): #If a movie is in both remove it
-                    movies.remove(otherMovie) #Remove the movie
-                    break #Once removed, break out of that loop and look for the next movie
-        for potMovie in notSeen: #Loop over all potential movies
-            sim = 0 #Variable for the similarity
-            if int(potMovie.getRating()) >= 4: #Ignore all movies the user rated lower than a 4, considering that those might fit, but are also just bad
-                for seenMovie in moviesTarget: #Compare the movie to all movies the target has seen and calculate an average similarity
-                    sim += compareMoviesByUsersWatched(movieList[int(seenMovie.getID())-1], movieList[int(potMovie.getID())-1], 2) #Calculate the similarity
-                sim /= len(moviesTarget) #Calculate the average similarity score
-                temp = [item for item in recommendedMovieList if item[0] == potMovie.getName()] #If the movie is already in the list of recommendations
-                if len(temp) == 0:
-                    recommendedMovieList.append((potMovie.getName(), sim, float(movieList[int(potMovie.getID())].getRating())))
-        if len(recommendedMovieList) >= int(recommendationAmount) or len(recommendedMovieList) == len(movieList): #Once enough movies are in the recommendations, stop the loop
-            break
-    recommendedMovieList.sort(key = lambda x: (x[1], x[2]), reverse = True) #Sort the list by similarity and average rating
-    return recommendedMovieList[:recommendationAmount] #Return the asked for amount of recommendations
\ No newline at end of file
+    recommendedNames = set()
+    seenIDs = {movie.getID() for movie in moviesTarget}
+    users = {user.getID(): user for user in userList}
+    
+    with Profiling.stage("Similarity.customSimilarity.candidates"): #Score the movies of the most similar users
+        for tup in _bestFirst(userSimList): #Loop over the users from the most to the least similar
+            neighbor = users.get(tup[0])
+            if neighbor == None: #Not in the user list (e.g. a neighbor of an index built on other data)
+                continue
+            movies = neighbor.getWatchedMovies() #Get the movies that user watched
+            notSeen = [movie for movie in movies if not movie.getID() in seenIDs] #All the movies that user watched that the target user hasn't seen
+            for potMovie in notSeen: #Loop over all potential movies
+                sim = 0 #Variable for the similarity
+                if int(potMovie.getRating()) >= 4: #Ignore all movies the user rated lower than a 4, considering that those might fit, but are also just bad
+                    if potMovie.getName() in recommendedNames: #Skip the movie if it is already in the list of recommendations, before scoring it again
+                        Profiling.count("Similarity.customSimilarity.duplicates")
+                        continue
+                    for seenMovie in moviesTarget: #Compare the movie to all movies the target has seen and calculate an average similarity
+                        if not movieCache == None: #Memoized pairs
+                            sim += movieCache.getSimilarity(movieList[int(seenMovie.getID())-1], movieList[int(potMovie.getID())-1], 2, False)
+                        else:
+                            sim += compareMoviesByUsersWatched(movieList[int(seenMovie.getID())-1], movieList[int(potMovie.getID())-1], 2) #Calculate the similarity
+                    sim /= len(moviesTarget) #Calculate the average similarity score
+                    recommendedNames.add(potMovie.getName())
+                    recommendedMovieList.append((potMovie.getName(), sim, _averageRating(potMovie, movieList, movieStats)))
+            if len(recommendedMovieList) >= int(recommendationAmount) or len(recommendedMovieList) == len(movieList): #Once enough movies are in the recommendations, stop the loop
+                break
+    with Profiling.stage("Similarity.customSimilarity.rank"): #Top-N by similarity and average rating
+        recommendedMovieList = heapq.nlargest(int(recommendationAmount), recommendedMovieList, key = lambda x: (x[1], x[2])) #The asked for amount of recommendations, by similarity and average rating
+        return _addPopularMovies(recommendedMovieList, movieList, movieStats, seenIDs, recommendationAmount)
\ No newline at end of file
@@ -0,0 +1,230 @@
+import struct #Converts the scores to the words of the dense tables
+import threading #The cache is shared by all threads of a process
+import collections #OrderedDict for the LRU mode
+import numpy as np #Dense tables of the scores
+import Similarity
+
+#Memoized movie-movie similarities
+#recommendMovies compares every candidate movie to every movie the target has seen, and the same pairs come up again for every
+#neighbor who rated the candidate and for every other user. The cache computes a pair the first time it is asked for and keeps the score.
+#If the catalog is known and small enough, every (simFunction, mode) gets a dense table with one slot per pair (a triangle for the
+#symmetric scores, a full square for Jaccard, which depends on the order), otherwise the scores are kept in a bounded LRU.
+#Dense tables can live in named shared memory, so all worker processes of a pool fill and read the same table. The process that owns
+#the cache creates the shared tables with prepare (and removes them with close) before it starts the workers, the workers only attach.
+#A slot is one aligned 8 byte word, 0 while the pair is unknown, otherwise the score XOR _KNOWN_BITS. A score is published with a single
+#word store, so a reader sees either nothing or the whole score, and every process computes the same value for a pair.
+#Only the pairwise paths use the cache: the genre mode of recommendMovies scores all seen movies at once from the genre bitmasks,
+#which is cheaper than a lookup per pair, so there the cache only covers similarMovies.
+
+DEFAULT_CAPACITY = 1000000 #Pairs kept in the LRU mode
+DEFAULT_DENSE_BYTES = 64 * 1024 * 1024 #Largest dense table per (simFunction, mode), bigger catalogs use the LRU
+ASYMMETRIC_FUNCTIONS = (3,) #Jaccard counts the ones only in the first vector, so (a, b) and (b, a) differ
+_KNOWN_BITS = 0x7ff8dead5eed0001 #A NaN pattern no score has, XORed into every stored word so that 0 means unknown
+
+class _DenseTable:
+    '''One score word per movie pair, optionally in shared memory'''
+    def __init__(self, size, symmetric, sharedName = None, create = False):
+        '''Constructor, size = largest movie ID + 1. sharedName = name of the shared memory block,
+        created if create is True (the owner), otherwise it has to exist already and is only attached'''
+        self.__size = size
+        self.__symmetric = symmetric
+        slots = size * (size + 1) // 2 if symmetric else size * size
+        self.__memory = None
+        self.__owner = False #True if this process created the shared block and has to remove it
+        if sharedName == None:
+            buffer = bytearray(slots * 8)
+        else:
+            from multiprocessing import shared_memory #Python 3.8+, only needed for shared tables
+            if create:
+                self.__memory = shared_memory.SharedMemory(name=sharedName, create=True, size=slots * 8) #Zero filled, so nothing is known yet
+                self.__owner = True
+            else:
+                try:
+                    try:
+                        self.__memory = shared_memory.SharedMemory(name=sharedName, track=False) #Only the owner removes the block
+                    except TypeError: #Before Python 3.13 attaching registers the block too, pool workers use the tracker of the owner,
+                        self.__memory = shared_memory.SharedMemory(name=sharedName) #where it is registered already
+                except FileNotFoundError:
+                    raise ValueError("Shared table " + sharedName + " doesn't exist, the owner has to prepare it before starting the workers")
+            buffer = self.__memory.buf
+        self.__words = np.frombuffer(buffer, dtype=np.uint64, count=slots)
+
+    def slot(self, ID1, ID2):
+        '''Slot of a pair of movie IDs, -1 if an ID is outside the table'''
+        if not (0 <= ID1 < self.__size and 0 <= ID2 < self.__size):
+            return -1
+        if not self.__symmetric:
+            return ID1 * self.__size + ID2
+        if ID1 < ID2:
+            ID1, ID2 = ID2, ID1
+        return ID1 * (ID1 + 1) // 2 + ID2 #Lower triangle, row by row
+
+    def get(self, slot):
+        '''Score of a slot, or None if it wasn't computed yet'''
+        word = int(self.__words[slot]) #One aligned 8 byte load
+        if word == 0:
+            return None
+        return struct.unpack("<d", struct.pack("<Q", word ^ _KNOWN_BITS))[0]
+
+    def set(self, slot, value):
+        '''Store the score of a slot with a single word store, so a reader never sees a half written slot'''
+        self.__words[slot] = struct.unpack("<Q", struct.pack("<d", float(value)))[0] ^ _KNOWN_BITS
+
+    def forget(self, ID):
+        '''Forget all pairs with this movie ID'''
+        if not 0 <= ID < self.__size:
+            return
+        if not self.__symmetric:
+            self.__words.reshape(self.__size, self.__size)[ID, :] = 0
+            self.__words.reshape(self.__size, self.__size)[:, ID] = 0
+            return
+        start = ID * (ID + 1) // 2
+        self.__words[start:start + ID + 1] = 0 #Pairs with a smaller or equal ID
+        rows = np.arange(ID + 1, self.__size)
+        self.__words[rows * (rows + 1) // 2 + ID] = 0 #Pairs with a bigger ID
+
+    def clear(self):
+        '''Forget all pairs'''
+        self.__words[:] = 0
+
+    def count(self):
+        '''Number of pairs that are known'''
+        return int(np.count_nonzero(self.__words))
+
+    def getSizeInBytes(self):
+        '''Memory of the table'''
+        return self.__words.nbytes
+
+    def close(self):
+        '''Release the shared memory, the creator also removes the block'''
+        if self.__memory == None:
+            return
+        self.__words = None #The buffer can only be closed once no array uses it
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
+        self.__memory = None
+
+class MovieSimilarityCache:
+    '''Shared cache of movie-movie similarities, keyed by the movie pair, the simFunction and the comparison mode.
+    Has the getSimilarity interface recommendMovies, customSimilarity and similarMovies take as movieCache'''
+    def __init__(self, movieList = None, capacity = DEFAULT_CAPACITY, maxDenseBytes = DEFAULT_DENSE_BYTES, sharedName = None):
+        '''Constructor
+        movieList = The catalog, dense tables are used if the largest movie ID fits maxDenseBytes, without it the LRU is used
+        capacity = Pairs kept in the LRU mode, the least recently used pair is dropped first
+        sharedName = Prefix of the shared memory blocks of the dense tables, every process that uses the same prefix shares the tables.
+        The owner creates them with prepare before starting the workers, the other processes only attach to prepared tables'''
+        self.__size = max((int(movie.getID()) for movie in movieList), default=-1) + 1 if movieList else 0
+        self.__dense = self.__size > 0 and self.__size * self.__size * 8 <= maxDenseBytes #The square (Jaccard) is the bigger table
+        self.__capacity = int(capacity)
+        self.__sharedName = sharedName
+        self.__tables = dict() #(simFunction, compareMovieGenres) -> _DenseTable, created on first use
+        self.__lru = collections.OrderedDict() #(simFunction, compareMovieGenres, ID1, ID2) -> score
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def __str__(self):
+        '''To String function: Print the mode and the counters'''
+        return ("MovieSimilarityCache(" + self.getMode() + ", " + str(self.__hits) + " hits, " + str(self.__misses) + " misses, "
+                + str(len(self)) + " pairs)")
+
+    def __len__(self):
+        '''Number of pairs in the cache'''
+        with self.__lock:
+            if self.__dense:
+                return sum(table.count() for table in self.__tables.values())
+            return len(self.__lru)
+
+    def getMode(self):
+        '''Returns "dense" or "lru"'''
+        return "dense" if self.__dense else "lru"
+
+    def __table(self, simFunction, compareMovieGenres, create = False):
+        '''Dense table of a simFunction and mode, created on first use (shared tables only by prepare). Called with the lock held'''
+        key = (simFunction, compareMovieGenres)
+        table = self.__tables.get(key)
+        if table == None:
+            name = None
+            if self.__sharedName:
+                name = self.__sharedName + "_" + ("genre" if compareMovieGenres else "watchers") + str(simFunction)
+            table = self.__tables[key] = _DenseTable(self.__size, not simFunction in ASYMMETRIC_FUNCTIONS, name, create)
+        return table
+
+    def prepare(self, simFunction = 0, compareMovieGenres = True):
+        '''Create the dense table of a simFunction and mode now instead of on first use. With sharedName this process becomes the owner
+        of the shared block and removes it in close, a pool parent has to prepare every table its workers use before starting them'''
+        if self.__dense:
+            with self.__lock:
+                self.__table(simFunction, compareMovieGenres, True)
+
+    def getSimilarity(self, movie1, movie2, simFunction = 0, compareMovieGenres = True):
+        '''Similarity of two movies, the same as Similarity.compareMoviesByGenre / compareMoviesByUsersWatched(movie1, movie2, simFunction).
+        Computed on the first request of the pair, afterwards taken from the cache'''
+        ID1, ID2 = int(movie1.getID()), int(movie2.getID())
+        with self.__lock:
+            if self.__dense:
+                table = self.__table(simFunction, compareMovieGenres)
+                slot = table.slot(ID1, ID2)
+                sim = table.get(slot) if slot >= 0 else None
+            else:
+                if not simFunction in ASYMMETRIC_FUNCTIONS and ID1 > ID2: #The order doesn't matter, store the pair once
+                    key = (simFunction, compareMovieGenres, ID2, ID1)
+                else:
+                    key = (simFunction, compareMovieGenres, ID1, ID2)
+                sim = self.__lru.get(key)
+                if not sim == None:
+                    self.__lru.move_to_end(key)
+            if not sim == None:
+                self.__hits += 1
+                return sim
+            self.__misses += 1
+
+        if compareMovieGenres: #Computed without the lock, two threads may compute the same pair, both get the same score
+            sim = Similarity.compareMoviesByGenre(movie1, movie2, simFunction)
+        else:
+            sim = Similarity.compareMoviesByUsersWatched(movie1, movie2, simFunction)
+
+        with self.__lock:
+            if self.__dense:
+                if slot >= 0:
+                    table.set(slot, sim)
+            else:
+                self.__lru[key] = sim
+                if len(self.__lru) > self.__capacity:
+                    self.__lru.popitem(last=False) #Least recently used pair
+                    self.__evictions += 1
+        return sim
+
+    def forgetMovie(self, movieID):
+        '''Forget all pairs with this movie, e.g. after its ratings changed'''
+        movieID = int(movieID)
+        with self.__lock:
+            for table in self.__tables.values():
+                table.forget(movieID)
+            for key in [key for key in self.__lru if key[2] == movieID or key[3] == movieID]:
+                del self.__lru[key]
+
+    def clear(self):
+        '''Forget all pairs, the counters are kept'''
+        with self.__lock:
+            for table in self.__tables.values():
+                table.clear()
+            self.__lru.clear()
+
+    def getStats(self):
+        '''Returns a dict with the hits, misses, evictions, hit rate, pairs and memory of the cache in this process'''
+        size = len(self)
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            memory = sum(table.getSizeInBytes() for table in self.__tables.values())
+            return {"mode": self.getMode(), "hits": self.__hits, "misses": self.__misses, "evictions": self.__evictions,
+                    "hitRate": self.__hits / lookups if lookups else 0.0, "pairs": size, "bytes": memory}
+
+    def close(self):
+        '''Release the dense tables, shared blocks are removed by the process that created them'''
+        with self.__lock:
+            for table in self.__tables.values():
+                table.close()
+            self.__tables.clear()
@@ -0,0 +1,174 @@
+import os #Used for the index file paths
+import sys #Used to read the command line arguments
+import time #Used to report the build time
+import json #The signature of the source files is stored as json
+import numpy as np #Used for the similarity blocks and the neighbor arrays
+import LoadData
+import Similarity
+import DataCache
+
+#Precomputed item-item similarity index
+#For every movie the K most similar movies are computed once (offline) for one simFunction and one comparison mode,
+#and saved to disk. similarMovies and recommendMovies can then look up the neighbors in O(K) instead of comparing against the whole catalog.
+#The file keeps the signature of the dataset files (DataCache.sourceSignature), so an index of data that changed since is built again.
+
+INDEX_DIR = os.path.join(LoadData.DATA_DIR, "index") #Default folder for the index files
+DEFAULT_K = 50 #Default amount of neighbors per movie
+BLOCK_SIZE = 256 #Amount of movies that are compared to the whole catalog at once, bounds the memory of the build
+
+class MovieIndex:
+    '''Top-K nearest neighbor index of a movie catalog, for one simFunction and one comparison mode'''
+    def __init__(self, movieIDs, neighbors, scores, simFunction, compareMovieGenres):
+        '''Constructor'''
+        self.__movieIDs = np.asarray(movieIDs) #Movie ID (string) of every position
+        self.__neighbors = np.asarray(neighbors) #movies x K array with the positions of the most similar movies, most similar first
+        self.__scores = np.asarray(scores) #movies x K array with the similarity scores of those neighbors
+        self.__simFunction = int(simFunction) #SimFunction the index was built with
+        self.__compareMovieGenres = bool(compareMovieGenres) #Comparison mode the index was built with
+        self.__positions = {ID: i for i, ID in enumerate(self.__movieIDs.tolist())} #Movie ID -> position
+
+    def __str__(self):
+        '''To String function: Print the settings of the index'''
+        mode = "genre" if self.__compareMovieGenres else "co-watchers"
+        return "MovieIndex(" + str(len(self.__movieIDs)) + " movies, K=" + str(self.getK()) + ", simFunction=" + str(self.__simFunction) + ", " + mode + ")"
+
+    def getK(self):
+        '''Returns the amount of neighbors stored per movie'''
+        return self.__neighbors.shape[1]
+
+    def getSimFunction(self):
+        '''Returns the simFunction the index was built with'''
+        return self.__simFunction
+
+    def getCompareMovieGenres(self):
+        '''Returns True if the index compares the movies by genre, False if by the users who watched them'''
+        return self.__compareMovieGenres
+
+    def matches(self, simFunction, compareMovieGenres):
+        '''Check if the index was built for that simFunction and comparison mode'''
+        return self.__simFunction == int(simFunction) and self.__compareMovieGenres == bool(compareMovieGenres)
+
+    def getNeighbors(self, movieID):
+        '''Returns (movieIDs, scores) of the K most similar movies, most similar first'''
+        pos = self.__positions.get(str(movieID))
+        if pos == None: #Unknown movie
+            return (list(), list())
+        return (self.__movieIDs[self.__neighbors[pos]].tolist(), self.__scores[pos].tolist())
+
+    def getSimilarity(self, movieID1, movieID2):
+        '''Returns the similarity of movie2 to movie1 if movie2 is one of the K neighbors of movie1, 0 otherwise'''
+        pos1 = self.__positions.get(str(movieID1))
+        pos2 = self.__positions.get(str(movieID2))
+        if pos1 == None or pos2 == None:
+            return 0
+        hit = np.flatnonzero(self.__neighbors[pos1] == pos2) #O(K) scan of the neighbor list
+        if len(hit) == 0:
+            return 0
+        return float(self.__scores[pos1, hit[0]])
+
+    def getSizeInBytes(self):
+        '''Returns the memory needed by the neighbor and score arrays'''
+        return self.__neighbors.nbytes + self.__scores.nbytes
+
+    def save(self, path, signature = None):
+        '''Save the index to a .npz file, signature = DataCache.sourceSignature of the files the movie list was loaded from'''
+        np.savez(path, movieIDs=self.__movieIDs.astype(str), neighbors=self.__neighbors, scores=self.__scores,
+                 simFunction=self.__simFunction, compareMovieGenres=self.__compareMovieGenres, signature=json.dumps(signature))
+
+def loadMovieIndex(path, sources = None):
+    '''Load an index saved with MovieIndex.save, returns None if the file doesn't exist.
+    sources = The dataset files the index should be built from (e.g. LoadData._cacheSources(path)) ... Also returns None if the index was
+    saved without a signature or the files changed since'''
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if not sources == None:
+            signature = json.loads(str(data["signature"])) if "signature" in data.files else None
+            if signature == None or not DataCache.signatureMatches(signature, sources):
+                return None
+        return MovieIndex(data["movieIDs"], data["neighbors"], data["scores"], int(data["simFunction"]), bool(data["compareMovieGenres"]))
+
+def indexFileName(simFunction, compareMovieGenres, indexDir = INDEX_DIR):
+    '''Returns the path of the index file for that simFunction and comparison mode'''
+    mode = "genre" if compareMovieGenres else "watchers"
+    return os.path.join(indexDir, "movieIndex_" + mode + "_" + str(simFunction) + ".npz")
+
+def _movieMatrix(movieList):
+    '''Build the 0/1 movies x users matrix, a one for every user who watched the movie'''
+    userIDs = sorted({user[0] for movie in movieList for user in movie.getUsersWatched()}) #All users who watched anything
+    userPos = {ID: i for i, ID in enumerate(userIDs)}
+    rows = list()
+    cols = list()
+    for i, movie in enumerate(movieList): #One row per movie with a 1 for every user who watched it
+        for user in movie.getUsersWatched():
+            rows.append(i)
+            cols.append(userPos[user[0]])
+    from scipy import sparse #Sparse movie x user matrix, imported on first use, the genre mode works without it
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(movieList), len(userIDs)))
+    matrix.data[:] = 1 #A user who is listed twice still counts once
+    return matrix
+
+def buildMovieIndex(movieList, simFunction = 0, compareMovieGenres = True, k = DEFAULT_K):
+    '''Compare every movie to every other movie and keep the K most similar ones, in the same order similarMovies uses
+    (similarity, then the average rating as integer, then the position in the movie list)'''
+    if compareMovieGenres: #Genre bitmasks, a block is scored with popcounts
+        masks = Similarity.genreMasks(movieList)
+        length = len(movieList[0].getGenreVector()) if movieList else Similarity.GENRE_LENGTH
+    else:
+        matrix = _movieMatrix(movieList)
+        counts = np.asarray(matrix.sum(axis=1)).ravel() #Number of ones per movie
+    ratings = np.array([int(movie.getRating()) for movie in movieList]) #Tie breaker of similarMovies
+    n = len(movieList)
+    k = min(k, n - 1)
+    neighbors = np.zeros((n, k), dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float64)
+    positions = np.arange(n)
+
+    for start in range(0, n, BLOCK_SIZE): #Compare a block of movies to the whole catalog at once
+        end = min(start + BLOCK_SIZE, n)
+        if compareMovieGenres:
+            block = Similarity.genreSimilarityScores(masks[start:end, np.newaxis], masks, simFunction, length)
+        else:
+            common = (matrix[start:end] @ matrix.T).toarray() #Ones in common with every other movie
+            count1 = counts[start:end].reshape(-1, 1)
+            length = count1 + counts - common #The co-watcher vectors only cover the users who watched one of the two movies
+            block = Similarity.binaryScoresFromCounts(count1, counts, common, length, simFunction)
+        block[np.arange(end - start), np.arange(start, end)] = -np.inf #Never recommend the movie itself
+        order = np.lexsort((np.broadcast_to(positions, block.shape), -np.broadcast_to(ratings, block.shape), -block), axis=1)[:, :k]
+        neighbors[start:end] = order
+        scores[start:end] = np.take_along_axis(block, order, axis=1)
+
+    movieIDs = np.array([movie.getID() for movie in movieList])
+    return MovieIndex(movieIDs, neighbors, scores, simFunction, compareMovieGenres)
+
+def loadOrBuildMovieIndex(movieList, simFunction = 0, compareMovieGenres = True, path = LoadData.DATA_DIR, indexDir = INDEX_DIR, k = DEFAULT_K):
+    '''Load the saved index for that simFunction and comparison mode, it is built and saved first if it is missing or the files in path
+    (the ones movieList was loaded from) changed since'''
+    sources = LoadData._cacheSources(path)
+    signature = DataCache.sourceSignature(sources) #Taken before building, see DataCache.writeCache
+    fileName = indexFileName(simFunction, compareMovieGenres, indexDir)
+    index = loadMovieIndex(fileName, sources)
+    if index == None or not index.getK() == min(k, len(movieList) - 1):
+        index = buildMovieIndex(movieList, simFunction, compareMovieGenres, k)
+        os.makedirs(indexDir, exist_ok=True)
+        index.save(fileName, signature)
+    return index
+
+def buildAllIndexes(movieList, indexDir = INDEX_DIR, k = DEFAULT_K, path = LoadData.DATA_DIR):
+    '''Build and save the index for every simFunction and both comparison modes, reports the build time and size of every index.
+    path = Folder of the dataset movieList was loaded from, its signature is saved with the indexes'''
+    signature = DataCache.sourceSignature(LoadData._cacheSources(path))
+    os.makedirs(indexDir, exist_ok=True)
+    for compareMovieGenres in (True, False):
+        for simFunction in range(5):
+            start = time.perf_counter()
+            index = buildMovieIndex(movieList, simFunction, compareMovieGenres, k)
+            buildTime = time.perf_counter() - start
+            fileName = indexFileName(simFunction, compareMovieGenres, indexDir)
+            index.save(fileName, signature)
+            print(str(index) + ": built in " + format(buildTime, ".3f") + "s, " + str(index.getSizeInBytes()) + " bytes in memory, " + str(os.path.getsize(fileName)) + " bytes on disk")
+
+if __name__ == "__main__":
+    #Build all indexes for the dataset, optional argument: K
+    data = LoadData.loadData(useRatingMatrix=True)
+    buildAllIndexes(data[1], k = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_K)
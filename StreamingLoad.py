@@ -0,0 +1,297 @@
+import os #Used for the file paths
+import sys #Used to read the command line arguments
+import time #Used to report the build time
+import shutil #Removes the spill folder
+import itertools #Reads the file in chunks of lines
+import tracemalloc #Reports the peak memory of a build
+import numpy as np #Vectorized parsing and aggregation
+import LoadData
+import DataCache
+
+#Streaming ingestion of rating files larger than memory
+#u.data is read in chunks of lines, every chunk is parsed in one vectorized call and only the per-user and per-movie aggregates
+#(counts, sums and sums of squares) are kept. The parsed chunks are spilled to disk as compact blocks, and a second pass over the blocks
+#writes the same memory mapped cache LoadData.buildCache writes, filling the CSR and CSC arrays on disk piece by piece.
+#The memory needed is bounded by the chunk size (plus one counter per user and movie), not by the number of ratings.
+#Malformed lines are skipped and counted instead of failing the whole run, they are reported at the end.
+
+DEFAULT_CHUNK_SIZE = 1000000 #Lines per chunk
+REPORTED_BAD_LINES = 10 #Line numbers of malformed lines that are kept for the report
+MAX_ID = 2 ** 31 - 1 #IDs are stored as int32
+MAX_RATING = 255 #Ratings are stored as uint8
+
+def _validRows(chunk):
+    '''Mask of the parsed rows that fit the cache arrays: IDs from 1 to MAX_ID and ratings from 1 to MAX_RATING'''
+    return ((chunk[:, 0] >= 1) & (chunk[:, 0] <= MAX_ID) & (chunk[:, 1] >= 1) & (chunk[:, 1] <= MAX_ID)
+            & (chunk[:, 2] >= 1) & (chunk[:, 2] <= MAX_RATING))
+
+def _parseChunk(lines):
+    '''Parse a chunk of lines, returns (lines x 4 int64 array of the valid rows, positions of the malformed lines in the chunk).
+    The whole chunk is parsed at once, only a chunk with a malformed line is parsed again line by line'''
+    try:
+        chunk = np.loadtxt(lines, dtype=np.int64, delimiter='\t', ndmin=2)
+        if chunk.shape[1] == 4 and _validRows(chunk).all():
+            return (chunk, list())
+    except (ValueError, OverflowError): #At least one line that isn't four integers
+        pass
+    rows, positions, bad = list(), list(), list()
+    for i, line in enumerate(lines):
+        if not line.strip(): #Empty lines are ignored, same as np.loadtxt
+            continue
+        try:
+            row = [int(field) for field in line.split('\t')]
+        except ValueError:
+            row = None
+        if row == None or not len(row) == 4 or not -2 ** 63 <= row[3] < 2 ** 63: #Not four integers or a timestamp that doesn't fit int64
+            bad.append(i)
+            continue
+        rows.append([min(max(value, -1), MAX_ID + 1) for value in row[:3]] + row[3:]) #Out of range IDs and ratings stay out of range, but fit int64
+        positions.append(i)
+    chunk = np.array(rows, dtype=np.int64).reshape(-1, 4)
+    valid = _validRows(chunk)
+    bad = sorted(bad + [positions[i] for i in np.flatnonzero(~valid).tolist()])
+    return (chunk[valid], bad)
+
+def iterRatingChunks(path = LoadData.DATA_DIR, chunkSize = DEFAULT_CHUNK_SIZE, badLines = None):
+    '''Read u.data in chunks, yields one (lines x 4) int64 array of (userID, movieID, rating, timestamp) per chunk.
+    Malformed lines are skipped, badLines = list ... Their line numbers (starting at 1) are appended to it'''
+    try:
+        f = open(os.path.join(path, "u.data"), 'r')
+    except OSError:
+        print('File "u.data" could not be found.')
+        raise
+    first = 1 #Line number of the first line of the chunk
+    with f:
+        while True:
+            lines = list(itertools.islice(f, chunkSize)) #The next chunkSize lines
+            if not lines:
+                break
+            chunk, bad = _parseChunk(lines)
+            if not badLines == None:
+                badLines.extend(first + i for i in bad)
+            first += len(lines)
+            yield chunk
+
+class RatingAggregates:
+    '''Per-user and per-movie counts, sums and sums of squares of the ratings, built chunk by chunk'''
+    def __init__(self):
+        '''Constructor'''
+        self.__userStats = np.zeros((3, 0)) #Rows: count, sum, sum of squares, column = user ID
+        self.__movieStats = np.zeros((3, 0)) #Same per movie ID
+        self.__ratingCount = 0 #Number of ratings added
+        self.__badLineCount = 0 #Number of malformed lines that were skipped
+        self.__badLines = list() #Line numbers of the first REPORTED_BAD_LINES of them
+
+    def __addTo(self, stats, ids, ratings):
+        '''Add the ratings to the stats of the ids, grows the arrays when a bigger ID shows up'''
+        if len(ids) and ids.max() >= stats.shape[1]:
+            grown = np.zeros((3, max(int(ids.max()) + 1, stats.shape[1] * 2)))
+            grown[:, :stats.shape[1]] = stats
+            stats = grown
+        size = stats.shape[1]
+        stats[0] += np.bincount(ids, minlength=size)
+        stats[1] += np.bincount(ids, weights=ratings, minlength=size)
+        stats[2] += np.bincount(ids, weights=ratings * ratings, minlength=size)
+        return stats
+
+    def add(self, chunk):
+        '''Add a chunk of (userID, movieID, rating, ...) rows'''
+        ratings = chunk[:, 2].astype(np.float64)
+        self.__userStats = self.__addTo(self.__userStats, chunk[:, 0], ratings)
+        self.__movieStats = self.__addTo(self.__movieStats, chunk[:, 1], ratings)
+        self.__ratingCount += len(chunk)
+
+    def addBadLines(self, lineNumbers):
+        '''Count malformed lines that were skipped'''
+        self.__badLineCount += len(lineNumbers)
+        self.__badLines.extend(lineNumbers[:REPORTED_BAD_LINES - len(self.__badLines)])
+
+    def getRatingCount(self):
+        '''Returns the number of ratings added so far'''
+        return self.__ratingCount
+
+    def getBadLineCount(self):
+        '''Returns the number of malformed lines that were skipped'''
+        return self.__badLineCount
+
+    def getBadLines(self):
+        '''Returns the line numbers of the first skipped lines (at most REPORTED_BAD_LINES)'''
+        return self.__badLines
+
+    def getUserIDs(self):
+        '''Returns the sorted IDs of all users with ratings'''
+        return np.flatnonzero(self.__userStats[0])
+
+    def getMovieIDs(self):
+        '''Returns the sorted IDs of all movies with ratings'''
+        return np.flatnonzero(self.__movieStats[0])
+
+    def getUserCounts(self, userIDs):
+        '''Returns the number of ratings of every user ID'''
+        return self.__userStats[0][userIDs].astype(np.int64)
+
+    def getMovieCounts(self, movieIDs):
+        '''Returns the number of ratings of every movie ID'''
+        return self.__movieStats[0][movieIDs].astype(np.int64)
+
+    def getMovieSums(self, movieIDs):
+        '''Returns the sum of the ratings of every movie ID'''
+        return self.__movieStats[1][movieIDs]
+
+    def getMovieAverages(self, movieIDs):
+        '''Returns the average rating of every movie ID, 0 for movies nobody rated (same as Movie.calculateAverageRating)'''
+        counts = self.__movieStats[0][movieIDs]
+        return np.divide(self.__movieStats[1][movieIDs], counts, out=np.zeros(len(counts)), where=counts > 0)
+
+    def getMovieVariances(self, movieIDs):
+        '''Returns the variance of the ratings of every movie ID, 0 for movies nobody rated'''
+        counts = self.__movieStats[0][movieIDs]
+        means = self.getMovieAverages(movieIDs)
+        squares = np.divide(self.__movieStats[2][movieIDs], counts, out=np.zeros(len(counts)), where=counts > 0)
+        return np.maximum(squares - means * means, 0)
+
+    def getUserAverages(self, userIDs):
+        '''Returns the average rating of every user ID, 0 for users without ratings'''
+        counts = self.__userStats[0][userIDs]
+        return np.divide(self.__userStats[1][userIDs], counts, out=np.zeros(len(counts)), where=counts > 0)
+
+    def setAverageRatings(self, movieList):
+        '''Store the average ratings in the movie objects, instead of generateAverageRatings'''
+        ids = np.array([int(movie.getID()) for movie in movieList])
+        known = ids < self.__movieStats.shape[1] #Movies with a bigger ID than any rated one have no ratings
+        averages = np.zeros(len(ids))
+        averages[known] = self.getMovieAverages(ids[known])
+        for movie, average in zip(movieList, averages.tolist()):
+            movie.setRating(average)
+
+def streamAggregates(path = LoadData.DATA_DIR, chunkSize = DEFAULT_CHUNK_SIZE, spillDir = None):
+    '''Read u.data chunk by chunk and build the aggregates. If spillDir is given, every parsed chunk is written there as a compact block
+    (int32 user IDs, int32 movie IDs, uint8 ratings, int64 timestamps). Malformed lines are skipped and reported at the end.
+    Returns (aggregates, list of block files)'''
+    aggregates = RatingAggregates()
+    blocks = list()
+    badLines = list() #Malformed lines of the current chunk
+    if spillDir:
+        os.makedirs(spillDir, exist_ok=True)
+    for i, chunk in enumerate(iterRatingChunks(path, chunkSize, badLines)):
+        aggregates.addBadLines(badLines)
+        badLines.clear()
+        aggregates.add(chunk)
+        if spillDir:
+            block = os.path.join(spillDir, "block_" + str(i).zfill(5) + ".npz")
+            np.savez(block, userIDs=chunk[:, 0].astype(np.int32), movieIDs=chunk[:, 1].astype(np.int32),
+                     ratings=chunk[:, 2].astype(np.uint8), timestamps=chunk[:, 3])
+            blocks.append(block)
+    if aggregates.getBadLineCount():
+        print("ERROR - Skipped " + str(aggregates.getBadLineCount()) + " malformed lines in u.data, first at lines "
+              + ", ".join(str(line) for line in aggregates.getBadLines()))
+    return (aggregates, blocks)
+
+def _iterBlocks(blocks):
+    '''Load the spilled blocks one after another'''
+    for block in blocks:
+        with np.load(block) as data:
+            yield (data["userIDs"], data["movieIDs"], data["ratings"], data["timestamps"])
+
+def _indexArray(ids):
+    '''Dense ID -> index array, same as RatingMatrix builds'''
+    index = np.full(int(ids[-1]) + 1 if len(ids) else 1, -1, dtype=np.int32)
+    index[ids] = np.arange(len(ids), dtype=np.int32)
+    return index
+
+def _scatter(indices, data, cursor, groups, values, weights):
+    '''Write one block into compressed (CSR or CSC) arrays: every entry goes to the next free slot of its group (row or column)'''
+    order = np.argsort(groups, kind="stable")
+    sortedGroups = groups[order]
+    firsts = np.searchsorted(sortedGroups, sortedGroups) #First position of every entries group in the sorted block
+    slots = cursor[sortedGroups] + (np.arange(len(order)) - firsts) #Next free slots of the group, in file order
+    indices[slots] = values[order]
+    data[slots] = weights[order]
+    cursor += np.bincount(groups, minlength=len(cursor))
+
+def _sortSegments(indices, data, indptr, chunkSize):
+    '''Sort the entries inside every row (or column) by index, a range of rows with at most about chunkSize entries at a time'''
+    groups = len(indptr) - 1
+    start = 0
+    while start < groups:
+        end = int(np.searchsorted(indptr, indptr[start] + chunkSize, side="right")) - 1 #Rows that fit in one chunk
+        end = min(max(end, start + 1), groups)
+        first, last = int(indptr[start]), int(indptr[end])
+        owner = np.repeat(np.arange(end - start), np.diff(indptr[start:end + 1])) #Row of every entry in the range
+        order = np.lexsort((indices[first:last], owner))
+        indices[first:last] = indices[first:last][order]
+        data[first:last] = data[first:last][order]
+        start = end
+
+def buildCacheStreaming(path = LoadData.DATA_DIR, cacheDir = None, chunkSize = DEFAULT_CHUNK_SIZE, spillDir = None):
+    '''Write the same binary cache as LoadData.buildCache, but with memory bounded by the chunk size.
+    Pass 1 parses the chunks, builds the aggregates and spills the blocks, pass 2 fills the cache arrays on disk from the blocks.
+    LoadData.loadCache / loadData(useCache=True) can open the result. Returns the aggregates.
+    (Duplicate (user, movie) ratings are kept as separate entries, MovieLens has none)'''
+    cacheDir = cacheDir or os.path.join(path, "cache")
+    spillDir = spillDir or os.path.join(cacheDir, "spill")
+    signature = DataCache.sourceSignature(LoadData._cacheSources(path)) #Taken before reading, like LoadData.buildCache
+    aggregates, blocks = streamAggregates(path, chunkSize, spillDir)
+
+    userIDs = aggregates.getUserIDs()
+    movieIDs = aggregates.getMovieIDs()
+    userIndex = _indexArray(userIDs)
+    movieIndex = _indexArray(movieIDs)
+    total = aggregates.getRatingCount()
+    indexType = np.int32 if total < 2 ** 31 else np.int64
+    csrIndptr = np.concatenate(([0], np.cumsum(aggregates.getUserCounts(userIDs)))).astype(indexType)
+    cscIndptr = np.concatenate(([0], np.cumsum(aggregates.getMovieCounts(movieIDs)))).astype(indexType)
+
+    names = list()
+    for name, array in LoadData._movieCacheArrays(path).items(): #The movie file is small, it is parsed as a whole
+        DataCache.writeArray(cacheDir, name, array)
+        names.append(name)
+    for name, array in (("matrix_userIDs", userIDs), ("matrix_movieIDs", movieIDs), ("matrix_userIndex", userIndex),
+                        ("matrix_movieIndex", movieIndex), ("matrix_csrIndptr", csrIndptr), ("matrix_cscIndptr", cscIndptr)):
+        DataCache.writeArray(cacheDir, name, array)
+        names.append(name)
+    onDisk = dict() #Arrays with one entry per rating are filled on disk
+    for name, dtype in (("userIDs", np.int32), ("movieIDs", np.int32), ("ratings", np.uint8), ("timestamps", np.int64),
+                        ("matrix_rows", np.int32), ("matrix_cols", np.int32), ("matrix_ratings", np.uint8),
+                        ("matrix_csrIndices", np.int32), ("matrix_csrData", np.uint8), ("matrix_cscIndices", np.int32), ("matrix_cscData", np.uint8)):
+        onDisk[name] = DataCache.createArray(cacheDir, name, (total,), dtype)
+        names.append(name)
+
+    csrCursor = csrIndptr[:-1].astype(np.int64) #Next free slot of every row
+    cscCursor = cscIndptr[:-1].astype(np.int64) #Next free slot of every column
+    offset = 0
+    for users, movies, ratings, timestamps in _iterBlocks(blocks): #Pass 2, one block in memory at a time
+        rows = userIndex[users]
+        cols = movieIndex[movies]
+        part = slice(offset, offset + len(users))
+        onDisk["userIDs"][part] = users
+        onDisk["movieIDs"][part] = movies
+        onDisk["ratings"][part] = ratings
+        onDisk["timestamps"][part] = timestamps
+        onDisk["matrix_rows"][part] = rows
+        onDisk["matrix_cols"][part] = cols
+        onDisk["matrix_ratings"][part] = ratings
+        _scatter(onDisk["matrix_csrIndices"], onDisk["matrix_csrData"], csrCursor, rows, cols, ratings)
+        _scatter(onDisk["matrix_cscIndices"], onDisk["matrix_cscData"], cscCursor, cols, rows, ratings)
+        offset += len(users)
+    _sortSegments(onDisk["matrix_csrIndices"], onDisk["matrix_csrData"], csrIndptr, chunkSize) #Canonical CSR/CSC: sorted indices in every row/column
+    _sortSegments(onDisk["matrix_cscIndices"], onDisk["matrix_cscData"], cscIndptr, chunkSize)
+    for array in onDisk.values():
+        array.flush()
+    del onDisk
+    DataCache.publish(cacheDir, signature, names)
+    shutil.rmtree(spillDir, ignore_errors=True) #The blocks are not needed anymore
+    return aggregates
+
+if __name__ == "__main__":
+    #Build the cache of a dataset with bounded memory and report the time and peak memory, arguments: [data folder] [chunk size]
+    path = sys.argv[1] if len(sys.argv) > 1 else LoadData.DATA_DIR
+    chunkSize = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_CHUNK_SIZE
+    tracemalloc.start()
+    start = time.perf_counter()
+    aggregates = buildCacheStreaming(path, chunkSize = chunkSize)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("Streamed " + str(aggregates.getRatingCount()) + " ratings in chunks of " + str(chunkSize) + " lines: "
+          + format(seconds, ".2f") + "s, peak memory " + format(peak / 1e6, ".1f") + " MB")
@@ -0,0 +1,260 @@
+import math #Used for the default amount of hash bits and clusters
+import time #Used to report the build and query times
+import argparse #Command line options
+import numpy as np #Hashes, buckets and centroids
+import LoadData
+import Similarity
+
+#Approximate nearest neighbor search over the users
+#Instead of scoring the target against every user, a UserANNIndex puts the users into buckets once, and a query only scores the users
+#in the buckets of the target (the candidates) with the batched engine. The result is the top M of the candidates with their exact scores,
+#so only users that are never candidates can be missed. Three ways to build the buckets:
+#lsh......Random projection LSH of the rating vectors, users with a small angle between their vectors share buckets (cosine)
+#minhash..MinHash of the sets of rated movies, users that rated many of the same movies share buckets (Jaccard of the movie sets)
+#ivf......Spherical k-means of the normalized rating vectors (inverted file), the clusters closest to the target are searched
+#The probes setting (hash tables or clusters that are searched) trades query time for recall, tuneProbes finds the smallest one for a target recall.
+
+METHODS = ("lsh", "minhash", "ivf")
+DEFAULT_NEIGHBORS = 50 #Amount of most similar users a query returns (M)
+DEFAULT_TABLES = {"lsh": 8, "minhash": 16} #Hash tables
+MINHASH_ROWS = 2 #MinHash values per band (hash table)
+BUCKET_SIZE = 64 #Average amount of users per LSH bucket the default amount of bits aims for
+IVF_ITERATIONS = 10 #k-means iterations of the IVF build
+BLOCK_SIZE = 65536 #Users that are hashed or assigned at once, bounds the memory of the build
+PRIME = (1 << 31) - 1 #Modulus of the MinHash functions
+
+class UserANNIndex:
+    '''Approximate nearest neighbor index over the users of a LoadData.RatingMatrix.
+    Can be given to Similarity.recommendMovies/customSimilarity as userScores, then only the top M users are walked'''
+    def __init__(self, ratingMatrix, method = "lsh", tables = None, bits = None, clusters = None, probes = None, neighbors = DEFAULT_NEIGHBORS, seed = 0):
+        '''Constructor, builds the index.
+        tables/bits...Hash tables and bits per table (lsh), bands (minhash), default depends on the method and the amount of users
+        clusters...Amount of IVF clusters, default sqrt(users)
+        probes...Hash tables or clusters searched per query, default all tables / an eighth of the clusters
+        neighbors...Amount of users a query returns (M)'''
+        if not method in METHODS:
+            raise ValueError("Unknown method: " + str(method) + ", use one of " + ", ".join(METHODS))
+        self.__matrix = ratingMatrix
+        self.__method = method
+        self.__neighbors = int(neighbors)
+        rng = np.random.default_rng(seed)
+        users = ratingMatrix.getShape()[0]
+        start = time.perf_counter()
+        if method == "ivf":
+            self.__clusters = min(users, int(clusters or max(1, round(math.sqrt(users)))))
+            codes = self.__buildIVF(rng)[np.newaxis, :]
+            self.__probes = int(probes or max(1, self.__clusters // 8))
+        else:
+            self.__tables = int(tables or DEFAULT_TABLES[method])
+            if method == "lsh":
+                self.__bits = int(bits or min(62, max(1, round(math.log2(max(users / BUCKET_SIZE, 1)))))) #About BUCKET_SIZE users per bucket
+                codes = self.__buildLSH(rng)
+            else:
+                self.__bits = int(bits or MINHASH_ROWS)
+                codes = self.__buildMinHash(rng)
+            self.__probes = int(probes or self.__tables)
+        self.__codes = codes #Bucket of every user in every table, tables x users
+        self.__order = np.argsort(codes, axis=1, kind="stable").astype(np.int32) #Users sorted by bucket, per table
+        self.__sortedCodes = np.take_along_axis(codes, self.__order, axis=1) #Buckets in that order, for the binary search
+        self.__buildSeconds = time.perf_counter() - start
+
+    def __str__(self):
+        '''To String function: Print the settings of the index'''
+        if self.__method == "ivf":
+            settings = str(self.__clusters) + " clusters"
+        else:
+            settings = str(self.__tables) + " tables x " + str(self.__bits) + (" bits" if self.__method == "lsh" else " rows")
+        return "UserANNIndex(" + self.__method + ", " + settings + ", probes=" + str(self.__probes) + ", M=" + str(self.__neighbors) + ")"
+
+    def __buildLSH(self, rng):
+        '''Random hyperplanes, one bit per plane: the side of the plane the rating vector is on'''
+        R = self.__matrix.getCSR().astype(np.float32)
+        planes = rng.standard_normal((R.shape[1], self.__tables * self.__bits)).astype(np.float32)
+        codes = np.zeros((self.__tables, R.shape[0]), dtype=np.int64)
+        weights = np.left_shift(np.int64(1), np.arange(self.__bits, dtype=np.int64)) #Value of every bit in the bucket number
+        for start in range(0, R.shape[0], BLOCK_SIZE):
+            side = np.asarray(R[start:start + BLOCK_SIZE] @ planes) > 0 #users x (tables * bits)
+            side = side.reshape(side.shape[0], self.__tables, self.__bits)
+            codes[:, start:start + BLOCK_SIZE] = (side * weights).sum(axis=2).T
+        return codes
+
+    def __buildMinHash(self, rng):
+        '''MinHash signatures of the rated movie sets, every band of MINHASH_ROWS values is hashed into one bucket number'''
+        csr = self.__matrix.getCSR()
+        hashes = self.__tables * self.__bits
+        a = rng.integers(1, PRIME, hashes, dtype=np.int64).reshape(-1, 1)
+        b = rng.integers(0, PRIME, hashes, dtype=np.int64).reshape(-1, 1)
+        codes = np.zeros((self.__tables, csr.shape[0]), dtype=np.uint64)
+        for start in range(0, csr.shape[0], BLOCK_SIZE):
+            end = min(start + BLOCK_SIZE, csr.shape[0])
+            first, last = csr.indptr[start], csr.indptr[end]
+            movies = csr.indices[first:last].astype(np.int64)
+            values = (a * movies + b) % PRIME #hashes x ratings of the block
+            starts = (csr.indptr[start:end] - first).astype(np.int64)
+            signature = np.full((hashes, end - start), PRIME, dtype=np.int64)
+            filled = np.diff(csr.indptr[start:end + 1]) > 0 #reduceat needs non empty rows
+            signature[:, filled] = np.minimum.reduceat(values, starts[filled], axis=1)
+            signature = signature.reshape(self.__tables, self.__bits, -1).astype(np.uint64)
+            band = np.zeros((self.__tables, end - start), dtype=np.uint64)
+            for row in range(self.__bits): #Combine the values of a band into one number
+                band = band * np.uint64(1000003) + signature[:, row]
+            codes[:, start:end] = band
+        return codes
+
+    def __normalizedRows(self):
+        '''Rating rows scaled to length 1, so the dot product is the cosine'''
+        from scipy import sparse #Imported on first use, the LSH index works without it
+        R = self.__matrix.getCSR().astype(np.float32)
+        norms = np.sqrt(np.asarray(R.multiply(R).sum(axis=1)).ravel())
+        return sparse.diags(1 / np.maximum(norms, 1e-12)).astype(np.float32) @ R
+
+    def __assign(self, X, centroids):
+        '''Closest centroid of every row'''
+        assignment = np.zeros(X.shape[0], dtype=np.int64)
+        for start in range(0, X.shape[0], BLOCK_SIZE):
+            assignment[start:start + BLOCK_SIZE] = np.asarray(X[start:start + BLOCK_SIZE] @ centroids.T).argmax(axis=1)
+        return assignment
+
+    def __buildIVF(self, rng):
+        '''Spherical k-means, the clusters are the inverted lists'''
+        X = self.__normalizedRows().tocsr()
+        from scipy import sparse
+        users = X.shape[0]
+        centroids = X[rng.choice(users, self.__clusters, replace=False)].toarray() #Random users as the first centroids
+        for i in range(IVF_ITERATIONS):
+            assignment = self.__assign(X, centroids)
+            members = sparse.csr_matrix((np.ones(users, dtype=np.float32), (assignment, np.arange(users))), shape=(self.__clusters, users))
+            centroids = np.asarray((members @ X).todense())
+            empty = np.flatnonzero(np.diff(members.indptr) == 0)
+            centroids[empty] = X[rng.choice(users, len(empty), replace=False)].toarray() #Restart empty clusters at random users
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        self.__centroids = centroids.astype(np.float32)
+        self.__rows = X
+        return self.__assign(X, self.__centroids)
+
+    def getMethod(self):
+        '''Returns the method the index was built with'''
+        return self.__method
+
+    def getBuildSeconds(self):
+        '''Returns the time the build took'''
+        return self.__buildSeconds
+
+    def getProbes(self):
+        '''Returns the amount of hash tables or clusters searched per query'''
+        return self.__probes
+
+    def getMaxProbes(self):
+        '''Returns the largest useful probes setting'''
+        return self.__clusters if self.__method == "ivf" else self.__tables
+
+    def setProbes(self, probes):
+        '''Set the amount of hash tables or clusters searched per query, more probes = more candidates, higher recall and slower queries'''
+        self.__probes = max(1, min(int(probes), self.getMaxProbes()))
+
+    def getNeighborAmount(self):
+        '''Returns the amount of users a query returns (M)'''
+        return self.__neighbors
+
+    def setNeighborAmount(self, neighbors):
+        '''Set the amount of users a query returns (M)'''
+        self.__neighbors = int(neighbors)
+
+    def getSizeInBytes(self):
+        '''Returns the memory needed by the buckets (and centroids)'''
+        size = self.__codes.nbytes + self.__order.nbytes + self.__sortedCodes.nbytes
+        if self.__method == "ivf":
+            size += self.__centroids.nbytes
+        return size
+
+    def getCandidates(self, row):
+        '''Returns the sorted row indices of the users that share a searched bucket with the user at that row, without the user itself'''
+        if self.__method == "ivf":
+            closeness = np.asarray(self.__rows[row] @ self.__centroids.T).ravel()
+            searched = np.argsort(-closeness, kind="stable")[:self.__probes] #The closest clusters
+            tables = [0] * len(searched)
+        else:
+            searched = self.__codes[:self.__probes, row] #The bucket of the user in every searched table
+            tables = range(self.__probes)
+        parts = list()
+        for table, code in zip(tables, searched):
+            start = np.searchsorted(self.__sortedCodes[table], code, side="left")
+            end = np.searchsorted(self.__sortedCodes[table], code, side="right")
+            parts.append(self.__order[table, start:end])
+        candidates = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int32)
+        return candidates[candidates != row]
+
+    def getTopUsers(self, userID, simFunction = 0, amount = None):
+        '''Returns the list of (userID, similarity) tuples of the most similar users found, most similar first.
+        The candidates are scored exactly with Similarity.userSimilarityScores, same simFunction values'''
+        row = self.__matrix.getUserIndex(userID)
+        if row == -1:
+            return list()
+        candidates = self.getCandidates(row)
+        scores = Similarity.userSimilarityScores(self.__matrix, userID, simFunction, candidates)
+        amount = int(amount or self.__neighbors)
+        best = np.argsort(-scores, kind="stable")[:amount] #Ties in user ID order
+        userIDs = self.__matrix.getUserIDs()
+        return [(str(userIDs[candidates[i]]), float(scores[i])) for i in best.tolist()]
+
+def measureRecall(index, ratingMatrix, simFunction = 0, amount = None, sample = 100, seed = 0):
+    '''Compare the queries of the index to the exact ranking of all users (the batched engine, same scores as compareUsers) for a sample of users.
+    Recall@M = share of the returned users that are in the exact top M, users tied with the M-th best exact score count as in the top M.
+    Returns a dict with the recall, the query and exact times in milliseconds and the share of users that were candidates'''
+    amount = int(amount or index.getNeighborAmount())
+    userIDs = ratingMatrix.getUserIDs()
+    rows = np.random.default_rng(seed).choice(len(userIDs), min(sample, len(userIDs)), replace=False)
+    recalls, queryTimes, exactTimes, candidates = list(), list(), list(), list()
+    for row in rows.tolist():
+        userID = str(userIDs[row])
+        start = time.perf_counter()
+        found = index.getTopUsers(userID, simFunction, amount)
+        queryTimes.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        exact = Similarity.userSimilarityScores(ratingMatrix, userID, simFunction)
+        exact = np.delete(exact, row) #Without the user itself
+        exactTimes.append(time.perf_counter() - start)
+        wanted = min(amount, len(exact))
+        if wanted == 0:
+            continue
+        threshold = np.partition(exact, len(exact) - wanted)[len(exact) - wanted] #M-th best exact score
+        recalls.append(min(sum(1 for ID, score in found if score >= threshold), wanted) / wanted)
+        candidates.append(len(index.getCandidates(row)) / max(len(userIDs) - 1, 1))
+    queryMs = np.array(queryTimes) * 1000
+    return {"recall": float(np.mean(recalls)) if recalls else 0.0, "queryMs": float(queryMs.mean()), "queryP95Ms": float(np.percentile(queryMs, 95)),
+            "exactMs": float(np.mean(exactTimes) * 1000), "candidateShare": float(np.mean(candidates)) if candidates else 0.0}
+
+def tuneProbes(index, ratingMatrix, targetRecall, simFunction = 0, amount = None, sample = 100, seed = 0):
+    '''Find the smallest probes setting (growing it by half each step) that reaches the target recall, leaves the index at that setting.
+    Returns (probes, measureRecall result)'''
+    probes = 1
+    while True:
+        index.setProbes(probes)
+        result = measureRecall(index, ratingMatrix, simFunction, amount, sample, seed)
+        if result["recall"] >= targetRecall or probes >= index.getMaxProbes():
+            return (index.getProbes(), result)
+        probes = max(probes + 1, probes * 3 // 2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build user ANN indexes and report build time, query time and recall@M against the exact ranking")
+    parser.add_argument("--method", default="all", choices=METHODS + ("all",))
+    parser.add_argument("--sim-function", type=int, default=1, help="0 Euclidean, 1 Cosine, 2 Pearson, 3 Jaccard, 4 Manhatten, 5 Custom")
+    parser.add_argument("--neighbors", type=int, default=DEFAULT_NEIGHBORS, help="users per query (M)")
+    parser.add_argument("--recall", type=float, default=None, help="tune the probes for this recall@M")
+    parser.add_argument("--sample", type=int, default=100, help="users the recall is measured on")
+    parser.add_argument("--data", default=LoadData.DATA_DIR, help="folder with u.item and u.data")
+    args = parser.parse_args()
+    ratingMatrix = LoadData.loadRatingMatrix(args.data, useCache=True)
+    print(str(ratingMatrix.getShape()[0]) + " users, " + str(ratingMatrix.getShape()[1]) + " movies, simFunction " + str(args.sim_function) + ", M=" + str(args.neighbors))
+    for method in (METHODS if args.method == "all" else (args.method,)):
+        index = UserANNIndex(ratingMatrix, method, neighbors=args.neighbors)
+        if args.recall == None:
+            result = measureRecall(index, ratingMatrix, args.sim_function, sample=args.sample)
+        else:
+            probes, result = tuneProbes(index, ratingMatrix, args.recall, args.sim_function, sample=args.sample)
+        print(str(index) + ": build " + format(index.getBuildSeconds() * 1000, ".1f") + " ms, " + format(index.getSizeInBytes() / 1e6, ".2f") + " MB, query "
+              + format(result["queryMs"], ".2f") + " ms (p95 " + format(result["queryP95Ms"], ".2f") + " ms) vs exact " + format(result["exactMs"], ".2f")
+              + " ms, candidates " + format(result["candidateShare"] * 100, ".1f") + "%, recall@M " + format(result["recall"], ".3f"))
+
+if __name__ == "__main__":
+    main()
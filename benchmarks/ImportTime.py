@@ -0,0 +1,90 @@
+import os #Used to find the repository folder
+import sys #The interpreter the scenarios are started with
+import json #Results are stored as json
+import time #Wall time of the processes
+import argparse #Command line options
+import statistics #Median over the repeats
+import subprocess #Every scenario runs in a fresh interpreter
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+#Cold start benchmark of the modules
+#Short lived batch jobs and worker processes pay for every import before they do any work. Every scenario runs a fresh
+#"python -X importtime -c ..." in the repository folder, a few times, and reports the median import time (the cumulative time of all
+#imports it triggered, without the ones every interpreter does at start up), the median wall time of the whole process, the number
+#of modules it imported and whether scipy was loaded. The heaviest imports show what a scenario spends its start up on.
+
+SCENARIOS = [("LoadData", "import LoadData"),
+             ("Similarity", "import Similarity"),
+             ("SimilarityCache", "import SimilarityCache"),
+             ("MovieStats", "import MovieStats"),
+             ("MatrixFactorization", "import MatrixFactorization"),
+             ("BatchRecommend", "import BatchRecommend"),
+             ("Evaluation", "import Evaluation"),
+             ("worker", "import BatchRecommend, LoadData; LoadData.loadRatingMatrix(useCache=True)"), #Start up of a BatchRecommend worker
+             ("batched engine", "import LoadData, Similarity; Similarity.userSimilarityScores(LoadData.loadRatingMatrix(useCache=True), 1)")]
+BASELINE = "pass" #Interpreter start up, subtracted from every scenario
+
+def runOnce(code):
+    '''Run code in a fresh interpreter with -X importtime, returns (wall seconds, {imported module: (depth, self us, cumulative us)})'''
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=REPO_DIR, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if not process.returncode == 0:
+        raise RuntimeError("Scenario failed: " + code + "\n" + process.stderr[-2000:])
+    imports = dict()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line: #Skip the header and anything the code printed
+            continue
+        selfTime, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2 #Nested imports are indented by two spaces per level
+        imports[name.strip()] = (depth, int(selfTime), int(cumulative))
+    return (wall, imports)
+
+def measureScenario(code, repeats, baseline):
+    '''Median import time, wall time and the heaviest imports of a scenario over repeats runs'''
+    walls, totals = list(), list()
+    for i in range(repeats):
+        wall, imports = runOnce(code)
+        walls.append(wall)
+        totals.append(sum(cumulative for name, (depth, selfTime, cumulative) in imports.items() if depth == 0 and not name in baseline["modules"]))
+    heaviest = sorted(((name, cumulative) for name, (depth, selfTime, cumulative) in imports.items() if depth <= 1 and not name in baseline["modules"]),
+                      key = lambda x: -x[1]) #Top level imports and the ones directly below them
+    return {"importMs": statistics.median(totals) / 1000, "wallMs": statistics.median(walls) * 1000 - baseline["wallMs"],
+            "modules": len([name for name in imports if not name in baseline["modules"]]),
+            "scipy": any(name == "scipy" or name.startswith("scipy.") for name in imports),
+            "heaviest": [{"module": name, "ms": cumulative / 1000} for name, cumulative in heaviest]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start import time of the modules with python -X importtime")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per scenario, the median is reported")
+    parser.add_argument("--top", type=int, default=3, help="heaviest imports shown per scenario")
+    parser.add_argument("--only", nargs="*", default=None, help="only the scenarios with these names")
+    parser.add_argument("--output", default=None, help="also write the results to this json file")
+    options = parser.parse_args()
+
+    walls, modules = list(), set()
+    for i in range(options.repeats): #Interpreter start up without any of our modules
+        wall, imports = runOnce(BASELINE)
+        walls.append(wall)
+        modules.update(imports)
+    baseline = {"wallMs": statistics.median(walls) * 1000, "modules": modules}
+    print("Interpreter start up: " + format(baseline["wallMs"], ".1f") + " ms (subtracted below)")
+    print("scenario".ljust(22) + "import ms".rjust(11) + "wall ms".rjust(10) + "modules".rjust(9) + "scipy".rjust(7) + "  heaviest imports")
+
+    results = list()
+    for name, code in SCENARIOS:
+        if options.only and not name in options.only:
+            continue
+        result = dict(name=name, code=code, **measureScenario(code, options.repeats, baseline))
+        results.append(result)
+        heaviest = ", ".join(entry["module"] + " " + format(entry["ms"], ".1f") for entry in result["heaviest"][:options.top])
+        print(name.ljust(22) + format(result["importMs"], ".1f").rjust(11) + format(result["wallMs"], ".1f").rjust(10)
+              + str(result["modules"]).rjust(9) + ("yes" if result["scipy"] else "no").rjust(7) + "  " + heaviest)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({"python": sys.version, "baselineWallMs": baseline["wallMs"], "repeats": options.repeats, "results": results}, f, indent=1)
+
+if __name__ == "__main__":
+    main()
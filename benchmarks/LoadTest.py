@@ -0,0 +1,125 @@
+import os #Used to find the repository folder
+import sys #Used to import the modules from the repository folder
+import json #Responses are json, results can be written as json
+import time #Latency and throughput
+import random #Random targets and settings
+import asyncio #Concurrent clients
+import argparse #Command line options
+import numpy as np #Percentiles
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import LoadData
+
+#Load test of RecommendService
+#Runs a number of concurrent keep alive clients against a running service for a fixed time and reports the latency percentiles
+#and requests per second, per endpoint and overall. The targets are drawn from a small hot set most of the time, so the result cache
+#gets hits like under real traffic, and a share of the requests can be rating events.
+
+def _targets(path):
+    '''User and movie IDs of the dataset'''
+    matrix = LoadData.loadRatingMatrix(path, useCache=True)
+    return ([str(ID) for ID in matrix.getUserIDs().tolist()], [str(ID) for ID in matrix.getMovieIDs().tolist()])
+
+def _request(rng, users, movies, hotUsers, hotMovies, hotShare, rateShare, simFunction, mode):
+    '''Pick a random request, returns (endpoint name, method, path, body). simFunction -1 / mode "mixed" pick random settings per request'''
+    roll = rng.random()
+    user = rng.choice(hotUsers if rng.random() < hotShare else users)
+    if roll < rateShare:
+        body = json.dumps({"user": user, "movie": rng.choice(movies), "rating": rng.randint(1, 5)}).encode()
+        return ("ratings", "POST", "/ratings", body)
+    simFunction = rng.randint(0, 4) if simFunction < 0 else simFunction
+    mode = rng.choice(("genre", "watchers")) if mode == "mixed" else mode
+    settings = "&simFunction=" + str(simFunction) + "&mode=" + mode + "&amount=10"
+    if roll < rateShare + (1 - rateShare) / 2:
+        movie = rng.choice(hotMovies if rng.random() < hotShare else movies)
+        return ("similarMovies", "GET", "/similarMovies?movie=" + movie + settings, b"")
+    if roll < rateShare + (1 - rateShare) * 0.9:
+        return ("recommendMovies", "GET", "/recommendMovies?user=" + user + settings, b"")
+    return ("customSimilarity", "GET", "/customSimilarity?user=" + user + "&amount=10", b"")
+
+async def _client(host, port, deadline, rng, targets, latencies, errors):
+    '''One keep alive connection that sends requests until the deadline'''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            name, method, path, body = _request(rng, *targets)
+            start = time.perf_counter()
+            writer.write((method + " " + path + " HTTP/1.1\r\nHost: " + host + "\r\nContent-Length: " + str(len(body)) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b""):
+                    break
+                if header.lower().startswith(b"content-length:"):
+                    length = int(header.split(b":")[1])
+            payload = json.loads(await reader.readexactly(length))
+            latencies.setdefault(name, list()).append(time.perf_counter() - start)
+            if status != 200:
+                errors.append((name, status, payload.get("error")))
+    finally:
+        writer.close()
+
+async def loadTest(host = "127.0.0.1", port = 8080, clients = 16, seconds = 10, hotShare = 0.8, hotSize = 50, rateShare = 0.0, seed = 0, path = LoadData.DATA_DIR,
+                   simFunction = 0, mode = "genre"):
+    '''Run the load test, returns a dict with the results per endpoint and overall'''
+    users, movies = _targets(path)
+    rng = random.Random(seed)
+    targets = (users, movies, rng.sample(users, min(hotSize, len(users))), rng.sample(movies, min(hotSize, len(movies))), hotShare, rateShare, simFunction, mode)
+    latencies = dict()
+    errors = list()
+    start = time.perf_counter()
+    deadline = start + seconds
+    await asyncio.gather(*(_client(host, port, deadline, random.Random(seed + 1 + i), targets, latencies, errors) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    results = {"clients": clients, "seconds": elapsed, "errors": len(errors), "endpoints": dict()}
+    everything = list()
+    for name, times in sorted(latencies.items()):
+        everything += times
+        results["endpoints"][name] = _summary(times, elapsed)
+    results["overall"] = _summary(everything, elapsed)
+    return results
+
+def _summary(times, elapsed):
+    '''Request count, requests per second and latency percentiles in milliseconds'''
+    ms = np.array(times) * 1000
+    if len(ms) == 0:
+        return {"requests": 0}
+    return {"requests": len(ms), "requestsPerSecond": len(ms) / elapsed, "meanMs": float(ms.mean()), "p50Ms": float(np.percentile(ms, 50)),
+            "p99Ms": float(np.percentile(ms, 99)), "maxMs": float(ms.max())}
+
+def report(results):
+    '''Print the results as a table'''
+    print(str(results["clients"]) + " clients, " + format(results["seconds"], ".1f") + "s, " + str(results["errors"]) + " errors")
+    print("endpoint".ljust(18) + "requests".rjust(10) + "req/s".rjust(10) + "p50 ms".rjust(10) + "p99 ms".rjust(10) + "max ms".rjust(10))
+    for name, summary in list(results["endpoints"].items()) + [("overall", results["overall"])]:
+        if summary["requests"] == 0:
+            continue
+        print(name.ljust(18) + str(summary["requests"]).rjust(10) + format(summary["requestsPerSecond"], ".1f").rjust(10)
+              + format(summary["p50Ms"], ".2f").rjust(10) + format(summary["p99Ms"], ".2f").rjust(10) + format(summary["maxMs"], ".2f").rjust(10))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running RecommendService")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--clients", type=int, default=16, help="concurrent connections")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of the test")
+    parser.add_argument("--hot-share", type=float, default=0.8, help="share of requests for the hot targets")
+    parser.add_argument("--hot-size", type=int, default=50, help="amount of hot users and movies")
+    parser.add_argument("--rate-share", type=float, default=0.0, help="share of requests that are rating events")
+    parser.add_argument("--sim-function", type=int, default=0, help="simFunction of the requests, -1 for a random one per request")
+    parser.add_argument("--mode", default="genre", choices=("genre", "watchers", "mixed"), help="mode of the requests")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data", default=LoadData.DATA_DIR, help="folder with u.item and u.data, to draw the targets from")
+    parser.add_argument("--output", default=None, help="also write the results to this json file")
+    args = parser.parse_args()
+    results = asyncio.run(loadTest(args.host, args.port, args.clients, args.seconds, args.hot_share, args.hot_size, args.rate_share, args.seed, args.data,
+                                   args.sim_function, args.mode))
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import os #Used to find the repository folder
+import sys #Used to import the modules from the repository folder
+import gc #Collect garbage before measuring
+import tracemalloc #Measures the allocated memory
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import LoadData
+
+#Memory benchmark of the user rating representation
+#Compares the bytes per rating of the array backed users (positions into the shared movie list and uint8 ratings)
+#with the previous layout, where every rating was its own Movie object.
+
+def measure(build):
+    '''Run build() and return (result, bytes still allocated by it)'''
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (result, allocated)
+
+def movieObjectPerRating(userList):
+    '''Build the previous layout, a list with one new Movie object per rating for every user'''
+    result = list()
+    for user in userList:
+        result.append([LoadData.Movie(m.getID(), m.getName(), m.getYear(), m.getGenreVector(), m.getRating()) for m in user.getWatchedMovies()])
+    return result
+
+def main(path = LoadData.DATA_DIR):
+    movieList = LoadData.loadMovies(path)
+    ratingMatrix = LoadData.loadRatingMatrix(path)
+    ratingCount = ratingMatrix.getCSR().nnz
+
+    userList, compactBytes = measure(lambda: ratingMatrix.toUserList(movieList)) #Users as it is loaded now
+    objects, objectBytes = measure(lambda: movieObjectPerRating(userList)) #One Movie per rating
+
+    print("Ratings:", ratingCount)
+    print("One Movie object per rating: " + str(objectBytes) + " bytes, " + format(objectBytes / ratingCount, ".1f") + " bytes per rating")
+    print("Array backed users:          " + str(compactBytes) + " bytes, " + format(compactBytes / ratingCount, ".1f") + " bytes per rating")
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else LoadData.DATA_DIR)
@@ -0,0 +1,226 @@
+import os #Used for the dataset and result paths
+import sys #Used to import the modules from the repository folder
+import io #Silences the loading messages
+import gc #Collect garbage between the runs
+import json #Results are stored as json
+import time #Timing
+import random #Picks the targets of the recommendation benchmarks
+import argparse #Command line options
+import platform #Machine information for the results
+import contextlib #Used to silence the loading messages
+import subprocess #Used to read the current git commit
+import tracemalloc #Measures the peak memory
+import numpy as np #Synthetic datasets
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+import LoadData
+import Similarity
+
+#Repeatable benchmark suite
+#Times the loaders and every recommendation path for all simFunction values and both comparison modes,
+#on the bundled movies/ dataset and on synthetic datasets with 10x and 100x the users, movies and ratings.
+#Every benchmark records the wall time, the peak memory and the calls per second, and the results are stored as json,
+#so two runs can be compared with --compare.
+
+SYNTHETIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data") #Generated datasets are kept here
+RESULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results") #Default folder for the result files
+LEGACY_LOAD_LIMIT = 200000 #loadUsers is quadratic, it is only timed on datasets up to this many ratings
+GENRE_COUNT = len(LoadData.GENRE_NAMES)
+
+def generateDataset(scale, seed = 0):
+    '''Write a synthetic dataset with scale times the users, movies and ratings of ML-100K, returns its folder.
+    Movie popularity and user activity are skewed like in MovieLens, ratings follow the ML-100K rating distribution'''
+    folder = os.path.join(SYNTHETIC_DIR, "scale" + str(scale))
+    if os.path.exists(os.path.join(folder, "u.data")): #Generated before, same seed gives the same data
+        return folder
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    users, movies, ratings = 943 * scale, 1682 * scale, 100000 * scale
+
+    with open(os.path.join(folder, "u.item"), 'w', encoding="latin-1") as f:
+        genres = rng.random((movies, GENRE_COUNT)) < 0.1 #About two genres per movie
+        years = rng.integers(1930, 1999, movies)
+        for i in range(movies):
+            genreText = "|".join(str(int(g)) for g in genres[i])
+            f.write(str(i + 1) + "|Movie " + str(i + 1) + " (" + str(years[i]) + ")|01-Jan-" + str(years[i]) + "||http://example.com|0|" + genreText + "\n")
+
+    userWeights = rng.pareto(1.5, users) + 1 #A few users rate a lot
+    movieWeights = 1 / np.arange(1, movies + 1) ** 0.9 #Zipf like popularity
+    rng.shuffle(movieWeights)
+    userIDs = rng.choice(users, size=int(ratings * 1.3), p=userWeights / userWeights.sum()) + 1
+    movieIDs = rng.choice(movies, size=int(ratings * 1.3), p=movieWeights / movieWeights.sum()) + 1
+    pairs = np.unique(userIDs.astype(np.int64) * (movies + 1) + movieIDs) #One rating per user and movie
+    pairs = rng.permutation(pairs)[:ratings]
+    values = rng.choice(np.arange(1, 6), size=len(pairs), p=[0.06, 0.11, 0.27, 0.34, 0.22])
+    timestamps = rng.integers(874724710, 893286638, len(pairs))
+    data = np.column_stack((pairs // (movies + 1), pairs % (movies + 1), values, timestamps))
+    np.savetxt(os.path.join(folder, "u.data"), data, fmt="%d", delimiter="\t")
+    return folder
+
+def measure(function, setup = None, calls = 1, budget = 30.0, memory = True):
+    '''Call function(setup()) up to "calls" times (stops early once budget seconds are used), then once more with tracemalloc for the peak memory.
+    Returns a dict with the results'''
+    times = list()
+    for i in range(calls):
+        arguments = setup() if setup else None
+        gc.collect()
+        start = time.perf_counter()
+        function(arguments)
+        times.append(time.perf_counter() - start)
+        if sum(times) > budget:
+            break
+    result = {"calls": len(times), "seconds": sum(times), "secondsPerCall": sum(times) / len(times), "bestSeconds": min(times),
+              "callsPerSecond": len(times) / sum(times) if sum(times) > 0 else None}
+    if memory:
+        arguments = setup() if setup else None
+        gc.collect()
+        tracemalloc.start()
+        function(arguments)
+        result["peakMemoryBytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+def loadFresh(path):
+    '''Load all data without printing, returns (userList, movieList, ratingMatrix)'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        ratingMatrix = LoadData.loadRatingMatrix(path)
+        movieList = LoadData.loadMovies(path)
+        userList, movieList = ratingMatrix.toLists(movieList)
+    userList.sort(key = lambda x: int(x.getID()))
+    return (userList, movieList, ratingMatrix)
+
+def quiet(function):
+    '''Wrap function so it doesn't print its progress messages'''
+    def wrapper(arguments):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(arguments)
+    return wrapper
+
+def benchmarkLoading(path, scale, ratingCount, options):
+    '''Benchmarks of the LoadData functions'''
+    results = list()
+    results.append(dict(name="loadMovies", **measure(lambda a: LoadData.loadMovies(path), calls=options.calls, budget=options.budget, memory=options.memory)))
+    results.append(dict(name="loadRatingMatrix", **measure(lambda a: LoadData.loadRatingMatrix(path), calls=options.calls, budget=options.budget, memory=options.memory)))
+    if ratingCount <= LEGACY_LOAD_LIMIT:
+        results.append(dict(name="loadUsers", **measure(quiet(lambda movieList: LoadData.loadUsers(movieList, path)), lambda: LoadData.loadMovies(path),
+                                                        calls=1, budget=options.budget, memory=options.memory)))
+    else:
+        results.append({"name": "loadUsers", "skipped": "more than " + str(LEGACY_LOAD_LIMIT) + " ratings"})
+    ratingMatrix = LoadData.loadRatingMatrix(path)
+    def usersWatchedSetup():
+        movieList = LoadData.loadMovies(path)
+        return (ratingMatrix.toUserList(movieList), movieList)
+    results.append(dict(name="loadUsersWatched", **measure(lambda a: LoadData.loadUsersWatched(a[0], a[1]), usersWatchedSetup,
+                                                           calls=options.calls, budget=options.budget, memory=options.memory)))
+    def averageSetup():
+        userList, movieList = usersWatchedSetup()
+        LoadData.loadUsersWatched(userList, movieList)
+        return movieList
+    results.append(dict(name="generateAverageRatings", **measure(LoadData.generateAverageRatings, averageSetup,
+                                                                 calls=options.calls, budget=options.budget, memory=options.memory)))
+    return results
+
+def benchmarkRecommendations(path, scale, options):
+    '''Benchmarks of similarMovies, recommendMovies and customSimilarity for every simFunction and both modes'''
+    userList, movieList, ratingMatrix = loadFresh(path)
+    rng = random.Random(options.seed)
+    targetUsers = rng.sample(userList, min(options.calls, len(userList)))
+    targetMovies = rng.sample(movieList, min(options.calls, len(movieList)))
+    results = list()
+    for compareMovieGenres in (True, False):
+        for simFunction in range(5):
+            settings = {"simFunction": simFunction, "compareMovieGenres": compareMovieGenres}
+            targets = iter(targetMovies * 2)
+            results.append(dict(name="similarMovies", **settings, **measure(
+                lambda a: Similarity.similarMovies(next(targets), movieList, options.amount, simFunction, compareMovieGenres),
+                calls=len(targetMovies), budget=options.budget, memory=options.memory)))
+            targets = iter(targetUsers * 2)
+            results.append(dict(name="recommendMovies", **settings, **measure(
+                lambda a: Similarity.recommendMovies(next(targets), userList, movieList, options.amount, simFunction, compareMovieGenres, False, ratingMatrix),
+                calls=len(targetUsers), budget=options.budget, memory=options.memory)))
+    targets = iter(targetUsers * 2)
+    results.append(dict(name="customSimilarity", **measure(
+        lambda a: Similarity.customSimilarity(next(targets), userList, movieList, options.amount, False, ratingMatrix),
+        calls=len(targetUsers), budget=options.budget, memory=options.memory)))
+    return results
+
+def gitCommit():
+    '''Return the current git commit of the repository, or None'''
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runAll(options):
+    '''Run every benchmark for every scale and return the result document'''
+    document = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": gitCommit(), "python": platform.python_version(),
+                "numpy": np.__version__, "machine": platform.platform(), "cpus": os.cpu_count(), "options": vars(options), "datasets": list()}
+    for scale in options.scales:
+        path = os.path.join(REPO_DIR, LoadData.DATA_DIR) if scale == 1 else generateDataset(scale, options.seed) #Scale 1 is the bundled dataset
+        ratingCount = LoadData.loadRatingMatrix(path).getCSR().nnz
+        print("Dataset scale " + str(scale) + ": " + str(ratingCount) + " ratings")
+        results = benchmarkLoading(path, scale, ratingCount, options)
+        if not options.loading_only:
+            results += benchmarkRecommendations(path, scale, options)
+        for result in results:
+            print("    " + describe(result))
+        document["datasets"].append({"scale": scale, "path": path, "ratings": ratingCount, "results": results})
+    return document
+
+def describe(result):
+    '''One line summary of a benchmark result'''
+    name = result["name"]
+    if "simFunction" in result:
+        name += "[f=" + str(result["simFunction"]) + ", " + ("genre" if result["compareMovieGenres"] else "watchers") + "]"
+    if "skipped" in result:
+        return name.ljust(40) + "skipped: " + result["skipped"]
+    text = name.ljust(40) + format(result["secondsPerCall"] * 1000, "12.3f") + " ms/call " + format(result["callsPerSecond"], "10.2f") + " calls/s"
+    if "peakMemoryBytes" in result:
+        text += format(result["peakMemoryBytes"] / 1e6, "10.2f") + " MB peak"
+    return text
+
+def resultKey(scale, result):
+    '''Key to find the same benchmark in another run'''
+    return (scale, result["name"], result.get("simFunction"), result.get("compareMovieGenres"))
+
+def compare(document, previousPath):
+    '''Print the time and memory ratio of every benchmark against a previous result file'''
+    with open(previousPath, 'r') as f:
+        previous = json.load(f)
+    old = {resultKey(d["scale"], r): r for d in previous["datasets"] for r in d["results"] if not "skipped" in r}
+    print("Compared to " + previousPath + " (commit " + str(previous.get("commit")) + "), ratio new/old:")
+    for dataset in document["datasets"]:
+        for result in dataset["results"]:
+            before = old.get(resultKey(dataset["scale"], result))
+            if before == None or "skipped" in result:
+                continue
+            line = "    scale " + str(dataset["scale"]).ljust(4) + describe(result)[:40] + " time x" + format(result["secondsPerCall"] / before["secondsPerCall"], ".2f")
+            if "peakMemoryBytes" in result and "peakMemoryBytes" in before and before["peakMemoryBytes"] > 0:
+                line += ", memory x" + format(result["peakMemoryBytes"] / before["peakMemoryBytes"], ".2f")
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the loaders and recommendation functions")
+    parser.add_argument("--scales", type=lambda text: [int(x) for x in text.split(",")], default=[1, 10, 100], help="dataset scales, default 1,10,100")
+    parser.add_argument("--calls", type=int, default=5, help="calls per benchmark (different targets for the recommendations)")
+    parser.add_argument("--budget", type=float, default=30.0, help="seconds per benchmark after which no more calls are made")
+    parser.add_argument("--amount", type=int, default=20, help="recommendationAmount")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic data and the targets")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc peak memory run")
+    parser.add_argument("--loading-only", action="store_true", help="only benchmark the loaders")
+    parser.add_argument("--output", default=None, help="result file, default benchmarks/results/benchmark-<time>.json")
+    parser.add_argument("--compare", default=None, help="previous result file to compare against")
+    options = parser.parse_args()
+
+    document = runAll(options)
+    output = options.output or os.path.join(RESULT_DIR, "benchmark-" + time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(document, f, indent=1)
+    print("Results written to " + output)
+    if options.compare:
+        compare(document, options.compare)
+
+if __name__ == "__main__":
+    main()
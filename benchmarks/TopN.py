@@ -0,0 +1,72 @@
+import os #Used to find the repository folder
+import sys #Used to import the modules from the repository folder
+import time #Timing
+import heapq #Heap based selection
+import random #Synthetic scores
+import numpy as np #argpartition over score arrays
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import LoadData
+import Similarity
+
+#Microbenchmark of the top-N selection in the recommendation functions
+#Compares the full sort + slice the functions used before with heapq.nlargest and np.argpartition,
+#and the list comprehension duplicate check with a set, on the ML-100K catalog and on a synthetic catalog 100x larger.
+
+AMOUNT = 20 #Largest amount the GUI asks for
+REPEATS = 20 #Repeats per measurement, the best time is reported
+
+def best(function, repeats = REPEATS):
+    '''Return the best time of some runs of function() in milliseconds'''
+    times = list()
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+def selection(recList):
+    '''Time the ways to select the AMOUNT best (name, score, rating) tuples'''
+    key = lambda x: (x[1], int(x[2]))
+    scores = np.array([x[1] for x in recList])
+    return {"sort + slice": best(lambda: sorted(recList, key=key, reverse=True)[:AMOUNT]),
+            "heapq.nlargest": best(lambda: heapq.nlargest(AMOUNT, recList, key=key)),
+            "argpartition (scores only)": best(lambda: np.argpartition(-scores, AMOUNT)[:AMOUNT])}
+
+def dedup(names, repeats = REPEATS):
+    '''Time the duplicate check of a stream of candidate names'''
+    def listCheck():
+        result = list()
+        for name in names:
+            if len([item for item in result if item[0] == name]) == 0:
+                result.append((name, 0, 0))
+    def setCheck():
+        result = list()
+        seen = set()
+        for name in names:
+            if not name in seen:
+                seen.add(name)
+                result.append((name, 0, 0))
+    return {"list comprehension": best(listCheck, repeats), "set": best(setCheck, repeats)}
+
+def report(title, results):
+    print(title)
+    for name, ms in results.items():
+        print("    " + name.ljust(30) + format(ms, "10.3f") + " ms")
+
+def main():
+    random.seed(0)
+    movieList = LoadData.loadMovies()
+    target = movieList[0]
+    realList = [(movie.getName(), Similarity.compareMoviesByGenre(target, movie, 0), random.uniform(1, 5)) for movie in movieList[1:]] #similarMovies list for movie 1
+    syntheticList = [("Movie " + str(i), random.random(), random.uniform(1, 5)) for i in range(len(movieList) * 100)] #100x catalog
+
+    report("Top-" + str(AMOUNT) + " of " + str(len(realList)) + " movies (ML-100K):", selection(realList))
+    report("Top-" + str(AMOUNT) + " of " + str(len(syntheticList)) + " movies (synthetic 100x):", selection(syntheticList))
+    candidates = [movie.getName() for movie in movieList] * 2 #Every candidate shows up twice, like movies recommended by several neighbors
+    report("Duplicate check of " + str(len(candidates)) + " candidates (ML-100K):", dedup(candidates))
+    syntheticCandidates = [name for name, score, rating in syntheticList[:5000]] * 2
+    report("Duplicate check of " + str(len(syntheticCandidates)) + " candidates (synthetic):", dedup(syntheticCandidates, 1)) #The list check is quadratic, one run is enough
+
+if __name__ == "__main__":
+    main()